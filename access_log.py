@@ -0,0 +1,253 @@
+"""
+结构化访问日志和错误日志：JSON 格式，经队列由后台线程批量写出
+
+- AccessLogMiddleware 为每个请求生成 request_id（或沿用 X-Request-ID 请求头），记录路由、状态码、
+  耗时、数据库查询次数和用户 ID
+- 2xx/3xx 请求按 ACCESS_LOG_SAMPLE_RATE 抽样记录；4xx/5xx、异常和慢请求全部记录
+- 请求线程只把日志放进有界队列，格式化和写出在后台线程中批量完成；队列满时丢弃并计数，
+  不会阻塞请求
+- start() 之后 logging 的根 logger 也走同一个队列，logger.exception 等错误日志自动带上 request_id
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler
+
+from sqlalchemy import event
+
+SAMPLE_RATE = float(os.environ.get("ACCESS_LOG_SAMPLE_RATE", "0.1"))
+SLOW_REQUEST_SECONDS = float(os.environ.get("ACCESS_LOG_SLOW_SECONDS", "1.0"))
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+
+access_logger = logging.getLogger("access")
+access_logger.propagate = False
+
+# 当前请求的日志上下文；保存可变字典，线程池中执行的代码修改后中间件也能看到
+_request = contextvars.ContextVar("request_log", default=None)
+
+
+def current() -> dict:
+    return _request.get()
+
+
+def set_user(user_id: int):
+    state = _request.get()
+    if state is not None:
+        state["user_id"] = user_id
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    state = _request.get()
+    if state is not None:
+        state["db_queries"] += 1
+
+
+def install(engine):
+    """
+    统计每个请求执行的 SQL 条数
+    """
+    event.listen(engine, "before_cursor_execute", _count_query)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        else:
+            entry["message"] = record.getMessage()
+            request = getattr(record, "request", None)
+            if request:
+                entry["request_id"] = request["request_id"]
+                entry["user_id"] = request["user_id"]
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    在请求线程中只做最少的工作：带上请求上下文、展开异常栈，然后非阻塞入队
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        state = _request.get()
+        if state is not None and not hasattr(record, "request"):
+            record.request = dict(state)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchWriter:
+    """
+    后台线程：取出队列中已有的全部日志（最多 BATCH_SIZE 条），格式化后一次写出
+    """
+
+    def __init__(self, log_queue, stream, formatter: logging.Formatter):
+        self.queue = log_queue
+        self.stream = stream
+        self.formatter = formatter
+        self._thread = None
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            batch = [record]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            lines = []
+            for record in batch:
+                if record is None:
+                    continue
+                try:
+                    lines.append(self.formatter.format(record) + "\n")
+                except Exception:
+                    pass
+            if lines:
+                try:
+                    self.stream.write("".join(lines))
+                    self.stream.flush()
+                except Exception:
+                    pass
+            if stop:
+                return
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        写完队列中剩余的日志后退出
+        """
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+_queue = queue.Queue(QUEUE_SIZE)
+handler = ContextQueueHandler(_queue)
+writer = None
+
+
+def start(stream=None):
+    """
+    启动后台写日志线程，把访问日志和根 logger 接到队列上
+    """
+    global writer
+    if writer is not None:
+        return
+    path = os.environ.get("ACCESS_LOG_FILE")
+    if stream is None:
+        stream = open(path, "a", encoding="utf-8") if path else sys.stdout
+    writer = BatchWriter(_queue, stream, JsonFormatter())
+    writer.start()
+    access_logger.setLevel(logging.INFO)
+    access_logger.addHandler(handler)
+    root = logging.getLogger()
+    root.addHandler(handler)
+    if root.level > logging.INFO or root.level == logging.NOTSET:
+        root.setLevel(logging.INFO)
+
+
+def stop():
+    global writer
+    if writer is None:
+        return
+    access_logger.removeHandler(handler)
+    logging.getLogger().removeHandler(handler)
+    writer.stop()
+    writer = None
+
+
+def _should_log(status: int, elapsed: float, failed: bool) -> bool:
+    if failed or status >= 400 or elapsed >= SLOW_REQUEST_SECONDS:
+        return True
+    return SAMPLE_RATE >= 1 or random.random() < SAMPLE_RATE
+
+
+class AccessLogMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        state = {"request_id": request_id or uuid.uuid4().hex, "user_id": None, "db_queries": 0}
+        token = _request.set(state)
+        status = 500
+        failed = False
+        start = time.perf_counter()
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", state["request_id"].encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if writer is not None and _should_log(status, elapsed, failed):
+                route = scope.get("route")
+                access_logger.info("request", extra={"fields": {
+                    "request_id": state["request_id"],
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": getattr(route, "path", None),
+                    "status": status,
+                    "latency_ms": round(elapsed * 1000, 2),
+                    "db_queries": state["db_queries"],
+                    "user_id": state["user_id"],
+                    "client": scope["client"][0] if scope.get("client") else None,
+                    "sampled": not (failed or status >= 400 or elapsed >= SLOW_REQUEST_SECONDS),
+                    "sample_rate": SAMPLE_RATE,
+                }})
+            _request.reset(token)
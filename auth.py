@@ -6,6 +6,8 @@ from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 import crud
 import schemas
+import access_log
+import profiler
 from database import get_db
 
 # 秘钥和算法设置
@@ -32,12 +34,13 @@ def hash_password(password: str) -> str:
 
 # 用户身份验证
 def authenticate_user(db: Session, username: str, password: str):
-	user = crud.get_user(db, username)  # 从数据库获取用户信息
-	if not user:
-		return False
-	if not verify_password(password, user.password_hashed):  # 验证密码是否匹配
-		return False
-	return user
+	with profiler.span("auth"):
+		user = crud.get_user(db, username)  # 从数据库获取用户信息
+		if not user:
+			return False
+		if not verify_password(password, user.password_hashed):  # 验证密码是否匹配
+			return False
+		return user
 
 
 # 创建 JWT 访问令牌
@@ -59,14 +62,23 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
 		detail="Could not validate credentials",
 		headers={"WWW-Authenticate": "Bearer"},
 	)
-	try:
-		payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-		username: str = payload.get("sub")
-		if username is None:
+	with profiler.span("auth"):
+		try:
+			payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+			username: str = payload.get("sub")
+			if username is None:
+				raise credentials_exception
+		except JWTError:
 			raise credentials_exception
-	except JWTError:
-		raise credentials_exception
-	user = crud.get_user(db, username=username)
+		user = crud.get_user(db, username=username)
 	if user is None:
 		raise credentials_exception
+	access_log.set_user(user.id)
 	return user
+
+
+# 获取当前管理员（用户名在环境变量 ADMIN_USERNAMES 中，逗号分隔）
+def get_current_admin(current_user=Depends(get_current_user)):
+	if current_user.username not in profiler.admin_usernames():
+		raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="需要管理员权限")
+	return current_user
@@ -0,0 +1,218 @@
+"""
+购物车存储：内存中的写缓冲 + 定期批量落库
+
+加购、改数量、删除只修改内存中的字典并标记为脏，后台每隔 flush_interval 秒把所有脏购物车
+在一个事务中批量写回 carts / cart_items 表，频繁的购物车操作不会各自产生一次 MySQL 事务。
+内存中的购物车按最近使用淘汰（只淘汰已落库的），缺失时从数据库加载。
+落库失败的购物车保持为脏，下次重试，不会在落库前被淘汰。
+
+注意：购物车缓存在进程内，多 worker 部署时需要按用户做粘性路由。
+"""
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+MAX_QUANTITY = 999
+
+
+class CheckoutInProgress(Exception):
+    pass
+
+
+class CartStore:
+    def __init__(self, flush_interval: float = 5.0, max_carts: int = 100000):
+        """
+        :param flush_interval: 批量落库的间隔秒数
+        :param max_carts: 内存中最多缓存的购物车数
+        """
+        self.flush_interval = flush_interval
+        self.max_carts = max_carts
+        self._carts = OrderedDict()  # user_id -> {product_id: quantity}
+        self._dirty = {}  # user_id -> 修改次数，落库成功且期间没有新修改时才移除
+        self._checking_out = set()
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._task = None
+
+    def _load(self, db: Session, user_id: int) -> dict:
+        with self._lock:
+            cart = self._carts.get(user_id)
+            if cart is not None:
+                self._carts.move_to_end(user_id)
+                return cart
+
+        rows = (
+            db.query(models.CartItem.product_id, models.CartItem.quantity)
+            .join(models.Cart, models.Cart.id == models.CartItem.cart_id)
+            .filter(models.Cart.user_id == user_id)
+            .all()
+        )
+        with self._lock:
+            # 加载期间可能已被其他请求放入
+            cart = self._carts.setdefault(user_id, {product_id: quantity for product_id, quantity in rows})
+            self._carts.move_to_end(user_id)
+            self._evict()
+            return cart
+
+    def _mark_dirty(self, user_id: int):
+        self._dirty[user_id] = self._dirty.get(user_id, 0) + 1
+
+    def _evict(self):
+        if len(self._carts) <= self.max_carts:
+            return
+        for user_id in list(self._carts):
+            if len(self._carts) <= self.max_carts:
+                break
+            if user_id not in self._dirty:
+                del self._carts[user_id]
+
+    def items(self, db: Session, user_id: int) -> dict:
+        """
+        返回购物车内容 {product_id: quantity} 的副本
+        """
+        cart = self._load(db, user_id)
+        with self._lock:
+            return dict(cart)
+
+    def add(self, db: Session, user_id: int, product_id: int, quantity: int = 1) -> dict:
+        cart = self._load(db, user_id)
+        with self._lock:
+            cart[product_id] = min(MAX_QUANTITY, cart.get(product_id, 0) + quantity)
+            self._mark_dirty(user_id)
+            return dict(cart)
+
+    def set(self, db: Session, user_id: int, product_id: int, quantity: int) -> dict:
+        """
+        设置商品数量，数量为 0 时移除
+        """
+        cart = self._load(db, user_id)
+        with self._lock:
+            if quantity <= 0:
+                cart.pop(product_id, None)
+            else:
+                cart[product_id] = min(MAX_QUANTITY, quantity)
+            self._mark_dirty(user_id)
+            return dict(cart)
+
+    def remove(self, db: Session, user_id: int, product_id: int) -> dict:
+        return self.set(db, user_id, product_id, 0)
+
+    def clear(self, db: Session, user_id: int, product_ids=None):
+        """
+        清空购物车，或只移除指定的商品（结算后）
+        """
+        cart = self._load(db, user_id)
+        with self._lock:
+            if product_ids is None:
+                cart.clear()
+            else:
+                for product_id in product_ids:
+                    cart.pop(product_id, None)
+            self._mark_dirty(user_id)
+
+    @contextmanager
+    def checking_out(self, user_id: int):
+        """
+        同一用户同时只允许一个结算，重复提交抛出 CheckoutInProgress
+        """
+        with self._lock:
+            if user_id in self._checking_out:
+                raise CheckoutInProgress(user_id)
+            self._checking_out.add(user_id)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._checking_out.discard(user_id)
+
+    def flush(self, db: Session) -> int:
+        """
+        把所有脏购物车在一个事务中写回数据库
+        :return: 写回的购物车数
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                versions = dict(self._dirty)
+                snapshot = {user_id: dict(self._carts.get(user_id, {})) for user_id in versions}
+
+            try:
+                user_ids = list(snapshot)
+                cart_ids = dict(
+                    db.query(models.Cart.user_id, models.Cart.id).filter(models.Cart.user_id.in_(user_ids)).all()
+                )
+                missing = [user_id for user_id in user_ids if user_id not in cart_ids]
+                if missing:
+                    db.add_all([models.Cart(user_id=user_id) for user_id in missing])
+                    db.flush()
+                    cart_ids.update(
+                        db.query(models.Cart.user_id, models.Cart.id).filter(models.Cart.user_id.in_(missing)).all()
+                    )
+
+                # 整个购物车替换：一次 DELETE + 一次批量 INSERT
+                db.query(models.CartItem).filter(
+                    models.CartItem.cart_id.in_(list(cart_ids.values()))
+                ).delete(synchronize_session=False)
+                rows = [
+                    {"cart_id": cart_ids[user_id], "product_id": product_id, "quantity": quantity}
+                    for user_id, cart in snapshot.items()
+                    for product_id, quantity in cart.items()
+                ]
+                if rows:
+                    db.execute(models.CartItem.__table__.insert(), rows)
+                db.commit()
+            except Exception:
+                db.rollback()  # 购物车仍然是脏的，下次重试
+                raise
+            with self._lock:
+                for user_id, version in versions.items():
+                    # 落库期间又被修改的购物车保持为脏
+                    if self._dirty.get(user_id) == version:
+                        del self._dirty[user_id]
+            return len(snapshot)
+
+    async def _run(self, session_factory):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await loop.run_in_executor(None, self._flush_with, session_factory)
+            except Exception:
+                logger.exception("购物车批量落库失败，稍后重试")
+
+    def _flush_with(self, session_factory):
+        db = session_factory()
+        try:
+            return self.flush(db)
+        finally:
+            db.close()
+
+    def start(self, session_factory):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(session_factory))
+
+    async def stop(self, session_factory):
+        """
+        停止定时落库，并把剩余的修改写回数据库
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(None, self._flush_with, session_factory)
+
+
+# 全局购物车存储
+store = CartStore()
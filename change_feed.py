@@ -0,0 +1,193 @@
+"""
+商品目录变更记录（change_log）：供客户端增量同步本地缓存
+
+- install() 在 sessionmaker 上注册 after_flush 钩子，商品、图片、分类、评论的新增、修改、删除
+  随同一个事务写入 change_log，提交后才可见
+- change_log.id 自增，作为同步游标；get_changes 返回游标之后的变化，同一实体只返回最新状态
+- 自增 ID 的分配顺序与事务提交顺序不一定一致：ID 较小的事务可能晚提交。因此只返回
+  SETTLE_SECONDS 秒之前写入的记录，并在遇到第一条未沉淀的记录处截断，客户端下次从这里继续。
+  写入事务的时长不能超过这个窗口
+- 上线前已有的数据可以通过 `python change_feed.py seed` 生成初始记录
+"""
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import image_store
+import migrations
+import models
+
+SETTLE_SECONDS = 5
+MAX_LIMIT = 1000
+
+ENTITIES = {
+    models.Product: "product",
+    models.ProductImage: "image",
+    models.Category: "category",
+    models.Review: "review",
+}
+MODELS = {name: model for model, name in ENTITIES.items()}
+
+
+def _after_flush(session, flush_context):
+    now = datetime.utcnow()
+    rows = []
+    for obj in session.new:
+        entity = ENTITIES.get(type(obj))
+        if entity is not None:
+            rows.append({"entity": entity, "entity_id": obj.id, "op": "upsert", "changed_at": now})
+    for obj in session.dirty:
+        entity = ENTITIES.get(type(obj))
+        if entity is not None and session.is_modified(obj, include_collections=False):
+            rows.append({"entity": entity, "entity_id": obj.id, "op": "upsert", "changed_at": now})
+    for obj in session.deleted:
+        entity = ENTITIES.get(type(obj))
+        if entity is not None:
+            rows.append({"entity": entity, "entity_id": obj.id, "op": "delete", "changed_at": now})
+    if rows:
+        # 一次 flush 的全部变更用一条批量 INSERT 写入
+        session.connection().execute(models.ChangeLog.__table__.insert(), rows)
+
+
+def install(session_factory):
+    """
+    之后由 session_factory 创建的 Session 在 flush 时自动记录目录变更
+    """
+    event.listen(session_factory, "after_flush", _after_flush)
+
+
+def _serialize(entity: str, obj) -> dict:
+    if entity == "product":
+        return {
+            "id": obj.id,
+            "name": obj.name,
+            "description": obj.description,
+            "price": float(obj.price),
+            "stock": obj.stock,
+            "seller_id": obj.seller_id,
+            "category_id": obj.category_id,
+            "updated_at": obj.updated_at,
+        }
+    if entity == "image":
+        return {
+            "id": obj.id,
+            "product_id": obj.product_id,
+            "image_url": obj.image_url,
+            "thumbnail_url": image_store.thumbnail_url(obj.image_url),
+            "updated_at": obj.updated_at,
+        }
+    if entity == "category":
+        return {"id": obj.id, "name": obj.name, "updated_at": obj.updated_at}
+    return {
+        "id": obj.id,
+        "product_id": obj.product_id,
+        "user_id": obj.user_id,
+        "rating": obj.rating,
+        "review": obj.review,
+        "created_at": obj.created_at,
+        "updated_at": obj.updated_at,
+    }
+
+
+def get_changes(db: Session, since: int = 0, limit: int = 500, settle_seconds: int = None) -> dict:
+    """
+    返回游标 since 之后已沉淀的目录变化
+    :return: {"cursor": 下次请求使用的游标, "has_more": 是否还有更多, "changes": [...]}
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    entries = (
+        db.query(models.ChangeLog)
+        .filter(models.ChangeLog.id > since)
+        .order_by(models.ChangeLog.id)
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # 遇到第一条尚未沉淀的记录就截断，保证游标之前不会再出现晚提交的记录
+    if settle_seconds is None:
+        settle_seconds = SETTLE_SECONDS
+    horizon = datetime.utcnow() - timedelta(seconds=settle_seconds)
+    for index, entry in enumerate(entries):
+        if entry.changed_at > horizon:
+            entries = entries[:index]
+            has_more = False  # 剩下的记录要等沉淀后再取
+            break
+
+    # 同一实体只保留最后一次变化，按该变化的顺序返回
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.entity, entry.entity_id), None)
+        latest[(entry.entity, entry.entity_id)] = entry
+
+    upserts = {}
+    for entity, entity_id in latest:
+        if latest[(entity, entity_id)].op == "upsert":
+            upserts.setdefault(entity, []).append(entity_id)
+    loaded = {}
+    for entity, ids in upserts.items():
+        model = MODELS[entity]
+        loaded[entity] = {obj.id: obj for obj in db.query(model).filter(model.id.in_(ids)).all()}
+
+    changes = []
+    for (entity, entity_id), entry in latest.items():
+        obj = loaded.get(entity, {}).get(entity_id)
+        if obj is None:
+            # 之后已被删除
+            changes.append({"entity": entity, "id": entity_id, "op": "delete", "data": None})
+        else:
+            changes.append({"entity": entity, "id": entity_id, "op": "upsert", "data": _serialize(entity, obj)})
+
+    return {
+        "cursor": entries[-1].id if entries else since,
+        "has_more": has_more,
+        "changes": changes,
+    }
+
+
+def seed(db: Session, chunk_size: int = 1000) -> int:
+    """
+    为已有的目录数据生成初始 upsert 记录，只在 change_log 为空时执行
+    :return: 写入的记录数
+    """
+    if db.query(models.ChangeLog.id).first() is not None:
+        return 0
+    now = datetime.utcnow() - timedelta(seconds=SETTLE_SECONDS)
+    written = 0
+    for model, entity in ENTITIES.items():
+        last_id = 0
+        while True:
+            ids = [
+                row[0] for row in
+                db.query(model.id).filter(model.id > last_id).order_by(model.id).limit(chunk_size).all()
+            ]
+            if not ids:
+                break
+            last_id = ids[-1]
+            db.execute(models.ChangeLog.__table__.insert(), [
+                {"entity": entity, "entity_id": entity_id, "op": "upsert", "changed_at": now} for entity_id in ids
+            ])
+            db.commit()
+            written += len(ids)
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="商品目录变更记录维护工具")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    seed_parser = subparsers.add_parser('seed', help="为已有数据生成初始变更记录")
+    seed_parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    from database import SessionLocal, engine
+
+    migrations.upgrade(engine)
+    session = SessionLocal()
+    try:
+        count = seed(session, chunk_size=args.chunk_size)
+        print(f"已生成 {count} 条初始变更记录")
+    finally:
+        session.close()
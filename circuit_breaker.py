@@ -0,0 +1,303 @@
+"""
+远程数据库熔断：数据库出错或变慢时快速失败，商品目录类读请求返回缓存的旧数据
+
+熔断器挂在 Session 上，统计每次 ORM 查询的耗时和连接类错误：
+- 关闭（closed）：正常访问；时间窗口内错误/慢查询比例过高，或连续失败次数过多时打开
+- 打开（open）：所有查询和写入直接抛出 CircuitOpen（503 + Retry-After），不再等待连接池超时
+- 半开（half_open）：打开 reset_timeout 秒后放行一次试探查询，成功则关闭，失败则重新打开
+启动后台探测后，打开期间会定期用 SELECT 1 探测数据库，恢复后立即关闭，不必等用户请求来试探。
+导出、回填、只有关键字的全表搜索本来就慢，它们的会话（long_running）或语句（execution_options(long_running=True)）
+不计慢查询，只有出错才计入失败。
+
+商品目录的读接口通过 catalog_read 访问数据库，每次成功的结果按请求参数保存一份，
+熔断打开或查询失败时返回保存的旧数据，并带上 Warning / Age 响应头。
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from fastapi import HTTPException
+from sqlalchemy import event, exc, text
+
+import singleflight
+
+logger = logging.getLogger(__name__)
+
+# 视为数据库不可用的错误；IntegrityError 等说明数据库正常应答，不计入失败
+DB_ERRORS = (exc.OperationalError, exc.InterfaceError, exc.TimeoutError, exc.DisconnectionError)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Session.info / execution_options 中的标记：本来就慢的查询，不按耗时计入失败
+LONG_RUNNING = "long_running"
+
+
+class CircuitOpen(HTTPException):
+    def __init__(self, retry_after: int):
+        super().__init__(status_code=503, detail="数据库暂时不可用，请稍后重试",
+                         headers={"Retry-After": str(retry_after)})
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, failure_rate: float = 0.5, min_calls: int = 20,
+                 window_seconds: float = 10.0, slow_call_seconds: float = 2.0, reset_timeout: float = 10.0,
+                 probe_interval: float = 2.0, clock=time.monotonic):
+        """
+        :param failure_threshold: 连续失败（含慢查询）多少次后打开
+        :param failure_rate: 时间窗口内失败比例达到多少时打开
+        :param min_calls: 时间窗口内至少有多少次查询才按比例判断
+        :param window_seconds: 统计时间窗口
+        :param slow_call_seconds: 超过该耗时的查询视为失败
+        :param reset_timeout: 打开多少秒后进入半开状态
+        :param probe_interval: 后台探测的间隔秒数
+        """
+        self.failure_threshold = failure_threshold
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_timeout = reset_timeout
+        self.probe_interval = probe_interval
+        self.clock = clock
+
+        self.state = CLOSED
+        self._outcomes = deque()  # (时间, 是否失败)
+        self._bad = 0
+        self._consecutive = 0
+        self._retry_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+        self._task = None
+        self._counters = {"calls": 0, "failures": 0, "slow_calls": 0, "rejected": 0, "trips": 0}
+
+    def _trip(self, now: float):
+        if self.state != OPEN:
+            self._counters["trips"] += 1
+            logger.warning("数据库熔断打开，%s 秒后重试", self.reset_timeout)
+        self.state = OPEN
+        self._retry_at = now + self.reset_timeout
+        self._trial = False
+
+    def _close(self):
+        if self.state != CLOSED:
+            logger.warning("数据库恢复，熔断关闭")
+        self.state = CLOSED
+        self._outcomes.clear()
+        self._bad = 0
+        self._consecutive = 0
+        self._trial = False
+
+    def before_call(self):
+        """
+        查询前调用：熔断打开时抛出 CircuitOpen，到达重试时间后放行一次试探
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = self.clock()
+            if self.state == OPEN and now >= self._retry_at and not self._trial:
+                self.state = HALF_OPEN
+                self._trial = True
+                return
+            self._counters["rejected"] += 1
+            raise CircuitOpen(max(1, math.ceil(self._retry_at - now)))
+
+    def check_write(self):
+        """
+        写入前调用：只要没有关闭就直接拒绝，试探机会留给读请求
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            self._counters["rejected"] += 1
+            raise CircuitOpen(max(1, math.ceil(self._retry_at - self.clock())))
+
+    def record(self, elapsed: float, error: bool = False, long_running: bool = False):
+        """
+        记录一次查询的结果
+        :param elapsed: 耗时秒数
+        :param error: 是否为数据库不可用类错误
+        :param long_running: 本来就慢的查询，不按耗时判断
+        """
+        slow = not long_running and elapsed >= self.slow_call_seconds
+        bad = error or slow
+        with self._lock:
+            now = self.clock()
+            self._counters["calls"] += 1
+            self._counters["failures"] += error
+            self._counters["slow_calls"] += slow and not error
+            if self.state == HALF_OPEN:
+                if bad:
+                    self._trip(now)
+                else:
+                    self._close()
+                return
+            if self.state == OPEN:
+                return  # 打开之前就已发出的查询
+
+            self._outcomes.append((now, bad))
+            self._bad += bad
+            while self._outcomes and self._outcomes[0][0] <= now - self.window_seconds:
+                self._bad -= self._outcomes.popleft()[1]
+            self._consecutive = self._consecutive + 1 if bad else 0
+            if self._consecutive >= self.failure_threshold or (
+                    len(self._outcomes) >= self.min_calls and self._bad / len(self._outcomes) >= self.failure_rate):
+                self._trip(now)
+
+    def _on_execute(self, orm_execute_state):
+        self.before_call()
+        long_running = bool(orm_execute_state.execution_options.get(LONG_RUNNING)
+                            or orm_execute_state.session.info.get(LONG_RUNNING))
+        start = self.clock()
+        try:
+            result = orm_execute_state.invoke_statement()
+        except DB_ERRORS:
+            self.record(self.clock() - start, error=True)
+            raise
+        except Exception:
+            self.record(self.clock() - start, long_running=long_running)
+            raise
+        self.record(self.clock() - start, long_running=long_running)
+        return result
+
+    def _on_flush(self, session, flush_context, instances):
+        self.check_write()
+
+    def install(self, session_factory):
+        """
+        在 sessionmaker 上注册钩子，之后由它创建的 Session 的查询和写入都经过熔断器
+        """
+        event.listen(session_factory, "do_orm_execute", self._on_execute)
+        event.listen(session_factory, "before_flush", self._on_flush)
+
+    def probe(self, engine) -> bool:
+        """
+        直接用 engine 执行 SELECT 1（不经过 Session 钩子），根据结果关闭或保持打开
+        """
+        start = self.clock()
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except DB_ERRORS:
+            with self._lock:
+                self._trip(self.clock())
+            return False
+        with self._lock:
+            if self.clock() - start < self.slow_call_seconds:
+                self._close()
+                return True
+            self._trip(self.clock())
+            return False
+
+    async def _run(self, engine):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            if self.state == CLOSED:
+                continue
+            try:
+                await loop.run_in_executor(None, self.probe, engine)
+            except Exception:
+                logger.exception("数据库探测失败")
+
+    def start_probe(self, engine):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(engine))
+
+    async def stop_probe(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = self.clock()
+            return {
+                "state": self.state,
+                "retry_after": max(0, math.ceil(self._retry_at - now)) if self.state != CLOSED else 0,
+                "window_calls": len(self._outcomes),
+                "window_failures": self._bad,
+                **self._counters,
+            }
+
+
+def long_running(session):
+    """
+    标记整个会话的查询都不计慢查询，例如导出和回填
+    """
+    session.info[LONG_RUNNING] = True
+    return session
+
+
+class StaleCache:
+    def __init__(self, max_entries: int = 5000, max_age: float = 3600, clock=time.monotonic):
+        """
+        :param max_entries: 最多保存的结果数，超出时淘汰最久未更新的
+        :param max_age: 旧数据最多保存多少秒
+        """
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (保存时间, 结果)
+        self._lock = threading.Lock()
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        """
+        :return: (结果, 已保存秒数)，没有或已过期时返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            age = self.clock() - entry[0]
+            if age > self.max_age:
+                del self._entries[key]
+                return None
+            return entry[1], age
+
+
+async def catalog_read(key, fn, *args, response=None, cache: StaleCache = None):
+    """
+    商品目录读请求：正常时合并并发的相同查询并保存结果；数据库不可用时返回保存的旧数据
+    :param key: 包含接口名和全部查询参数的键
+    :param fn: 返回可直接序列化的 dict / list；结果最长保存 max_age 秒，不要返回 ORM 对象
+    :param response: 传入时，返回旧数据会设置 Warning 和 Age 响应头
+    """
+    cache = cache or stale
+    try:
+        value = await singleflight.group.do(key, fn, *args)
+    except (CircuitOpen,) + DB_ERRORS as e:
+        cached = cache.get(key)
+        if cached is None:
+            if isinstance(e, CircuitOpen):
+                raise
+            raise CircuitOpen(max(1, math.ceil(breaker.reset_timeout)))
+        value, age = cached
+        if response is not None:
+            response.headers["Warning"] = '110 - "Response is Stale"'
+            response.headers["Age"] = str(int(age))
+        return value
+    cache.put(key, value)
+    return value
+
+
+# 全局熔断器和旧数据缓存
+breaker = CircuitBreaker()
+stale = StaleCache()
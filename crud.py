@@ -1,11 +1,16 @@
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session, joinedload, selectinload
 from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException
 from datetime import datetime
 import models
 import random
 import schemas
-from sqlalchemy import or_, func
+import tasks
+import image_store
+import order_archive
+import result_cache
+import circuit_breaker
+from sqlalchemy import or_, func, case
 
 
 # 用户相关操作
@@ -58,6 +63,12 @@ def create_product(db: Session, product: schemas.ProductCreate):
 		db.add(db_image)
 
 	db.commit()
+
+	# 新商品出现在该分类、该卖家的列表和搜索结果中
+	result_cache.product_created(db_product.category_id, db_product.seller_id)
+
+	# 提交后在后台更新搜索联想索引
+	tasks.enqueue_product_created(db_product.id, db_product.name)
 	return db_product
 
 
@@ -125,11 +136,13 @@ def add_product_image(db: Session, product_id: int, image_url: str):
 	db.add(db_image)
 	db.commit()
 	db.refresh(db_image)
+	result_cache.cards.invalidate([product_id])
 	return db_image
 
 
 def create_order(db: Session, order_data: schemas.OrderCreate, buyer_id: int):
 	total_amount = 0
+	sold_out = []
 
 	# 获取订单中的产品信息
 	for item in order_data.products:
@@ -143,6 +156,8 @@ def create_order(db: Session, order_data: schemas.OrderCreate, buyer_id: int):
 
 		total_amount += float(product.price) * item.quantity
 		product.stock -= item.quantity  # 更新库存
+		if product.stock == 0:
+			sold_out.append(product)
 
 	# 创建新订单
 	new_order = models.Order(
@@ -160,6 +175,8 @@ def create_order(db: Session, order_data: schemas.OrderCreate, buyer_id: int):
 	db.flush()  # 提前获取 new_order 的 ID
 
 	# 记录已售出的产品
+	sold_at = datetime.utcnow()
+	sold_items = []
 	for item in order_data.products:
 		product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
 		sold_product = models.SoldProduct(
@@ -167,14 +184,25 @@ def create_order(db: Session, order_data: schemas.OrderCreate, buyer_id: int):
 			buyer_id = buyer_id,
 			product_id=item.product_id,
 			order_id=new_order.id,
-			sold_date=datetime.utcnow(),
-			quantity=item.quantity
+			sold_date=sold_at,
+			quantity=item.quantity,
+			unit_price=product.price
 		)
 		db.add(sold_product)
+		sold_items.append((product.seller_id, product.id, product.category_id, item.quantity, product.price))
 
 	db.commit()
 	db.refresh(new_order)
 
+	# 库存已变化，刷新缓存的商品信息；售罄的商品不再出现在只看有货的结果中
+	result_cache.stock_changed(
+		[product_id for _, product_id, _, _, _ in sold_items],
+		{product.category_id for product in sold_out},
+	)
+
+	# 提交后在后台更新销售汇总、推荐索引、热门排行和联想权重
+	tasks.enqueue_order_created(new_order.id, sold_at, sold_items)
+
 	return new_order
 
 
@@ -184,57 +212,33 @@ def get_order_details(db: Session, order_id: int):
     """
 	order = db.query(models.Order).filter(models.Order.id == order_id).first()
 	if not order:
-		raise HTTPException(status_code=404, detail=f"订单 ID {order_id} 未找到")
+		# 较早的订单可能已经归档
+		archived = order_archive.get_archived_order_details(db, order_id)
+		if archived is None:
+			raise HTTPException(status_code=404, detail=f"订单 ID {order_id} 未找到")
+		return archived
 
 	# 获取订单中的已售出产品
 	sold_products = db.query(models.SoldProduct).filter(models.SoldProduct.order_id == order_id).all()
 
 	# 构造返回的订单详情
-	return {
-		"id": order.id,
-		"buyer_id": order.buyer_id,
-		"order_date": order.order_date,
-		"status": order.status,
-		"total_amount": order.total_amount,
-		"recipient_name": order.recipient_name,
-		"phone": order.phone,
-		"address_line1": order.address_line1,
-		"address_line2": order.address_line2,
-		"products": [
-			{
-
-				"product_id": sold.product_id,
-				"quantity": sold.quantity,
-				"sold_date": sold.sold_date,
-				"seller_id": sold.seller_id,
-			}
-			for sold in sold_products
-		]
-	}
+	return order_archive.order_details(order, sold_products)
 
 
 def get_products_by_seller(db: Session, seller_id: int):
 	"""
     获取卖家发布的商品列表及对应的图片URL
     """
-	products = db.query(models.Product).filter(models.Product.seller_id == seller_id).all()
+	key = ("seller", seller_id)
+	product_ids = result_cache.lists.get(key)
+	if product_ids is None:
+		product_ids = result_cache.lists.put(key, [
+			row[0] for row in
+			db.query(models.Product.id).filter(models.Product.seller_id == seller_id).order_by(models.Product.id)
+		], result_cache.TTLS["seller"], tags=[f"seller:{seller_id}"])
 
 	# 返回商品的详细信息，包括每件商品的图片URL
-	result = []
-	for product in products:
-		product_data = {
-			"id": product.id,
-			"name": product.name,
-			"description": product.description,
-			"price": product.price,
-			"stock": product.stock,
-			"seller_id": product.seller_id,
-			"category_id": product.category_id,
-			"image_urls": [image.image_url for image in product.images]  # 获取商品的所有图片URL
-		}
-		result.append(product_data)
-
-	return result
+	return _cards_for_ids(db, product_ids)
 
 
 def update_order_status(db: Session, order_id: int, new_status: str):
@@ -250,14 +254,99 @@ def update_order_status(db: Session, order_id: int, new_status: str):
 	if not order:
 		raise HTTPException(status_code=404, detail=f"订单 ID {order_id} 不存在")
 
+	changed = order.status != new_status
+
 	# 更新状态
 	order.status = new_status
 	db.commit()
 	db.refresh(order)
 
+	# 提交后在后台推送状态变化，取消订单时扣减卖家销售汇总
+	if changed:
+		tasks.enqueue_order_status_changed([order_id], new_status)
+
 	return order
 
 
+# 允许的订单状态流转：pending → shipped → completed，pending → canceled
+ORDER_STATUS_TRANSITIONS = {
+	'pending': {'shipped', 'canceled'},
+	'shipped': {'completed'},
+}
+
+
+def batch_update_order_status(db: Session, items: list, seller_id: int):
+	"""
+    批量更新订单状态（卖家发货、完成等）
+    :param db: 数据库会话
+    :param items: OrderStatusBatchItem 列表
+    :param seller_id: 当前卖家 ID，只能修改包含自己商品的订单
+    :return: 每个订单的处理结果列表，顺序与请求一致
+    """
+	targets = {}
+	results = {}
+	duplicates = set()  # 同一订单重复出现时，只处理第一次，之后的位置直接拒绝
+	for position, item in enumerate(items):
+		if item.order_id in targets:
+			duplicates.add(position)
+			continue
+		targets[item.order_id] = getattr(item.status, 'value', item.status)
+
+	order_ids = list(targets)
+
+	# 一次查询取出所有订单当前状态，并加锁防止并发修改
+	current = dict(
+		db.query(models.Order.id, models.Order.status)
+		.filter(models.Order.id.in_(order_ids))
+		.with_for_update()
+		.all()
+	)
+	# 一次查询找出当前卖家确实售出商品的订单
+	owned = {
+		row[0] for row in db.query(models.SoldProduct.order_id)
+		.filter(models.SoldProduct.order_id.in_(order_ids), models.SoldProduct.seller_id == seller_id)
+		.distinct()
+		.all()
+	}
+
+	# 按目标状态分组，每组只执行一次 UPDATE
+	groups = {}
+	for order_id in order_ids:
+		new_status = targets[order_id]
+		old_status = current.get(order_id)
+		if old_status is None:
+			results[order_id] = {"order_id": order_id, "success": False, "detail": f"订单 ID {order_id} 不存在"}
+		elif order_id not in owned:
+			results[order_id] = {"order_id": order_id, "success": False, "status": old_status,
+			                     "detail": "无权修改该订单"}
+		elif new_status not in ORDER_STATUS_TRANSITIONS.get(old_status, ()):
+			results[order_id] = {"order_id": order_id, "success": False, "status": old_status,
+			                     "detail": f"不允许从 {old_status} 变更为 {new_status}"}
+		else:
+			groups.setdefault(new_status, []).append(order_id)
+
+	for new_status, ids in groups.items():
+		sources = [s for s, allowed in ORDER_STATUS_TRANSITIONS.items() if new_status in allowed]
+		db.query(models.Order).filter(
+			models.Order.id.in_(ids),
+			models.Order.status.in_(sources)
+		).update({models.Order.status: new_status}, synchronize_session=False)
+		for order_id in ids:
+			results[order_id] = {"order_id": order_id, "success": True, "status": new_status}
+
+	db.commit()
+
+	# 提交后在后台推送状态变化，取消订单时扣减卖家销售汇总
+	for new_status, ids in groups.items():
+		tasks.enqueue_order_status_changed(ids, new_status)
+
+	return [
+		{"order_id": item.order_id, "success": False, "detail": "订单重复提交"} if position in duplicates
+		else results[item.order_id]
+		for position, item in enumerate(items)
+	]
+
+
 def get_user_orders(db: Session, user_id: int):
 	"""
     获取用户作为买家和卖家的订单号
@@ -271,10 +360,13 @@ def get_user_orders(db: Session, user_id: int):
 	seller_orders = db.query(models.SoldProduct.order_id).filter(models.SoldProduct.seller_id == user_id).distinct().all()
 	# seller_orders = db.query(models.Order.id).filter(models.Order.seller_id == user_id).all()
 
+	# 包括已归档的历史订单
+	archived_buyer_orders, archived_seller_orders = order_archive.get_archived_order_ids(db, user_id)
+
 	# 将结果整理为简单的列表格式
 	result = {
-		"buyer_orders": [order.id for order in buyer_orders],
-	    "seller_orders": [order[0] for order in seller_orders]
+		"buyer_orders": archived_buyer_orders + [order.id for order in buyer_orders],
+	    "seller_orders": archived_seller_orders + [order[0] for order in seller_orders]
 	}
 	return result
 
@@ -318,35 +410,21 @@ def get_random_products_by_category(db: Session, category_id: int, limit: int =
 	"""
     随机获取某分类下的商品以及多个图片信息
     """
-	# 查询该分类下的商品，并预加载商品图片信息
-	products_query = db.query(models.Product).filter(models.Product.category_id == category_id).options(
-		joinedload(models.Product.images)
-	)
-
-	# 获取商品总数
-	total_products = products_query.count()
-	if total_products == 0:
+	# 缓存该分类下的商品 ID 池，每次请求从池中随机抽取，不必每次在数据库中随机排序
+	key = ("category_pool", category_id)
+	pool = result_cache.lists.get(key)
+	if pool is None:
+		pool = result_cache.lists.put(key, [
+			row[0] for row in
+			db.query(models.Product.id).filter(models.Product.category_id == category_id)
+			.order_by(func.random()).limit(result_cache.CATEGORY_POOL_SIZE)
+		], result_cache.TTLS["category_pool"], tags=[f"category:{category_id}"])
+
+	if not pool:
 		return []  # 如果没有商品，返回空列表
 
-	# 随机选择商品（通过数据库实现随机排序，避免全部加载到内存）
-	random_products = products_query.order_by(func.random()).limit(limit).all()
-
 	# 构造结果数据
-	result = [
-		{
-			"id": product.id,
-			"name": product.name,
-			"description": product.description,
-			"price": float(product.price),
-			"stock": product.stock,
-			"seller_id": product.seller_id,
-			"category_id": product.category_id,
-			"image_urls": [image.image_url for image in product.images],  # 获取图片 URL
-		}
-		for product in random_products
-	]
-
-	return result
+	return _cards_for_ids(db, random.sample(pool, min(max(limit, 0), len(pool))))
 
 
 def get_random_products(db: Session, limit: int = 5):
@@ -365,49 +443,191 @@ def get_random_products(db: Session, limit: int = 5):
 	random_products = products_query.order_by(func.random()).limit(limit).all()
 
 	# 构造结果数据
-	result = [
-		{
-			"id": product.id,
-			"name": product.name,
-			"description": product.description,
-			"price": float(product.price),
-			"stock": product.stock,
-			"seller_id": product.seller_id,
-			"category_id": product.category_id,
-			"image_urls": [image.image_url for image in product.images],  # 获取图片 URL
-		}
-		for product in random_products
-	]
+	return [_product_card(product) for product in random_products]
 
-	return result
+
+# 搜索支持的排序方式
+SEARCH_SORTS = ('relevance', 'price_asc', 'price_desc', 'newest')
+
+# 搜索每页的最大条数和最大偏移量，避免一次请求扫描、返回过多的行
+SEARCH_MAX_LIMIT = 100
+SEARCH_MAX_OFFSET = 1000
+
+# 价格分面的区间边界，最后一个区间没有上限
+PRICE_BUCKETS = (0, 50, 100, 200, 500, 1000)
+
+
+def _product_card(product: models.Product):
+	"""
+    商品列表中使用的商品信息，包括图片 URL
+    """
+	return {
+		"id": product.id,
+		"name": product.name,
+		"description": product.description,
+		"price": float(product.price),
+		"stock": product.stock,
+		"seller_id": product.seller_id,
+		"category_id": product.category_id,
+		"image_urls": [image.image_url for image in product.images],  # 获取图片 URL
+		# 列表中使用的缩略图
+		"thumbnail_url": image_store.thumbnail_url(product.images[0].image_url) if product.images else None,
+	}
+
+
+def get_product_cards_by_ids(db: Session, product_ids):
+	"""
+    一次查询批量获取商品信息（含图片），返回 {product_id: 商品信息}
+    """
+	if not product_ids:
+		return {}
+	products = db.query(models.Product).filter(models.Product.id.in_(list(product_ids))).options(
+		joinedload(models.Product.images)
+	).all()
+	return {product.id: _product_card(product) for product in products}
 
 
-def search_products(db: Session, keyword: str, limit: int = 10):
+def _cards_for_ids(db: Session, product_ids):
 	"""
-    模糊查找商品
+    按 ID 顺序返回商品信息，优先使用缓存，缺失的用一次查询补齐；已删除的商品跳过
     """
-	query = db.query(models.Product).filter(
-		or_(
+	cards, missing = result_cache.cards.get_many(product_ids)
+	if missing:
+		loaded = get_product_cards_by_ids(db, missing)
+		result_cache.cards.put_many(loaded)
+		cards.update(loaded)
+	return [cards[product_id] for product_id in product_ids if product_id in cards]
+
+
+def _search_conditions(keyword: str = None, category_id: int = None, min_price: float = None,
+                       max_price: float = None, in_stock: bool = False):
+	"""
+    把搜索条件转换为过滤表达式，返回 {条件名: 表达式}，方便计算分面时排除某个条件
+    """
+	conditions = {}
+	if keyword:
+		# '%kw%' 前导通配符无法使用索引：有分类/价格条件时先走 ix_products_category_price / ix_products_price，
+		# 关键字在筛出的行上逐行匹配；只有关键字时仍是全表扫描
+		conditions["keyword"] = or_(
 			models.Product.name.ilike(f"%{keyword}%"),  # 商品名称包含关键字
 			models.Product.description.ilike(f"%{keyword}%")  # 商品描述包含关键字
 		)
-	).limit(limit)
+	if category_id is not None:
+		conditions["category"] = models.Product.category_id == category_id
+	price = []
+	if min_price is not None:
+		price.append(models.Product.price >= min_price)
+	if max_price is not None:
+		price.append(models.Product.price <= max_price)
+	if price:
+		conditions["price"] = price
+	if in_stock:
+		conditions["stock"] = models.Product.stock > 0
+	return conditions
+
+
+def _apply_conditions(query, conditions: dict, exclude: str = None):
+	applied = set()
+	for name, condition in conditions.items():
+		if name == exclude:
+			continue
+		applied.add(name)
+		if isinstance(condition, list):
+			query = query.filter(*condition)
+		else:
+			query = query.filter(condition)
+	if "keyword" in applied and not applied & {"category", "price"}:
+		# 只有关键字时是全表扫描，本来就慢，熔断器不按耗时计入失败
+		query = query.execution_options(**{circuit_breaker.LONG_RUNNING: True})
+	return query
+
+
+def search_products(db: Session, keyword: str = None, limit: int = 10, category_id: int = None,
+                    min_price: float = None, max_price: float = None, in_stock: bool = False,
+                    sort: str = 'relevance', offset: int = 0):
+	"""
+    模糊查找商品，可按分类、价格区间、是否有货筛选并排序
+    结果的商品 ID 列表按规范化后的查询条件缓存
+    """
+	keyword = result_cache.normalize_keyword(keyword)
+	key = ("search", keyword, limit, category_id, min_price, max_price, bool(in_stock), sort, offset)
+	product_ids = result_cache.lists.get(key)
+	if product_ids is not None:
+		return _cards_for_ids(db, product_ids)
+
+	conditions = _search_conditions(keyword, category_id, min_price, max_price, in_stock)
+	query = _apply_conditions(db.query(models.Product), conditions)
+
+	if sort == 'price_asc':
+		query = query.order_by(models.Product.price.asc(), models.Product.id)
+	elif sort == 'price_desc':
+		query = query.order_by(models.Product.price.desc(), models.Product.id)
+	elif sort == 'newest':
+		query = query.order_by(models.Product.id.desc())
 
-	products = query.all()
+	# 图片用一次 IN 查询批量加载
+	products = query.options(selectinload(models.Product.images)).offset(offset).limit(limit).all()
 
 	# 构造返回数据，包括商品图片
-	result = []
-	for product in products:
-		product_data = {
-			"id": product.id,
-			"name": product.name,
-			"description": product.description,
-			"price": float(product.price),
-			"stock": product.stock,
-			"seller_id": product.seller_id,
-			"category_id": product.category_id,
-			"image_urls": [image.image_url for image in product.images]  # 获取图片 URL
-		}
-		result.append(product_data)
+	cards = {product.id: _product_card(product) for product in products}
+	result_cache.cards.put_many(cards)
+	result_cache.lists.put(key, list(cards), result_cache.TTLS["search"],
+	                       tags=[f"category:{category_id}" if category_id is not None else "search:all"])
+	return list(cards.values())
 
-	return result
+
+def get_search_facets(db: Session, keyword: str = None, category_id: int = None, min_price: float = None,
+                      max_price: float = None, in_stock: bool = False):
+	"""
+    计算搜索结果的分面统计：每个分类的商品数和每个价格区间的商品数
+    分类分面不受分类条件限制，价格分面不受价格条件限制，便于用户切换筛选
+    统计结果按规范化后的查询条件缓存，和搜索结果使用相同的 TTL
+    """
+	keyword = result_cache.normalize_keyword(keyword)
+	key = ("facets", keyword, category_id, min_price, max_price, bool(in_stock))
+	cached = result_cache.lists.get(key)
+	if cached is not None:
+		category_counts, price_counts = cached[0], dict(cached[1])
+		return _facets_response(category_counts, price_counts)
+
+	conditions = _search_conditions(keyword, category_id, min_price, max_price, in_stock)
+
+	category_counts = _apply_conditions(
+		db.query(models.Product.category_id, models.Category.name, func.count(models.Product.id))
+		.join(models.Category, models.Category.id == models.Product.category_id),
+		conditions, exclude="category"
+	).group_by(models.Product.category_id, models.Category.name).all()
+
+	bucket = case(
+		*[
+			(models.Product.price < upper, index)
+			for index, upper in enumerate(PRICE_BUCKETS[1:])
+		],
+		else_=len(PRICE_BUCKETS) - 1
+	).label("bucket")
+	price_counts = dict(
+		_apply_conditions(db.query(bucket, func.count(models.Product.id)), conditions, exclude="price")
+		.group_by(bucket)
+		.all()
+	)
+	# 分类分面不限分类，任何分类新增商品或售罄都会影响结果
+	result_cache.lists.put(key, (tuple(tuple(row) for row in category_counts), tuple(price_counts.items())),
+	                       result_cache.TTLS["search"], tags=["search:all"])
+	return _facets_response(category_counts, price_counts)
+
+
+def _facets_response(category_counts, price_counts: dict):
+	return {
+		"categories": [
+			{"category_id": cid, "name": name, "count": count}
+			for cid, name, count in sorted(category_counts, key=lambda row: -row[2])
+		],
+		"price_ranges": [
+			{
+				"min_price": lower,
+				"max_price": PRICE_BUCKETS[index + 1] if index + 1 < len(PRICE_BUCKETS) else None,
+				"count": price_counts.get(index, 0),
+			}
+			for index, lower in enumerate(PRICE_BUCKETS)
+		],
+	}
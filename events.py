@@ -0,0 +1,237 @@
+"""
+订单状态推送：进程内发布 / 订阅，支持断线续传
+
+事件由后端（backend）统一编号并保存一段历史，EventHub 从后端读取新事件，按用户分发给
+本进程内的订阅者（每个 SSE 连接一个有界队列）。
+
+- MemoryBackend：单进程使用，事件保存在内存环形缓冲区中
+- FileBackend：多个 worker 共享一个追加写的本地文件作为简易 broker，事件 ID 即该事件
+  在文件中的偏移量，每个 worker 轮询文件末尾读取新事件
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Event:
+    __slots__ = ("id", "type", "data", "audience")
+
+    def __init__(self, event_id: int, event_type: str, data: dict, audience):
+        self.id = event_id
+        self.type = event_type
+        self.data = data
+        self.audience = set(audience)
+
+    def to_sse(self) -> str:
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data, ensure_ascii=False)}\n\n"
+
+
+class MemoryBackend:
+    def __init__(self, history: int = 10000):
+        self._history = deque(maxlen=history)
+        # 以启动时间（毫秒）作为起始 ID，重启后客户端带来的旧 ID 也不会大于新事件的 ID
+        self._next_id = int(time.time() * 1000)
+        self._lock = threading.Lock()
+        self._listeners = []  # (loop, asyncio.Queue)
+
+    def publish(self, event_type: str, data: dict, audience) -> int:
+        with self._lock:
+            event = Event(self._next_id, event_type, data, audience)
+            self._next_id += 1
+            self._history.append(event)
+            listeners = list(self._listeners)
+        for loop, queue in listeners:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+        return event.id
+
+    def replay(self, after_id: int):
+        with self._lock:
+            return [event for event in self._history if event.id > after_id]
+
+    async def listen(self):
+        queue = asyncio.Queue()
+        entry = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._listeners.append(entry)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            with self._lock:
+                self._listeners.remove(entry)
+
+
+class FileBackend:
+    def __init__(self, path: str, poll_interval: float = 0.2):
+        """
+        :param path: 多个 worker 共享的事件文件
+        :param poll_interval: 轮询文件新内容的间隔秒数
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+
+    def publish(self, event_type: str, data: dict, audience) -> int:
+        line = json.dumps({"type": event_type, "data": data, "audience": sorted(audience)}, ensure_ascii=False)
+        with open(self.path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                f.write(line.encode("utf-8") + b"\n")
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        # 偏移量从 0 开始，事件 ID 加 1 保证大于 0
+        return offset + 1
+
+    def _read_from(self, offset: int):
+        events = []
+        if not os.path.exists(self.path):
+            return events, offset
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while True:
+                start = f.tell()
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    # 另一个进程正在写的半行，下次再读
+                    return events, start
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                events.append(Event(start + 1, record["type"], record["data"], record["audience"]))
+
+    def replay(self, after_id: int):
+        if after_id <= 0:
+            return self._read_from(0)[0]
+        # after_id 对应的那一行本身已经收到过，从下一行开始
+        return [event for event in self._read_from(after_id - 1)[0] if event.id > after_id]
+
+    async def listen(self):
+        offset = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        while True:
+            events, offset = await asyncio.get_running_loop().run_in_executor(None, self._read_from, offset)
+            for event in events:
+                yield event
+            await asyncio.sleep(self.poll_interval)
+
+
+class EventHub:
+    def __init__(self, backend):
+        self.backend = backend
+        self._subscribers = {}  # user_id -> set(asyncio.Queue)
+        self._task = None
+
+    def publish(self, event_type: str, data: dict, audience) -> int:
+        """
+        发布事件，可以在任意线程中调用
+        :param audience: 可以收到该事件的用户 ID
+        """
+        return self.backend.publish(event_type, data, audience)
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def replay(self, user_id: int, after_id: int):
+        """
+        返回 after_id 之后、该用户可以收到的历史事件
+        """
+        return [event for event in self.backend.replay(after_id) if user_id in event.audience]
+
+    def _dispatch(self, event: Event):
+        for user_id in event.audience:
+            for queue in list(self._subscribers.get(user_id, ())):
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # 消费太慢的连接：放入 None 通知其断开，客户端带 Last-Event-ID 重连后补齐
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+                    self.unsubscribe(user_id, queue)
+
+    async def _run(self):
+        while True:
+            try:
+                async for event in self.backend.listen():
+                    self._dispatch(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("读取订单事件失败，1 秒后重试")
+                await asyncio.sleep(1)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def stream(self, user_id: int, last_event_id: int = 0, is_disconnected=None):
+        """
+        生成 SSE 文本流：带 last_event_id 重连时先补发之后的事件，再推送新事件，空闲时发送心跳
+        """
+        queue = self.subscribe(user_id)  # 先订阅再补发，避免遗漏中间的事件
+        try:
+            last_sent = last_event_id
+            if last_event_id:
+                for event in self.replay(user_id, last_event_id):
+                    last_sent = event.id
+                    yield event.to_sse()
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        break
+                    yield f": heartbeat {int(time.time())}\n\n"
+                    continue
+                if event is None:
+                    break
+                if event.id <= last_sent:
+                    continue
+                last_sent = event.id
+                yield event.to_sse()
+        finally:
+            self.unsubscribe(user_id, queue)
+
+
+def create_backend(spec: str):
+    """
+    根据配置创建后端：memory 或 file:/path/to/events.log
+    """
+    if spec.startswith("file:"):
+        return FileBackend(spec[len("file:"):])
+    return MemoryBackend()
+
+
+# 全局订单事件中心
+hub = EventHub(create_backend(os.environ.get("ORDER_EVENTS_BACKEND", "memory")))
@@ -0,0 +1,156 @@
+"""
+卖家数据导出：按主键分批读取，逐批写出 NDJSON / CSV
+
+导出使用独立的数据库会话，每批查询 CHUNK_SIZE 行后立即生成输出，内存占用与数据量无关，
+第一批数据查出后客户端就能开始接收。分批用主键范围（keyset）而不是长时间持有的服务端游标，
+客户端下载慢时也不会一直占用远程数据库连接。
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy.orm import selectinload
+
+import circuit_breaker
+import models
+
+CHUNK_SIZE = 1000
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+PRODUCT_FIELDS = ("id", "name", "description", "price", "stock", "category_id", "image_urls")
+ORDER_FIELDS = ("order_id", "order_date", "status", "buyer_id", "recipient_name", "phone", "address_line1",
+                "address_line2", "product_id", "quantity", "sold_date")
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _encode(rows, fields, fmt: str, header: bool) -> str:
+    if fmt == "ndjson":
+        return "".join(json.dumps({field: _plain(row[field]) for field in fields}, ensure_ascii=False) + "\n"
+                       for row in rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(fields)
+    for row in rows:
+        writer.writerow([
+            " ".join(row[field]) if isinstance(row[field], list) else _plain(row[field])
+            for field in fields
+        ])
+    return buffer.getvalue()
+
+
+def _stream(session_factory, fetchers, fields, fmt: str):
+    """
+    :param fetchers: 依次执行的分批查询函数 fetch_chunk(db, last_id) -> (last_id, rows)
+    """
+    db = circuit_breaker.long_running(session_factory())  # 整个导出耗时较长，不计慢查询
+    try:
+        first = True
+        if fmt == "csv":
+            yield "\ufeff"  # BOM，让 Excel 按 UTF-8 打开
+        for fetch_chunk in fetchers:
+            last_id = 0
+            while True:
+                last_id, rows = fetch_chunk(db, last_id)
+                if not rows:
+                    break
+                yield _encode(rows, fields, fmt, header=first)
+                first = False
+                db.expunge_all()  # 释放已输出的对象
+        if first and fmt == "csv":
+            yield _encode([], fields, fmt, header=True)
+    finally:
+        db.close()
+
+
+def export_products(session_factory, seller_id: int, fmt: str = "ndjson"):
+    """
+    逐批生成卖家发布的全部商品
+    """
+    def fetch_chunk(db, last_id):
+        products = (
+            db.query(models.Product)
+            .filter(models.Product.seller_id == seller_id, models.Product.id > last_id)
+            .options(selectinload(models.Product.images))
+            .order_by(models.Product.id)
+            .limit(CHUNK_SIZE)
+            .all()
+        )
+        rows = [
+            {
+                "id": product.id,
+                "name": product.name,
+                "description": product.description,
+                "price": product.price,
+                "stock": product.stock,
+                "category_id": product.category_id,
+                "image_urls": [image.image_url for image in product.images],
+            }
+            for product in products
+        ]
+        return (products[-1].id if products else last_id), rows
+
+    return _stream(session_factory, [fetch_chunk], PRODUCT_FIELDS, fmt)
+
+
+def export_orders(session_factory, seller_id: int, fmt: str = "ndjson"):
+    """
+    逐批生成卖家售出的全部订单明细，每个已售商品一行，附带订单信息；先输出已归档的历史订单
+    """
+    def fetcher(sold_model, order_model):
+        return lambda db, last_id: fetch_chunk(db, last_id, sold_model, order_model)
+
+    def fetch_chunk(db, last_id, sold_model, order_model):
+        results = (
+            db.query(
+                sold_model.id,
+                sold_model.product_id,
+                sold_model.quantity,
+                sold_model.sold_date,
+                order_model.id,
+                order_model.order_date,
+                order_model.status,
+                order_model.buyer_id,
+                order_model.recipient_name,
+                order_model.phone,
+                order_model.address_line1,
+                order_model.address_line2,
+            )
+            .join(order_model, order_model.id == sold_model.order_id)
+            .filter(sold_model.seller_id == seller_id, sold_model.id > last_id)
+            .order_by(sold_model.id)
+            .limit(CHUNK_SIZE)
+            .all()
+        )
+        rows = [
+            {
+                "product_id": product_id,
+                "quantity": quantity,
+                "sold_date": sold_date,
+                "order_id": order_id,
+                "order_date": order_date,
+                "status": status,
+                "buyer_id": buyer_id,
+                "recipient_name": recipient_name,
+                "phone": phone,
+                "address_line1": address_line1,
+                "address_line2": address_line2,
+            }
+            for (_, product_id, quantity, sold_date, order_id, order_date, status, buyer_id, recipient_name,
+                 phone, address_line1, address_line2) in results
+        ]
+        return (results[-1][0] if results else last_id), rows
+
+    return _stream(session_factory, [
+        fetcher(models.ArchivedSoldProduct, models.ArchivedOrder),
+        fetcher(models.SoldProduct, models.Order),
+    ], ORDER_FIELDS, fmt)
@@ -0,0 +1,132 @@
+"""
+Idempotency-Key 支持：客户端重试下单、发布商品时不重复执行
+
+同一个键的第一个请求正常执行，成功响应按 TTL 保存在有界的内存表中；
+执行期间到达的重复请求等待第一个请求完成并共享结果；之后的重放直接返回保存的结果，
+不会再调用 crud.create_order / crud.create_product。失败（包括库存不足、正在结算等 4xx）只与
+并发的重复请求共享，不保存：条件变化后客户端可以用同一个键重试。
+"""
+import asyncio
+import hashlib
+import inspect
+import json
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(payload) -> str:
+    """
+    计算请求体指纹，用于识别同一个键被用在了不同的请求上
+    """
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "future", "expires_at")
+
+    def __init__(self, fingerprint: str, future: asyncio.Future):
+        self.fingerprint = fingerprint
+        self.future = future
+        self.expires_at = None  # 完成后才开始计算过期时间
+
+
+class IdempotencyStore:
+    def __init__(self, ttl_seconds: int = 24 * 3600, max_entries: int = 10000, clock=time.monotonic):
+        """
+        :param ttl_seconds: 结果保存时间
+        :param max_entries: 最多保存的键数量，超出时淘汰最早完成的结果
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> _Entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at is not None and entry.expires_at <= self.clock():
+            del self._entries[key]
+            return None
+        return entry
+
+    def _evict(self):
+        now = self.clock()
+        for key in [key for key, entry in self._entries.items()
+                    if entry.expires_at is not None and entry.expires_at <= now]:
+            del self._entries[key]
+        if len(self._entries) <= self.max_entries:
+            return
+        # 按插入顺序淘汰已完成的结果，正在执行的请求不能淘汰
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_entries:
+                break
+            if self._entries[key].expires_at is not None:
+                del self._entries[key]
+
+    def _finish(self, key: str, entry: _Entry, outcome):
+        entry.expires_at = self.clock() + self.ttl_seconds
+        entry.future.set_result(outcome)
+        self._entries.move_to_end(key)
+        self._evict()
+
+    @staticmethod
+    def _replay(outcome):
+        kind, status_code, body = outcome
+        if kind == "error":
+            raise HTTPException(status_code=status_code, detail=body)
+        return body
+
+    async def run(self, key: str, request_fingerprint: str, handler):
+        """
+        以幂等方式执行 handler
+        :param key: 已带上作用域（接口、用户）的幂等键
+        :param request_fingerprint: 请求体指纹
+        :param handler: 实际执行的函数，可以是普通函数或协程函数
+        :return: (响应体, 是否为重放)
+        """
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Idempotency-Key 过长")
+
+        entry = self._lookup(key)
+        if entry is not None:
+            if entry.fingerprint != request_fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key 已被用于不同的请求")
+            # 正在执行时等待第一个请求完成；shield 避免本请求断开时取消共享的 future
+            outcome = await asyncio.shield(entry.future)
+            return self._replay(outcome), True
+
+        future = asyncio.get_running_loop().create_future()
+        # 第一个请求失败且没有等待者时，避免 “exception was never retrieved” 警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        entry = _Entry(request_fingerprint, future)
+        self._entries[key] = entry
+        self._evict()
+
+        try:
+            result = handler()
+            if inspect.isawaitable(result):
+                result = await result
+        except HTTPException as e:
+            self._entries.pop(key, None)
+            future.set_result(("error", e.status_code, e.detail))
+            raise
+        except BaseException as e:
+            self._entries.pop(key, None)
+            future.set_exception(e if isinstance(e, Exception) else HTTPException(status_code=500))
+            raise
+
+        body = jsonable_encoder(result)
+        self._finish(key, entry, ("ok", 200, body))
+        return body, False
+
+
+# 全局幂等结果存储
+store = IdempotencyStore()
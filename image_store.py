@@ -0,0 +1,180 @@
+"""
+商品图片本地存储：按内容哈希寻址、自动去重，后台生成缩略图
+
+- 原图保存在 MEDIA_ROOT/originals/<哈希前两位>/<sha256>.<ext>，相同内容只存一份
+- 缩略图由后台任务生成，保存在 MEDIA_ROOT/thumbs/<尺寸>/<哈希前两位>/<sha256>.jpg
+- 文件名由内容决定、永不改变，因此可以设置长期缓存
+- 生成缩略图依赖 Pillow，未安装时缩略图地址回退为原图
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow 是可选依赖
+    Image = None
+
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", "media")
+URL_PREFIX = "/media"
+
+THUMBNAIL_SIZES = (128, 256, 512)
+LIST_THUMBNAIL_SIZE = 256  # 商品列表使用的缩略图尺寸
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+# 文件头 -> 扩展名
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+MEDIA_TYPES = {"jpg": "image/jpeg", "png": "image/png", "gif": "image/gif", "webp": "image/webp"}
+
+_NAME_RE = re.compile(r"^([0-9a-f]{64})\.(jpg|png|gif|webp)$")
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def _sniff(head: bytes):
+    for signature, ext in _SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def parse_name(name: str):
+    """
+    校验并解析 <sha256>.<ext> 形式的文件名，防止路径穿越
+    :return: (digest, ext)，不合法时返回 None
+    """
+    match = _NAME_RE.match(name)
+    return (match.group(1), match.group(2)) if match else None
+
+
+def original_path(digest: str, ext: str) -> str:
+    return os.path.join(MEDIA_ROOT, "originals", digest[:2], f"{digest}.{ext}")
+
+
+def thumbnail_path(digest: str, size: int) -> str:
+    return os.path.join(MEDIA_ROOT, "thumbs", str(size), digest[:2], f"{digest}.jpg")
+
+
+def image_url(digest: str, ext: str) -> str:
+    return f"{URL_PREFIX}/{digest}.{ext}"
+
+
+def thumbnail_url(url: str, size: int = LIST_THUMBNAIL_SIZE) -> str:
+    """
+    本地图片返回对应尺寸的缩略图地址，外部图片原样返回
+    """
+    if url and url.startswith(URL_PREFIX + "/"):
+        parsed = parse_name(url[len(URL_PREFIX) + 1:])
+        if parsed and Image is not None:
+            return f"{URL_PREFIX}/thumbs/{size}/{parsed[0]}.jpg"
+    return url
+
+
+def _verify(path: str):
+    """
+    完整解码一次图片，文件头正确但内容损坏的图片在这里拒绝，不会保存后再让缩略图任务反复失败
+    verify() 检查文件结构和校验和，load() 解码像素数据，发现截断等 verify() 查不出的问题
+    """
+    if Image is None:
+        return
+    try:
+        with Image.open(path) as image:
+            image.verify()
+        with Image.open(path) as image:
+            image.load()
+    except Exception:
+        raise InvalidImage("图片内容已损坏，无法解码")
+
+
+def save(stream) -> tuple:
+    """
+    边读边计算哈希写入临时文件，完成后按哈希移动到最终位置；已存在则丢弃临时文件
+    安装了 Pillow 时，保存前先解码校验
+    :param stream: 有 read(n) 方法的文件对象
+    :return: (digest, ext, 是否为新文件)
+    """
+    os.makedirs(os.path.join(MEDIA_ROOT, "tmp"), exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    ext = None
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.join(MEDIA_ROOT, "tmp"))
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if ext is None:
+                    ext = _sniff(chunk[:16])
+                    if ext is None:
+                        raise InvalidImage("只支持 JPEG、PNG、GIF、WebP 图片")
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise InvalidImage(f"图片不能超过 {MAX_UPLOAD_BYTES // 1024 // 1024}MB")
+                hasher.update(chunk)
+                tmp.write(chunk)
+        if ext is None:
+            raise InvalidImage("图片内容为空")
+        _verify(tmp_path)
+
+        digest = hasher.hexdigest()
+        path = original_path(digest, ext)
+        if os.path.exists(path):
+            os.unlink(tmp_path)
+            return digest, ext, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return digest, ext, True
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def thumbnails_missing(digest: str, sizes=THUMBNAIL_SIZES) -> bool:
+    """
+    是否还有尺寸的缩略图没有生成；未安装 Pillow 时不会生成缩略图，返回 False
+    """
+    return Image is not None and any(not os.path.exists(thumbnail_path(digest, size)) for size in sizes)
+
+
+def generate_thumbnails(digest: str, ext: str, sizes=THUMBNAIL_SIZES):
+    """
+    为原图生成各尺寸的 JPEG 缩略图，已存在的跳过
+    :return: 新生成的尺寸列表
+    """
+    if Image is None:
+        return []
+    todo = [size for size in sizes if not os.path.exists(thumbnail_path(digest, size))]
+    if not todo:
+        return []
+
+    with Image.open(original_path(digest, ext)) as source:
+        source.seek(0)  # GIF 只取第一帧
+        image = source.convert("RGBA") if source.mode in ("RGBA", "LA", "P") else source.convert("RGB")
+        if image.mode == "RGBA":
+            # 透明背景铺白色后再转 JPEG
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+
+        for size in sorted(todo, reverse=True):
+            thumb = image.copy()
+            thumb.thumbnail((size, size))
+            path = thumbnail_path(digest, size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            thumb.save(tmp_path, "JPEG", quality=85, optimize=True)
+            os.replace(tmp_path, path)
+    return todo
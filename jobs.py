@@ -0,0 +1,299 @@
+"""
+进程内后台任务队列：把下单后的汇总更新、索引更新、通知等副作用移出请求事务
+
+- 任务按名称注册处理函数，参数必须可以 JSON 序列化
+- 入队时先追加写入本地日志（journal）并 fsync，完成或彻底失败后再写一条结束记录；
+  进程重启（包括断电）后未结束的任务会重新入队
+- 重放意味着任务可能执行不止一次：处理函数需要幂等，或注册时指定 replay=False，
+  由启动时的其他恢复逻辑（例如从数据库重建内存索引）负责补齐
+- 失败按指数退避重试，超过次数后记为失败
+- 普通函数在线程池中执行，协程函数直接在事件循环中执行
+- 关闭服务时可以等待队列清空（drain）
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PATH = os.environ.get("JOBS_JOURNAL", "jobs.journal")
+
+
+class JobQueue:
+    def __init__(self, journal_path: str = JOURNAL_PATH, workers: int = 4, max_attempts: int = 5,
+                 base_delay: float = 0.5, max_delay: float = 60.0, compact_every: int = 1000,
+                 fsync: bool = True):
+        """
+        :param journal_path: 任务日志文件路径，为 None 时不持久化
+        :param fsync: 每次写日志后是否 fsync，关闭后进程崩溃不丢任务，但断电可能丢失最近的记录
+        :param workers: 并发执行任务的 worker 数
+        :param max_attempts: 每个任务最多执行次数
+        :param base_delay: 第一次重试前的等待秒数，之后每次翻倍
+        :param compact_every: 每完成多少个任务压缩一次日志
+        """
+        self.journal_path = journal_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.compact_every = compact_every
+        self.fsync = fsync
+
+        self._handlers = {}
+        self._no_replay = set()  # 重启后不重放的任务名
+        self._loop = None
+        self._queue = None
+        self._tasks = []
+        self._pending = {}  # job_id -> job，已入队但尚未结束的任务
+        self._journal_lock = threading.Lock()
+        self._journal = None
+        self._finished_since_compact = 0
+
+        # 指标
+        self._in_flight = 0
+        self._waiting_retry = 0
+        self._counters = {"enqueued": 0, "succeeded": 0, "retried": 0, "failed": 0, "skipped": 0}
+        self._latencies = deque(maxlen=1000)  # 入队到完成的耗时
+        self._durations = deque(maxlen=1000)  # 处理函数执行耗时
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    def register(self, name: str, replay: bool = True):
+        """
+        注册任务处理函数的装饰器
+        :param replay: 重启后是否重新执行日志中未完成的该类任务；处理函数不幂等、且效果会由
+                       其他途径恢复时设为 False
+        """
+        def decorator(func):
+            self._handlers[name] = func
+            if replay:
+                self._no_replay.discard(name)
+            else:
+                self._no_replay.add(name)
+            return func
+        return decorator
+
+    # 日志（journal）
+    def _write_journal(self, record: dict):
+        if self._journal is None:
+            return
+        with self._journal_lock:
+            self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+
+    def _load_journal(self):
+        jobs = {}
+        if not os.path.exists(self.journal_path):
+            return []
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 崩溃时写了一半的行
+                if record.get("op") == "enqueue":
+                    jobs[record["job"]["id"]] = record["job"]
+                else:
+                    jobs.pop(record.get("id"), None)
+        return list(jobs.values())
+
+    def _compact_journal(self):
+        # 只保留未结束的任务
+        with self._journal_lock:
+            tmp_path = self.journal_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for job in list(self._pending.values()):
+                    f.write(json.dumps({"op": "enqueue", "job": job}, ensure_ascii=False) + "\n")
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            if self._journal is not None:
+                self._journal.close()
+            os.replace(tmp_path, self.journal_path)
+            if self.fsync:
+                # 让重命名本身也落盘
+                dir_fd = os.open(os.path.dirname(os.path.abspath(self.journal_path)), os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+            self._finished_since_compact = 0
+
+    def _finish(self, job: dict, op: str):
+        self._pending.pop(job["id"], None)
+        self._write_journal({"op": op, "id": job["id"]})
+        self._finished_since_compact += 1
+        if self.journal_path and self._finished_since_compact >= self.compact_every:
+            self._compact_journal()
+
+    # 入队
+    def enqueue(self, name: str, **payload) -> str:
+        """
+        提交任务，可以在事件循环线程或线程池线程中调用
+        队列未启动（命令行脚本、未触发启动事件的测试）时直接同步执行
+        :return: 任务 ID
+        """
+        if name not in self._handlers:
+            raise KeyError(f"未注册的任务: {name}")
+        job = {"id": uuid.uuid4().hex, "name": name, "payload": payload, "attempts": 0,
+               "enqueued_at": time.time()}
+
+        if not self.running:
+            self._run_inline(job)
+            return job["id"]
+
+        self._counters["enqueued"] += 1
+        self._pending[job["id"]] = job
+        self._write_journal({"op": "enqueue", "job": job})
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        return job["id"]
+
+    def _run_inline(self, job: dict):
+        handler = self._handlers[job["name"]]
+        try:
+            result = handler(**job["payload"])
+            if asyncio.iscoroutine(result):
+                result.close()
+                logger.error("队列未启动，无法同步执行协程任务 %s", job["name"])
+        except Exception:
+            logger.exception("任务 %s 执行失败", job["name"])
+
+    # 执行
+    def _retry_delay(self, attempts: int) -> float:
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _requeue(self, job: dict):
+        self._waiting_retry -= 1
+        self._queue.put_nowait(job)
+
+    async def _execute(self, job: dict):
+        handler = self._handlers.get(job["name"])
+        if handler is None:
+            raise KeyError(f"未注册的任务: {job['name']}")
+        if asyncio.iscoroutinefunction(handler):
+            await handler(**job["payload"])
+        else:
+            await self._loop.run_in_executor(None, lambda: handler(**job["payload"]))
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            self._in_flight += 1
+            started = time.time()
+            try:
+                job["attempts"] += 1
+                await self._execute(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if job["attempts"] < self.max_attempts:
+                    delay = self._retry_delay(job["attempts"])
+                    logger.warning("任务 %s(%s) 第 %d 次执行失败，%.1f 秒后重试",
+                                   job["name"], job["id"], job["attempts"], delay, exc_info=True)
+                    self._counters["retried"] += 1
+                    self._waiting_retry += 1
+                    self._loop.call_later(delay, self._requeue, job)
+                else:
+                    logger.exception("任务 %s(%s) 重试 %d 次后仍然失败", job["name"], job["id"], job["attempts"])
+                    self._counters["failed"] += 1
+                    self._finish(job, "failed")
+            else:
+                finished = time.time()
+                self._counters["succeeded"] += 1
+                self._latencies.append(finished - job["enqueued_at"])
+                self._durations.append(finished - started)
+                self._finish(job, "done")
+            finally:
+                self._in_flight -= 1
+                self._queue.task_done()
+
+    async def start(self):
+        """
+        启动 worker，并重新入队上次未完成的任务
+        """
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+
+        if self.journal_path:
+            skipped = 0
+            for job in self._load_journal():
+                if job["name"] in self._no_replay:
+                    # 不写入压缩后的日志，相当于丢弃
+                    skipped += 1
+                    continue
+                self._pending[job["id"]] = job
+                self._queue.put_nowait(job)
+            if self._pending:
+                logger.info("从任务日志恢复了 %d 个未完成的任务", len(self._pending))
+            if skipped:
+                self._counters["skipped"] += skipped
+                logger.info("跳过了 %d 个不重放的任务", skipped)
+            self._compact_journal()
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain: bool = True, timeout: float = 30.0):
+        """
+        停止队列
+        :param drain: 是否先等待队列中的任务执行完（不包括等待重试的任务）
+        :param timeout: 等待的最长秒数，超时后未完成的任务保留在日志中，下次启动继续执行
+        """
+        if not self.running:
+            return
+        if drain:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("等待任务队列清空超时，剩余 %d 个任务将在下次启动时继续", len(self._pending))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        with self._journal_lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def stats(self) -> dict:
+        """
+        队列深度、执行中的任务数、成功 / 重试 / 失败次数，以及最近 1000 个任务的耗时
+        """
+        def summary(samples):
+            if not samples:
+                return {"avg_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+            ordered = sorted(samples)
+            return {
+                "avg_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+                "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2),
+            }
+
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "waiting_retry": self._waiting_retry,
+            "in_flight": self._in_flight,
+            "pending": len(self._pending),
+            **self._counters,
+            "latency": summary(self._latencies),
+            "duration": summary(self._durations),
+        }
+
+
+# 全局任务队列
+queue = JobQueue()
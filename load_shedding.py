@@ -0,0 +1,241 @@
+"""
+按路由分组的并发限制和过载保护
+
+每个请求先按方法和路径归入一个分组，取得该分组的并发名额后，再取得全局共享的名额（约等于
+数据库连接池大小），两级都满时在有界队列中等待：
+- 分组内的名额防止某一个接口的突发流量占满线程池和连接池，拖慢其他接口
+- 共享名额按分组优先级分配，下单结算排在浏览前面
+- 队列已满或等待超过 max_wait 秒时立即返回 503 + Retry-After，不再排队等连接池超时
+
+分组的 limit / queue / max_wait 可以用环境变量 ROUTE_LIMITS 覆盖，例如
+ROUTE_LIMITS='{"browse": {"limit": 64}, "shared": {"limit": 40}}'
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import os
+import re
+import time
+
+from starlette.responses import JSONResponse
+
+
+class Overloaded(Exception):
+    def __init__(self, group: str, retry_after: int):
+        super().__init__(group)
+        self.group = group
+        self.retry_after = retry_after
+
+
+class Limiter:
+    def __init__(self, name: str, limit: int, queue: int, max_wait: float, clock=time.monotonic):
+        """
+        :param limit: 同时执行的请求数
+        :param queue: 最多排队等待的请求数
+        :param max_wait: 排队最长秒数
+        """
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.max_wait = max_wait
+        self.clock = clock
+        self._active = 0
+        self._waiting = 0
+        self._heap = []  # (优先级, 序号, future)，超时/取消的 future 留在堆里，出堆时跳过
+        self._seq = itertools.count()
+        self._hold_ewma = 0.05  # 平均占用秒数，用于估算 Retry-After
+        self._counters = {"admitted": 0, "rejected": 0, "timed_out": 0, "queued": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def retry_after(self) -> int:
+        return min(30, max(1, math.ceil(self._hold_ewma * (self._waiting + 1) / self.limit)))
+
+    def _admit(self, waited: float):
+        self._counters["admitted"] += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    async def acquire(self, priority: int = 0):
+        """
+        取得一个名额，优先级数字越小越先得到；排不上时抛出 Overloaded
+        """
+        if self._active < self.limit and not self._waiting:
+            self._active += 1
+            self._admit(0.0)
+            return
+        if self._waiting >= self.queue:
+            self._counters["rejected"] += 1
+            raise Overloaded(self.name, self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        self._waiting += 1
+        self._counters["queued"] += 1
+        start = self.clock()
+
+        def expire():
+            if not future.done():
+                self._counters["timed_out"] += 1
+                future.set_exception(Overloaded(self.name, self.retry_after()))
+
+        timer = loop.call_later(self.max_wait, expire)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 名额已经转交给本请求但请求被取消（客户端断开），交给下一个
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            raise
+        finally:
+            timer.cancel()
+            if not future.done() or future.cancelled() or future.exception() is not None:
+                self._waiting -= 1
+        self._admit(self.clock() - start)
+
+    def release(self, held: float = None):
+        """
+        归还名额：直接转交给优先级最高的等待者，没有等待者时空出名额
+        :param held: 本次占用秒数
+        """
+        if held is not None:
+            self._hold_ewma = 0.9 * self._hold_ewma + 0.1 * held
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                self._waiting -= 1
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def stats(self) -> dict:
+        admitted = self._counters["admitted"]
+        return {
+            "limit": self.limit,
+            "in_flight": self._active,
+            "waiting": self._waiting,
+            **self._counters,
+            "avg_wait_ms": round(self._wait_total / admitted * 1000, 2) if admitted else 0.0,
+            "max_wait_ms": round(self._wait_max * 1000, 2),
+            "avg_hold_ms": round(self._hold_ewma * 1000, 2),
+        }
+
+
+class RouteGroup:
+    def __init__(self, name: str, routes, limit: int, queue: int, max_wait: float, priority: int,
+                 shared: bool = True):
+        """
+        :param routes: (方法正则, 路径正则) 列表
+        :param priority: 争用共享名额时的优先级，数字越小越优先
+        :param shared: 是否占用共享名额
+        """
+        self.name = name
+        self.routes = [(re.compile(method), re.compile(path)) for method, path in routes]
+        self.priority = priority
+        self.shared = shared
+        self.limiter = Limiter(name, limit, queue, max_wait)
+
+    def matches(self, method: str, path: str) -> bool:
+        return any(m.fullmatch(method) and p.fullmatch(path) for m, p in self.routes)
+
+
+class RouteLimits:
+    def __init__(self, groups, shared: Limiter, exempt=()):
+        """
+        :param groups: RouteGroup 列表，按顺序匹配
+        :param shared: 所有分组共享的名额
+        :param exempt: 不做限制的路径正则（长连接、静态文件、指标）
+        """
+        self.groups = list(groups)
+        self.shared = shared
+        self.exempt = [re.compile(path) for path in exempt]
+
+    def classify(self, method: str, path: str):
+        if any(pattern.fullmatch(path) for pattern in self.exempt):
+            return None
+        for group in self.groups:
+            if group.matches(method, path):
+                return group
+        return None
+
+    def configure(self, overrides: dict):
+        limiters = {group.name: group.limiter for group in self.groups}
+        limiters["shared"] = self.shared
+        for name, values in overrides.items():
+            limiter = limiters.get(name)
+            if limiter is None:
+                continue
+            for field in ("limit", "queue", "max_wait"):
+                if field in values:
+                    setattr(limiter, field, values[field])
+
+    def stats(self) -> dict:
+        return {
+            "shared": self.shared.stats(),
+            "groups": {group.name: group.limiter.stats() for group in self.groups},
+        }
+
+
+class LoadSheddingMiddleware:
+    def __init__(self, app, limits: RouteLimits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        group = self.limits.classify(scope["method"], scope["path"])
+        if group is None:
+            return await self.app(scope, receive, send)
+
+        limiters = [group.limiter] + ([self.limits.shared] if group.shared else [])
+        acquired = []
+        try:
+            for limiter in limiters:
+                await limiter.acquire(group.priority)
+                acquired.append(limiter)
+        except Overloaded as e:
+            for limiter in acquired:
+                limiter.release()
+            response = JSONResponse({"detail": "服务繁忙，请稍后重试"}, status_code=503,
+                                    headers={"Retry-After": str(e.retry_after)})
+            return await response(scope, receive, send)
+        except BaseException:
+            for limiter in acquired:
+                limiter.release()
+            raise
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            held = time.monotonic() - start
+            for limiter in reversed(acquired):
+                limiter.release(held)
+
+
+WRITE_METHODS = "POST|PUT|PATCH|DELETE"
+
+# 连接池 pool_size + max_overflow
+limits = RouteLimits(
+    groups=[
+        RouteGroup("checkout", [("POST", r"/order/create"), ("POST", r"/cart/checkout")],
+                   limit=20, queue=200, max_wait=10, priority=0),
+        # 密码哈希占用 CPU，单独限制
+        RouteGroup("auth", [("POST", r"/token"), ("POST", r"/register")],
+                   limit=8, queue=50, max_wait=5, priority=1),
+        RouteGroup("export", [("GET", r"/export/.*")],
+                   limit=4, queue=4, max_wait=2, priority=2, shared=False),
+        RouteGroup("write", [(WRITE_METHODS, r".*")],
+                   limit=16, queue=100, max_wait=5, priority=1),
+        RouteGroup("browse", [("GET|HEAD", r".*")],
+                   limit=24, queue=100, max_wait=2, priority=2),
+    ],
+    shared=Limiter("shared", limit=30, queue=500, max_wait=10),
+    exempt=[r"/orders/events", r"/media/.*", r"/(jobs|singleflight|load|cache)/stats", r"/db/health", r"/debug/.*",
+            r"/docs.*", r"/openapi\.json"],
+)
+limits.configure(json.loads(os.environ.get("ROUTE_LIMITS", "{}")))
@@ -1,17 +1,35 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Response, Header, UploadFile, File, Query
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from datetime import timedelta
-from typing import List
-import crud, models, schemas, auth
-from database import get_db, engine
-
-# 创建数据库表
-models.Base.metadata.create_all(bind=engine)
+from datetime import timedelta, date
+import logging
+import os
+from typing import List, Optional
+import crud, models, schemas, auth, sales_rollup, recommendations, trending, suggest, idempotency, jobs, events, cart_store, image_store, tasks, exports, singleflight, circuit_breaker, load_shedding, access_log, change_feed, profiler, result_cache, migrations
+from database import get_db, engine, SessionLocal
+
+# 创建数据库表，并给已有的表补充新增的列（create_all 不会修改已存在的表）
+migrations.upgrade(engine)
+
+# 数据库熔断：之后通过 SessionLocal 的查询和写入都经过熔断器
+circuit_breaker.breaker.install(SessionLocal)
+# 商品、图片、分类、评论的变更写入 change_log，供客户端增量同步
+change_feed.install(SessionLocal)
+# 访问日志中统计每个请求的 SQL 条数
+access_log.install(engine)
+# 带 X-Debug-Timing 头的请求统计数据库和序列化耗时
+profiler.install(engine)
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+# 按路由分组限制并发，过载时快速返回 503（放在 CORS 内层，503 响应同样带 CORS 头）
+app.add_middleware(load_shedding.LoadSheddingMiddleware, limits=load_shedding.limits)
+
 # CORS 配置
 app.add_middleware(
     CORSMiddleware,
@@ -21,6 +39,92 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 设置 DEBUG_TIMING=1 时，带 X-Debug-Timing: 1 头的请求在响应中附加 Server-Timing 耗时分解
+app.add_middleware(profiler.ServerTimingMiddleware)
+
+# 结构化访问日志，放在最外层以记录所有响应（包括 503）
+app.add_middleware(access_log.AccessLogMiddleware)
+
+
+@app.on_event("startup")
+def build_indexes():
+    # 后台构建内存中的商品共现索引、热门商品计数和搜索联想索引
+    recommendations.rebuild_in_background(SessionLocal)
+    trending.rebuild_in_background(SessionLocal)
+    suggest.rebuild_in_background(SessionLocal)
+
+
+@app.on_event("startup")
+async def start_jobs():
+    # 启动后台写日志线程
+    access_log.start()
+    # 启动后台任务队列，并恢复上次未完成的任务
+    await jobs.queue.start()
+    # 开始分发订单事件
+    events.hub.start()
+    # 定期把购物车修改批量写回数据库
+    cart_store.store.start(SessionLocal)
+    # 熔断打开期间定期探测数据库是否恢复
+    circuit_breaker.breaker.start_probe(engine)
+
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    # 写回剩余的购物车修改，等待队列中的任务执行完再退出
+    await cart_store.store.stop(SessionLocal)
+    await jobs.queue.stop(drain=True)
+    await events.hub.stop()
+    await circuit_breaker.breaker.stop_probe()
+    # 最后写出剩余的日志
+    access_log.stop()
+
+
+# 后台任务队列指标
+@app.get("/jobs/stats")
+async def job_stats(current_user: schemas.User = Depends(auth.get_current_admin)):
+    return jobs.queue.stats()
+
+
+# 各路由分组的并发和排队指标
+@app.get("/load/stats")
+async def load_stats(current_user: schemas.User = Depends(auth.get_current_admin)):
+    return load_shedding.limits.stats()
+
+
+# 采样剖析当前 worker，返回 collapsed stack 格式，可直接生成火焰图
+@app.get("/debug/profile", response_class=PlainTextResponse)
+async def debug_profile(seconds: float = 10, interval_ms: float = 5, include_idle: bool = False,
+                        current_user: schemas.User = Depends(auth.get_current_admin)):
+    """
+    仅管理员可用：在 seconds 秒内采样所有线程的调用栈，例如
+    curl -H "Authorization: Bearer ..." ".../debug/profile?seconds=30" | flamegraph.pl > profile.svg
+    """
+    seconds = max(0.1, min(seconds, profiler.MAX_SECONDS))
+    interval = max(0.001, interval_ms / 1000)
+    try:
+        stacks = await run_in_threadpool(profiler.profiler.profile, seconds, interval, include_idle)
+    except profiler.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="已有正在进行的采样")
+    return profiler.SamplingProfiler.collapse(stacks)
+
+
+# 数据库熔断状态
+@app.get("/db/health")
+async def db_health(current_user: schemas.User = Depends(auth.get_current_admin)):
+    return circuit_breaker.breaker.stats()
+
+
+# 请求合并指标
+@app.get("/singleflight/stats")
+async def singleflight_stats(current_user: schemas.User = Depends(auth.get_current_admin)):
+    return singleflight.group.stats()
+
+
+# 搜索和列表结果缓存指标
+@app.get("/cache/stats")
+async def cache_stats(current_user: schemas.User = Depends(auth.get_current_admin)):
+    return result_cache.stats()
+
 
 # 注册新用户
 @app.post("/register", response_model=schemas.User)
@@ -74,30 +178,101 @@ async def read_protected_data(current_user: schemas.User = Depends(auth.get_curr
     return {"message": "这是受保护的数据", "user": current_user.username}
 
 
+def idempotent_response(body, replayed: bool):
+    """
+    带 Idempotent-Replayed 头的响应，客户端据此判断是否为重放结果
+    """
+    return JSONResponse(content=body, headers={"Idempotent-Replayed": "true" if replayed else "false"})
+
+
 @app.post("/product/create")
-async def create_new_product(product: schemas.ProductCreate, db: Session = Depends(get_db)):
-    try:
-        # 调用 CRUD 函数创建产品
-        db_product = crud.create_product(db, product)
-        return {
-            "success": True,
-            "product": db_product.name,
-            "message": "产品发布成功"
-        }
-    except Exception as e:
-        # 捕获异常并返回错误信息
-        raise HTTPException(status_code=500, detail=f"产品发布失败: {str(e)}")
+async def create_new_product(product: schemas.ProductCreate, db: Session = Depends(get_db),
+                             idempotency_key: Optional[str] = Header(None)):
+    def handle():
+        try:
+            # 调用 CRUD 函数创建产品
+            db_product = crud.create_product(db, product)
+            return {
+                "success": True,
+                "product": db_product.name,
+                "message": "产品发布成功"
+            }
+        except circuit_breaker.CircuitOpen:
+            raise
+        except Exception as e:
+            # 捕获异常并返回错误信息
+            raise HTTPException(status_code=500, detail=f"产品发布失败: {str(e)}")
+
+    if not idempotency_key:
+        return handle()
+    body, replayed = await idempotency.store.run(
+        f"product:{product.seller_id}:{idempotency_key}", idempotency.fingerprint(product), handle
+    )
+    return idempotent_response(body, replayed)
 
 
 # 获取商品详情
 @app.get("/products/{product_id}/detail")
-async def get_seller_product(product_id: int, db: Session = Depends(get_db)):
-    product = crud.get_product_by_id(db, product_id)
+async def get_seller_product(product_id: int, response: Response, db: Session = Depends(get_db)):
+    def load():
+        # 旧数据缓存保存序列化后的 dict，不保存已脱离会话的 ORM 对象
+        product = crud.get_product_by_id(db, product_id)
+        return None if product is None else schemas.Product.model_validate(product).model_dump()
+
+    product = await circuit_breaker.catalog_read(("detail", product_id), load, response=response)
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
+    trending.tracker.record_view(product["id"], product["category_id"])
     return product
 
 
+# 热门商品排行
+@app.get("/products/trending")
+async def trending_products(limit: int = 10, category_id: Optional[int] = None):
+    """
+    返回最近 24 小时内销量和浏览量综合热度最高的商品，可按分类筛选
+    """
+    top = trending.tracker.top(limit=max(1, min(limit, 100)), category_id=category_id)
+    return [{"product_id": product_id, "score": score} for product_id, score in top]
+
+
+# 搜索框输入联想
+@app.get("/products/suggest")
+async def suggest_products(prefix: str, limit: int = 8):
+    """
+    按前缀返回销量最高的商品名和分类名
+    """
+    return suggest.index.suggest(prefix, limit)
+
+
+# 买了该商品的用户还买了
+@app.get("/products/{product_id}/related")
+async def related_products(product_id: int, limit: int = 5, db: Session = Depends(get_db)):
+    """
+    从内存中的共现索引返回相关商品，没有购买记录时随机返回同分类商品
+    """
+    related = recommendations.index.related(product_id, limit)
+    if related:
+        return {
+            "product_id": product_id,
+            "source": "co_purchase",
+            "products": [{"product_id": other_id, "score": count} for other_id, count in related],
+        }
+
+    product = crud.get_product_by_id(db, product_id)
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    candidates = crud.get_random_products_by_category(db, product.category_id, limit + 1)
+    return {
+        "product_id": product_id,
+        "source": "category",
+        "products": [
+            {"product_id": candidate["id"], "score": 0}
+            for candidate in candidates if candidate["id"] != product_id
+        ][:limit],
+    }
+
+
 # 获取商品图片
 @app.get("/product/{product_id}/images", response_model=List[schemas.ProductImage])
 async def read_product(product_id: int, db: Session = Depends(get_db)):
@@ -107,6 +282,69 @@ async def read_product(product_id: int, db: Session = Depends(get_db)):
     return product_images
 
 
+# 上传商品图片
+@app.post("/product/{product_id}/images/upload", response_model=schemas.ProductImage)
+async def upload_product_image(product_id: int, file: UploadFile = File(...),
+                               current_user: schemas.User = Depends(auth.get_current_user),
+                               db: Session = Depends(get_db)):
+    """
+    上传图片到本地存储（相同内容只存一份），后台生成缩略图，并关联到商品
+    """
+    product = crud.get_product_by_id(db, product_id)
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    if product.seller_id != current_user.id:
+        raise HTTPException(status_code=403, detail="只能为自己发布的商品上传图片")
+
+    try:
+        digest, ext, _ = await run_in_threadpool(image_store.save, file.file)
+    except image_store.InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # 原图已存在时，之前的缩略图任务可能失败或还没执行完，缺少缩略图就重新排队（已生成的尺寸会跳过）
+    if image_store.thumbnails_missing(digest):
+        tasks.enqueue_image_uploaded(digest, ext)
+
+    url = image_store.image_url(digest, ext)
+    for existing in crud.get_product_images_by_product_id(db, product_id):
+        if existing.image_url == url:
+            return existing
+    return crud.add_product_image(db, product_id, url)
+
+
+# 图片内容由文件名（哈希）决定，可以永久缓存
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+# 读取原图，支持 Range 请求
+@app.get("/media/{name}")
+async def serve_image(name: str):
+    parsed = image_store.parse_name(name)
+    path = image_store.original_path(*parsed) if parsed else None
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(path, media_type=image_store.MEDIA_TYPES[parsed[1]],
+                        headers={"Cache-Control": MEDIA_CACHE_CONTROL})
+
+
+# 读取缩略图，尚未生成时临时返回原图
+@app.get("/media/thumbs/{size}/{name}")
+async def serve_thumbnail(size: int, name: str):
+    parsed = image_store.parse_name(name)
+    if size not in image_store.THUMBNAIL_SIZES or parsed is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    digest = parsed[0]
+    path = image_store.thumbnail_path(digest, size)
+    if os.path.exists(path):
+        return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": MEDIA_CACHE_CONTROL})
+
+    for ext in image_store.MEDIA_TYPES:
+        original = image_store.original_path(digest, ext)
+        if os.path.exists(original):
+            return FileResponse(original, media_type=image_store.MEDIA_TYPES[ext],
+                                headers={"Cache-Control": "public, max-age=60"})
+    raise HTTPException(status_code=404, detail="Image not found")
+
+
 # 获取商品分类名
 @app.get("/categories/{category_id}/name")
 async def read_category_name(category_id: int, db: Session = Depends(get_db)):
@@ -121,41 +359,52 @@ async def read_category_name(category_id: int, db: Session = Depends(get_db)):
 async def create_order(
         order_data: schemas.OrderCreate,  # 通过请求体传递 OrderCreate 类型的数据
         db: Session = Depends(get_db),
-        current_user: schemas.User = Depends(auth.get_current_user)
+        current_user: schemas.User = Depends(auth.get_current_user),
+        idempotency_key: Optional[str] = Header(None)
 ):
-    try:
-        # 调用 crud.create_order 创建订单
-        new_order = crud.create_order(db=db, order_data=order_data, buyer_id=current_user.id)
-
-        # 构建订单响应模型
-        order_response = schemas.OrderResponse(
-            id=new_order.id,
-
-            buyer_id=new_order.buyer_id,
-            order_date=new_order.order_date.isoformat(),  # 格式化日期为 ISO 8601 字符串
-            status=new_order.status,
-            total_amount=new_order.total_amount,
-            products=[
-                schemas.ProductOrder(product_id=item.product_id, quantity=item.quantity)
-                for item in order_data.products
-            ],
-            receipt_info=schemas.ReceiptInfo(
-                recipient_name=order_data.receipt_info.recipient_name,
-                phone=order_data.receipt_info.phone,
-                address_line1=order_data.receipt_info.address_line1,
-                address_line2=order_data.receipt_info.address_line2
+    def handle():
+        try:
+            # 调用 crud.create_order 创建订单
+            new_order = crud.create_order(db=db, order_data=order_data, buyer_id=current_user.id)
+
+            # 构建订单响应模型
+            order_response = schemas.OrderResponse(
+                id=new_order.id,
+
+                buyer_id=new_order.buyer_id,
+                order_date=new_order.order_date.isoformat(),  # 格式化日期为 ISO 8601 字符串
+                status=new_order.status,
+                total_amount=new_order.total_amount,
+                products=[
+                    schemas.ProductOrder(product_id=item.product_id, quantity=item.quantity)
+                    for item in order_data.products
+                ],
+                receipt_info=schemas.ReceiptInfo(
+                    recipient_name=order_data.receipt_info.recipient_name,
+                    phone=order_data.receipt_info.phone,
+                    address_line1=order_data.receipt_info.address_line1,
+                    address_line2=order_data.receipt_info.address_line2
+                )
             )
-        )
-
-        return order_response  # 返回订单响应模型
 
-    except HTTPException as e:
-        print(e)
-        # 捕获 HTTP 异常并返回错误信息
-        raise HTTPException(status_code=e.status_code, detail=e.detail)
-    except Exception as e:
-        # 捕获其他异常并返回通用错误信息
-        raise HTTPException(status_code=500, detail=f"订单创建失败: {str(e)}")
+            return order_response  # 返回订单响应模型
+
+        except HTTPException as e:
+            logger.info("订单创建被拒绝: %s %s", e.status_code, e.detail)
+            # 捕获 HTTP 异常并返回错误信息
+            raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers)
+        except Exception as e:
+            logger.exception("订单创建失败")
+            # 捕获其他异常并返回通用错误信息
+            raise HTTPException(status_code=500, detail=f"订单创建失败: {str(e)}")
+
+    if not idempotency_key:
+        return handle()
+    # 同一个键只在同一个买家下生效
+    body, replayed = await idempotency.store.run(
+        f"order:{current_user.id}:{idempotency_key}", idempotency.fingerprint(order_data), handle
+    )
+    return idempotent_response(body, replayed)
 
 @app.post("/orders/{order_id}/status", response_model=schemas.Order)
 def change_order_status(order_id: int, status_update: schemas.OrderStatusUpdate, db: Session = Depends(get_db)):
@@ -167,6 +416,133 @@ def change_order_status(order_id: int, status_update: schemas.OrderStatusUpdate,
     :return: 更新后的订单信息
     """
     return crud.update_order_status(db, order_id, status_update.status)
+
+
+# 卖家批量修改订单状态
+@app.post("/orders/status/batch", response_model=List[schemas.OrderStatusBatchResult])
+def change_order_status_batch(
+        batch: schemas.OrderStatusBatchUpdate,
+        db: Session = Depends(get_db),
+        current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """
+    批量修改订单状态，只允许 pending → shipped → completed 以及 pending → canceled，
+    并且只能修改包含当前卖家商品的订单
+    """
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="订单列表不能为空")
+    return crud.batch_update_order_status(db, batch.items, seller_id=current_user.id)
+
+def cart_summary(items: dict):
+    return {"items": [{"product_id": product_id, "quantity": quantity} for product_id, quantity in items.items()]}
+
+
+def check_cart_stock(db: Session, product_id: int, quantity: int):
+    """
+    商品必须存在，且库存足够放入 quantity 件（结算时还会再检查一次）
+    """
+    product = crud.get_product_by_id(db, product_id)
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    if product.stock < quantity:
+        raise HTTPException(status_code=400, detail=f"产品 ID {product_id} 库存不足，剩余 {product.stock} 件")
+
+
+# 查看购物车
+@app.get("/cart")
+async def read_cart(current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+    """
+    返回购物车中的商品信息和数量，商品信息通过一次批量查询获取
+    """
+    items = cart_store.store.items(db, current_user.id)
+    cards = crud.get_product_cards_by_ids(db, items.keys())
+    result = [
+        {"product": cards[product_id], "quantity": quantity}
+        for product_id, quantity in items.items() if product_id in cards
+    ]
+    return {
+        "items": result,
+        "total_amount": round(sum(item["product"]["price"] * item["quantity"] for item in result), 2),
+    }
+
+
+# 加入购物车
+@app.post("/cart/items")
+async def add_cart_item(item: schemas.CartItemAdd, current_user: schemas.User = Depends(auth.get_current_user),
+                        db: Session = Depends(get_db)):
+    if item.quantity <= 0:
+        raise HTTPException(status_code=400, detail="数量必须大于 0")
+    check_cart_stock(db, item.product_id,
+                     cart_store.store.items(db, current_user.id).get(item.product_id, 0) + item.quantity)
+    return cart_summary(cart_store.store.add(db, current_user.id, item.product_id, item.quantity))
+
+
+# 修改购物车中商品的数量
+@app.put("/cart/items/{product_id}")
+async def update_cart_item(product_id: int, update: schemas.CartItemUpdate,
+                           current_user: schemas.User = Depends(auth.get_current_user),
+                           db: Session = Depends(get_db)):
+    if update.quantity < 0:
+        raise HTTPException(status_code=400, detail="数量不能小于 0")
+    if update.quantity > 0:
+        check_cart_stock(db, product_id, update.quantity)
+    return cart_summary(cart_store.store.set(db, current_user.id, product_id, update.quantity))
+
+
+# 从购物车移除商品
+@app.delete("/cart/items/{product_id}")
+async def remove_cart_item(product_id: int, current_user: schemas.User = Depends(auth.get_current_user),
+                           db: Session = Depends(get_db)):
+    return cart_summary(cart_store.store.remove(db, current_user.id, product_id))
+
+
+# 购物车结算
+@app.post("/cart/checkout", response_model=schemas.OrderResponse)
+async def checkout_cart(checkout: schemas.CartCheckout,
+                        current_user: schemas.User = Depends(auth.get_current_user),
+                        db: Session = Depends(get_db),
+                        idempotency_key: Optional[str] = Header(None)):
+    """
+    用购物车中的全部商品创建订单，成功后从购物车中移除这些商品
+    同一用户同时只能有一个结算在执行；带 Idempotency-Key 的重复提交返回第一次成功的结果
+    """
+    def handle():
+        try:
+            with cart_store.store.checking_out(current_user.id):
+                items = cart_store.store.items(db, current_user.id)
+                if not items:
+                    raise HTTPException(status_code=400, detail="购物车为空")
+
+                order_data = schemas.OrderCreate(
+                    products=[schemas.ProductOrder(product_id=product_id, quantity=quantity)
+                              for product_id, quantity in items.items()],
+                    receipt_info=checkout.receipt_info
+                )
+                new_order = crud.create_order(db=db, order_data=order_data, buyer_id=current_user.id)
+                cart_store.store.clear(db, current_user.id, items.keys())
+        except cart_store.CheckoutInProgress:
+            raise HTTPException(status_code=409, detail="购物车正在结算，请勿重复提交")
+
+        return schemas.OrderResponse(
+            id=new_order.id,
+            buyer_id=new_order.buyer_id,
+            order_date=new_order.order_date.isoformat(),
+            status=new_order.status,
+            total_amount=new_order.total_amount,
+            products=order_data.products,
+            receipt_info=order_data.receipt_info
+        )
+
+    # 在线程池中执行：下单期间不阻塞事件循环，同一用户的并发结算才会被 checking_out 拦下
+    if not idempotency_key:
+        return await run_in_threadpool(handle)
+    body, replayed = await idempotency.store.run(
+        f"cart_checkout:{current_user.id}:{idempotency_key}", idempotency.fingerprint(checkout),
+        lambda: run_in_threadpool(handle)
+    )
+    return idempotent_response(body, replayed)
+
+
 # 得到用户的所有订单
 @app.get("/user/orders")
 async def read_user_orders(current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
@@ -175,6 +551,27 @@ async def read_user_orders(current_user: schemas.User = Depends(auth.get_current
         raise HTTPException(status_code=404, detail="未找到相关订单")
     return orders
 
+# 订阅当前用户（买家或卖家）的订单状态变化
+@app.get("/orders/events")
+async def order_events(
+        request: Request,
+        last_event_id: Optional[int] = None,
+        current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """
+    Server-Sent Events 推送订单创建和状态变化；断线重连时浏览器会自动带上 Last-Event-ID，
+    也可以通过 last_event_id 参数指定，从该事件之后继续推送
+    """
+    header = request.headers.get("last-event-id")
+    if last_event_id is None and header and header.isdigit():
+        last_event_id = int(header)
+    return StreamingResponse(
+        events.hub.stream(current_user.id, last_event_id or 0, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # 获取订单详情
 @app.get("/orders/{order_id}")
 async def read_order_details(order_id: int, db: Session = Depends(get_db)):
@@ -197,6 +594,50 @@ async def get_products_for_seller(current_user: schemas.User = Depends(auth.get_
 
     return products
 
+# 卖家销售看板
+@app.get("/seller/sales", response_model=List[schemas.SellerSalesRollup])
+async def get_seller_sales(
+        period: str = "day",
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        product_id: Optional[int] = None,
+        current_user: schemas.User = Depends(auth.get_current_user),
+        db: Session = Depends(get_db)
+):
+    """
+    按天 / 周 / 月返回当前卖家每个商品的销量和销售额
+    """
+    if period not in sales_rollup.PERIODS:
+        raise HTTPException(status_code=400, detail="period 只能是 day、week 或 month")
+    return sales_rollup.get_seller_sales(db, current_user.id, period=period, start=start, end=end,
+                                         product_id=product_id)
+
+def export_response(content, fmt: str, name: str):
+    if fmt not in exports.FORMATS:
+        raise HTTPException(status_code=400, detail="format 只能是 ndjson 或 csv")
+    filename = f"{name}-{date.today().isoformat()}.{fmt}"
+    return StreamingResponse(content, media_type=exports.FORMATS[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+# 导出当前卖家的全部商品
+@app.get("/export/products")
+async def export_seller_products(format: str = "ndjson", current_user: schemas.User = Depends(auth.get_current_user)):
+    """
+    以 NDJSON 或 CSV 流式导出，数据分批查询、边查边发送
+    """
+    return export_response(exports.export_products(SessionLocal, current_user.id, format), format, "products")
+
+
+# 导出当前卖家售出的全部订单明细
+@app.get("/export/orders")
+async def export_seller_orders(format: str = "ndjson", current_user: schemas.User = Depends(auth.get_current_user)):
+    """
+    以 NDJSON 或 CSV 流式导出，每个已售商品一行，附带订单和收货信息
+    """
+    return export_response(exports.export_orders(SessionLocal, current_user.id, format), format, "orders")
+
+
 # 对某一商品进行评论
 @app.post("/product/{product_id}/review", response_model=schemas.ReviewResponse)
 async def post_review(
@@ -211,8 +652,8 @@ async def post_review(
         return new_review
     except HTTPException as e:
         raise HTTPException(status_code=e.status_code, detail=e.detail)
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception("评论创建失败")
         raise HTTPException(status_code=500, detail="评论创建失败")
 
 
@@ -222,53 +663,100 @@ async def get_reviews(product_id: int, db: Session = Depends(get_db)):
     """
        获取某个商品的所有评论
        """
-    reviews = crud.get_reviews_by_product_id(db, product_id)
+    reviews = await singleflight.group.do(("reviews", product_id), crud.get_reviews_by_product_id, db, product_id)
     return reviews
 
 
+# 客户端增量同步商品目录
+@app.get("/sync/changes")
+async def sync_changes(since: int = 0, limit: int = 500, db: Session = Depends(get_db)):
+    """
+    返回游标 since 之后新增、修改、删除的商品、图片、分类和评论，
+    客户端保存返回的 cursor，下次带上继续同步；has_more 为 true 时可以立即再次请求
+    """
+    if since < 0:
+        raise HTTPException(status_code=400, detail="since 不能小于 0")
+    return await run_in_threadpool(change_feed.get_changes, db, since, limit)
+
+
 # 获取所有分类ID和分类名
 @app.get("/categories", response_model=List[schemas.Category])
-async def get_categories(db: Session = Depends(get_db)):
+async def get_categories(response: Response, db: Session = Depends(get_db)):
     """
     获取所有分类的 ID 和名称
     """
-    categories = crud.get_all_categories(db)
     # 转换为字典列表，以满足 Pydantic 的序列化需求
-    return [{"id": category[0], "name": category[1]} for category in categories]
+    return await circuit_breaker.catalog_read(("categories",), lambda: [
+        {"id": category[0], "name": category[1]} for category in crud.get_all_categories(db)
+    ], response=response)
 
 
 @app.get("/categories/{category_id}/products")
-async def get_random_products(category_id: int, limit: int = 5, db: Session = Depends(get_db)):
+async def get_random_products(category_id: int, response: Response, limit: int = 5, db: Session = Depends(get_db)):
     """
     随机获取某分类下的商品及其多个图片URL
     """
-    products = crud.get_random_products_by_category(db, category_id, limit)
+    products = await circuit_breaker.catalog_read(("category_random", category_id, limit),
+                                                  crud.get_random_products_by_category, db, category_id, limit,
+                                                  response=response)
     if not products:
         raise HTTPException(status_code=404, detail="该分类下没有商品")
     return products
 
 
 @app.get("/products/random")
-async def random_products(limit: int = 5, db: Session = Depends(get_db)):
+async def random_products(response: Response, limit: int = 5, db: Session = Depends(get_db)):
     """
     随机返回数个商品及其图片信息
     """
-    products = crud.get_random_products(db, limit=limit)
+    products = await circuit_breaker.catalog_read(("random", limit), lambda: crud.get_random_products(db, limit=limit),
+                                                  response=response)
     if not products:
         raise HTTPException(status_code=404, detail="没有商品可供随机返回")
 
     return products
 
 @app.get("/products/search")
-async def search(keyword: str, limit: int = 10, db: Session = Depends(get_db)):
+async def search(keyword: str, response: Response, limit: int = Query(10, ge=1, le=crud.SEARCH_MAX_LIMIT),
+                 category_id: Optional[int] = None, min_price: Optional[float] = None,
+                 max_price: Optional[float] = None, in_stock: bool = False, sort: str = "relevance",
+                 offset: int = Query(0, ge=0, le=crud.SEARCH_MAX_OFFSET), db: Session = Depends(get_db)):
     """
-    按关键字模糊查找商品
+    按关键字模糊查找商品，可按分类、价格区间、是否有货筛选，按价格或上架时间排序
     """
-    if not keyword:
+    if not result_cache.normalize_keyword(keyword):
         raise HTTPException(status_code=400, detail="关键字不能为空")
-
-    products = crud.search_products(db, keyword=keyword, limit=limit)
+    if sort not in crud.SEARCH_SORTS:
+        raise HTTPException(status_code=400, detail="sort 只能是 relevance、price_asc、price_desc 或 newest")
+
+    key = ("search", result_cache.normalize_keyword(keyword), limit, category_id, min_price, max_price, in_stock,
+           sort, offset)
+    products = await circuit_breaker.catalog_read(key, lambda: crud.search_products(
+        db, keyword=keyword, limit=limit, category_id=category_id,
+        min_price=min_price, max_price=max_price, in_stock=in_stock, sort=sort, offset=offset), response=response)
     if not products:
         raise HTTPException(status_code=404, detail="未找到相关商品")
 
-    return products
\ No newline at end of file
+    return products
+
+
+@app.get("/products/search/faceted")
+async def faceted_search(response: Response, keyword: Optional[str] = None,
+                         limit: int = Query(10, ge=1, le=crud.SEARCH_MAX_LIMIT),
+                         offset: int = Query(0, ge=0, le=crud.SEARCH_MAX_OFFSET),
+                         category_id: Optional[int] = None, min_price: Optional[float] = None,
+                         max_price: Optional[float] = None, in_stock: bool = False, sort: str = "relevance",
+                         db: Session = Depends(get_db)):
+    """
+    带分面统计的商品搜索：返回当前页商品，以及每个分类、每个价格区间的商品数
+    """
+    if sort not in crud.SEARCH_SORTS:
+        raise HTTPException(status_code=400, detail="sort 只能是 relevance、price_asc、price_desc 或 newest")
+
+    filters = dict(keyword=result_cache.normalize_keyword(keyword), category_id=category_id, min_price=min_price,
+                   max_price=max_price, in_stock=in_stock)
+    key = ("faceted", filters["keyword"], limit, category_id, min_price, max_price, in_stock, sort, offset)
+    return await circuit_breaker.catalog_read(key, lambda: {
+        "items": crud.search_products(db, limit=limit, offset=offset, sort=sort, **filters),
+        "facets": crud.get_search_facets(db, **filters),
+    }, response=response)
@@ -0,0 +1,99 @@
+"""
+启动时的数据库结构升级
+
+Base.metadata.create_all 只创建不存在的表，不会修改已存在的表。upgrade 在 create_all 之后
+比较模型和数据库的实际结构，用 ALTER TABLE ... ADD COLUMN 补上模型中新增的列，用 CREATE INDEX
+补上新增的索引（MySQL InnoDB 建二级索引时不阻塞读写，但大表上仍需要一定时间）。
+无法自动补充（NOT NULL 且没有服务端默认值）或执行失败时抛出 SchemaError，服务直接启动失败，
+而不是等到查询时才报 unknown column。
+
+用法：python migrations.py upgrade [--dry-run]
+"""
+import argparse
+import logging
+
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+
+import models
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaError(RuntimeError):
+    pass
+
+
+def _add_column_sql(engine, table, column) -> str:
+    preparer = engine.dialect.identifier_preparer
+    column_type = column.type.compile(dialect=engine.dialect)
+    return f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column_type}"
+
+
+def pending_changes(engine, metadata=models.Base.metadata) -> list:
+    """
+    :return: 使数据库结构与模型一致需要执行的 DDL 语句
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    statements = []
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable and column.server_default is None:
+                raise SchemaError(f"{table.name}.{column.name} 为 NOT NULL 且没有默认值，无法自动添加，需要手动迁移")
+            statements.append(_add_column_sql(engine, table, column))
+        # 名称不同但列相同的索引（包括主键）视为已经存在，避免手工建的表上重复建索引
+        indexes = inspector.get_indexes(table.name)
+        existing_names = {index["name"] for index in indexes}
+        existing_columns = {tuple(index["column_names"]) for index in indexes}
+        existing_columns.add(tuple(inspector.get_pk_constraint(table.name)["constrained_columns"]))
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            columns = tuple(column.name for column in index.columns)
+            if index.name not in existing_names and columns not in existing_columns:
+                statements.append(str(CreateIndex(index).compile(dialect=engine.dialect)))
+    return statements
+
+
+def upgrade(engine, metadata=models.Base.metadata, dry_run: bool = False) -> list:
+    """
+    创建缺少的表，并给已有的表补充缺少的列和索引
+    :param dry_run: 只返回需要执行的语句，不修改数据库
+    :return: 执行（或需要执行）的 DDL 语句
+    """
+    if dry_run:
+        return pending_changes(engine, metadata)
+
+    metadata.create_all(bind=engine)
+    statements = pending_changes(engine, metadata)
+    for statement in statements:
+        logger.warning("升级数据库结构: %s", statement)
+        try:
+            with engine.begin() as conn:
+                conn.exec_driver_sql(statement)
+        except Exception as e:
+            # 多个 worker 同时启动时，可能已经由另一个进程补上
+            if statement not in pending_changes(engine, metadata):
+                continue
+            raise SchemaError(f"数据库结构升级失败，请手动执行: {statement}") from e
+    return statements
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="数据库结构升级工具")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    upgrade_parser = subparsers.add_parser('upgrade', help="创建缺少的表并补充缺少的列和索引")
+    upgrade_parser.add_argument('--dry-run', action='store_true', help="只打印需要执行的语句")
+    args = parser.parse_args()
+
+    from database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    executed = upgrade(engine, dry_run=args.dry_run)
+    for statement in executed:
+        print(statement + ";")
+    print(f"{'需要执行' if args.dry_run else '已执行'} {len(executed)} 条语句")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DECIMAL, ForeignKey, DateTime, Enum
+from sqlalchemy import Column, Integer, String, Text, DECIMAL, ForeignKey, DateTime, Enum, Date, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -21,6 +21,11 @@ class User(Base):
 
 class Product(Base):
 	__tablename__ = 'products'
+	__table_args__ = (
+		# 搜索按分类 + 价格筛选、排序
+		Index('ix_products_category_price', 'category_id', 'price'),
+		Index('ix_products_price', 'price'),
+	)
 
 	id = Column(Integer, primary_key=True, index=True, autoincrement=True)
 	name = Column(String(255), nullable=False)
@@ -29,6 +34,7 @@ class Product(Base):
 	stock = Column(Integer, nullable=False)
 	seller_id = Column(Integer, ForeignKey('users.id'))
 	category_id = Column(Integer, ForeignKey('categories.id'))
+	updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
 	seller = relationship('User', back_populates='products')
 	category = relationship('Category', back_populates='products')
@@ -43,6 +49,7 @@ class ProductImage(Base):
 	id = Column(Integer, primary_key=True, index=True, autoincrement=True)
 	product_id = Column(Integer, ForeignKey('products.id'))
 	image_url = Column(String(255), nullable=False)
+	updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
 	product = relationship('Product', back_populates='images')
 
@@ -52,10 +59,35 @@ class Category(Base):
 
 	id = Column(Integer, primary_key=True, index=True, autoincrement=True)
 	name = Column(String(255), unique=True, nullable=False)
+	updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
 	products = relationship('Product', back_populates='category')
 
 
+class Cart(Base):
+	__tablename__ = 'carts'
+
+	id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+	user_id = Column(Integer, ForeignKey('users.id'), unique=True, nullable=False)
+	created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+	items = relationship('CartItem', back_populates='cart')
+
+
+class CartItem(Base):
+	__tablename__ = 'cart_items'
+	__table_args__ = (
+		UniqueConstraint('cart_id', 'product_id', name='uq_cart_items_product'),
+	)
+
+	id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+	cart_id = Column(Integer, ForeignKey('carts.id'), nullable=False)
+	product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+	quantity = Column(Integer, nullable=False)
+
+	cart = relationship('Cart', back_populates='items')
+
+
 class Order(Base):
 	__tablename__ = 'orders'
 
@@ -85,6 +117,7 @@ class SoldProduct(Base):
 	order_id = Column(Integer, ForeignKey('orders.id'))
 	sold_date = Column(DateTime, nullable=False)
 	quantity = Column(Integer, nullable=False)
+	unit_price = Column(DECIMAL(10, 2))  # 成交单价，商品之后改价不影响销售额；早期记录为空
 
 	seller = relationship('User', foreign_keys=[seller_id])
 	buyer = relationship('User', foreign_keys=[buyer_id])
@@ -92,6 +125,36 @@ class SoldProduct(Base):
 	order = relationship('Order', back_populates='sold_products')
 
 
+class ArchivedOrder(Base):
+	"""已完成/已取消的历史订单，由 order_archive.py 从 orders 表分批迁入，保留原订单 ID"""
+	__tablename__ = 'orders_archive'
+
+	id = Column(Integer, primary_key=True, autoincrement=False)
+	buyer_id = Column(Integer, ForeignKey('users.id'), index=True)
+	order_date = Column(DateTime, nullable=False)
+	status = Column(Enum('pending', 'shipped', 'completed', 'canceled', name='order_status'))
+	total_amount = Column(DECIMAL(10, 2), nullable=False)
+	recipient_name = Column(String(255), nullable=False)
+	phone = Column(String(20), nullable=False)
+	address_line1 = Column(String(255), nullable=False)
+	address_line2 = Column(String(255))
+	archived_at = Column(DateTime, nullable=False)
+
+
+class ArchivedSoldProduct(Base):
+	"""归档订单的已售商品，随订单一起迁入，保留原 ID"""
+	__tablename__ = 'sold_products_archive'
+
+	id = Column(Integer, primary_key=True, autoincrement=False)
+	seller_id = Column(Integer, ForeignKey('users.id'), index=True)
+	buyer_id = Column(Integer, ForeignKey('users.id'))
+	product_id = Column(Integer, ForeignKey('products.id'))
+	order_id = Column(Integer, ForeignKey('orders_archive.id'), index=True)
+	sold_date = Column(DateTime, nullable=False)
+	quantity = Column(Integer, nullable=False)
+	unit_price = Column(DECIMAL(10, 2))
+
+
 class Review(Base):
 	__tablename__ = 'reviews'
 
@@ -101,6 +164,42 @@ class Review(Base):
 	rating = Column(Integer, nullable=False)  # Assuming a rating scale of 1-5
 	review = Column(Text)
 	created_at = Column(DateTime, default=datetime.datetime.utcnow)
+	updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
 	product = relationship('Product', back_populates='reviews')
 	user = relationship('User', back_populates='reviews')
+
+
+class SellerSalesDaily(Base):
+	"""卖家按商品、按天的销售汇总，下单/取消订单后由后台任务增量维护"""
+	__tablename__ = 'seller_sales_daily'
+	__table_args__ = (
+		UniqueConstraint('seller_id', 'sales_date', 'product_id', name='uq_seller_sales_daily'),
+	)
+
+	id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+	seller_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+	product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+	sales_date = Column(Date, nullable=False)
+	units = Column(Integer, nullable=False, default=0)  # 销量
+	revenue = Column(DECIMAL(12, 2), nullable=False, default=0)  # 销售额
+
+
+class SalesRollupApplied(Base):
+	"""已计入 seller_sales_daily 的订单，后台任务重放时据此跳过，每个订单只累加、扣减各一次"""
+	__tablename__ = 'seller_sales_applied'
+
+	order_id = Column(Integer, primary_key=True, autoincrement=False)
+	kind = Column(Enum('record', 'revert', name='sales_applied_kind'), primary_key=True)
+	applied_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class ChangeLog(Base):
+	"""商品目录变更记录，由 Session 的 after_flush 钩子写入，id 即同步游标"""
+	__tablename__ = 'change_log'
+
+	id = Column(Integer, primary_key=True, autoincrement=True)
+	entity = Column(String(20), nullable=False)  # product / image / category / review
+	entity_id = Column(Integer, nullable=False)
+	op = Column(Enum('upsert', 'delete', name='change_op'), nullable=False)
+	changed_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,178 @@
+"""
+历史订单归档：把较早的已完成/已取消订单及其已售商品迁入归档表
+
+orders / sold_products 只保留近期和进行中的订单，查询扫描的数据量不随历史增长。
+归档按订单 ID 分批进行，每批一个短事务（INSERT ... SELECT 到归档表，再从热表 DELETE），
+批次之间短暂停顿，不会长时间锁住热表。归档保留原 ID，订单详情和订单列表查询在热表中
+找不到时回退到归档表，对客户端透明。
+
+用法：python order_archive.py run --days 180 --batch-size 200
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, literal
+from sqlalchemy.orm import Session
+
+import migrations
+import models
+
+ARCHIVABLE_STATUSES = ('completed', 'canceled')
+
+ORDER_COLUMNS = ('id', 'buyer_id', 'order_date', 'status', 'total_amount', 'recipient_name', 'phone',
+                 'address_line1', 'address_line2')
+SOLD_PRODUCT_COLUMNS = ('id', 'seller_id', 'buyer_id', 'product_id', 'order_id', 'sold_date', 'quantity',
+                        'unit_price')
+
+
+def archive_batch(db: Session, order_ids: list) -> int:
+    """
+    在一个事务中把指定订单及其已售商品迁入归档表
+    :return: 归档的订单数
+    """
+    archived_at = datetime.utcnow()
+    orders = models.Order.__table__
+    sold = models.SoldProduct.__table__
+    condition = orders.c.id.in_(order_ids) & orders.c.status.in_(ARCHIVABLE_STATUSES)
+
+    try:
+        # 锁定本批订单，避免与并发的状态修改交错
+        ids = [row[0] for row in db.execute(orders.select().with_only_columns(orders.c.id)
+                                            .where(condition).with_for_update())]
+        if not ids:
+            db.rollback()
+            return 0
+
+        order_columns = [orders.c[name] for name in ORDER_COLUMNS]
+        db.execute(insert(models.ArchivedOrder.__table__).from_select(
+            list(ORDER_COLUMNS) + ['archived_at'],
+            orders.select().with_only_columns(
+                *order_columns, literal(archived_at, models.ArchivedOrder.archived_at.type)
+            ).where(orders.c.id.in_(ids)),
+        ))
+        db.execute(insert(models.ArchivedSoldProduct.__table__).from_select(
+            list(SOLD_PRODUCT_COLUMNS),
+            sold.select().with_only_columns(*[sold.c[name] for name in SOLD_PRODUCT_COLUMNS])
+            .where(sold.c.order_id.in_(ids)),
+        ))
+        db.execute(sold.delete().where(sold.c.order_id.in_(ids)))
+        db.execute(orders.delete().where(orders.c.id.in_(ids)))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(ids)
+
+
+def archive_orders(db: Session, older_than_days: int = 180, batch_size: int = 200, pause: float = 0.1,
+                   max_batches: int = None) -> int:
+    """
+    分批归档 older_than_days 天之前已完成/已取消的订单
+    :param pause: 每批之间停顿的秒数，给线上请求让出锁和连接
+    :param max_batches: 最多执行的批数，None 表示全部归档
+    :return: 归档的订单总数
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    total = 0
+    last_id = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        order_ids = [
+            row[0] for row in
+            db.query(models.Order.id)
+            .filter(models.Order.id > last_id,
+                    models.Order.order_date < cutoff,
+                    models.Order.status.in_(ARCHIVABLE_STATUSES))
+            .order_by(models.Order.id)
+            .limit(batch_size)
+            .all()
+        ]
+        db.commit()  # 结束只读事务，不在批次之间持有快照
+        if not order_ids:
+            break
+        last_id = order_ids[-1]
+        total += archive_batch(db, order_ids)
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    return total
+
+
+def order_details(order, sold_products) -> dict:
+    """
+    订单详情的返回结构，热表和归档表共用
+    """
+    return {
+        "id": order.id,
+        "buyer_id": order.buyer_id,
+        "order_date": order.order_date,
+        "status": order.status,
+        "total_amount": order.total_amount,
+        "recipient_name": order.recipient_name,
+        "phone": order.phone,
+        "address_line1": order.address_line1,
+        "address_line2": order.address_line2,
+        "products": [
+            {
+                "product_id": sold.product_id,
+                "quantity": sold.quantity,
+                "sold_date": sold.sold_date,
+                "seller_id": sold.seller_id,
+            }
+            for sold in sold_products
+        ],
+    }
+
+
+def get_archived_order_details(db: Session, order_id: int):
+    """
+    :return: 与 crud.get_order_details 相同结构的字典，不存在时返回 None
+    """
+    order = db.query(models.ArchivedOrder).filter(models.ArchivedOrder.id == order_id).first()
+    if order is None:
+        return None
+    sold_products = (
+        db.query(models.ArchivedSoldProduct)
+        .filter(models.ArchivedSoldProduct.order_id == order_id)
+        .all()
+    )
+    return order_details(order, sold_products)
+
+
+def get_archived_order_ids(db: Session, user_id: int):
+    """
+    :return: (作为买家的归档订单号, 作为卖家的归档订单号)
+    """
+    buyer_orders = [
+        row[0] for row in db.query(models.ArchivedOrder.id).filter(models.ArchivedOrder.buyer_id == user_id)
+    ]
+    seller_orders = [
+        row[0] for row in
+        db.query(models.ArchivedSoldProduct.order_id)
+        .filter(models.ArchivedSoldProduct.seller_id == user_id)
+        .distinct()
+    ]
+    return buyer_orders, seller_orders
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="历史订单归档工具")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help="归档较早的已完成/已取消订单")
+    run_parser.add_argument('--days', type=int, default=180, help="归档多少天之前的订单")
+    run_parser.add_argument('--batch-size', type=int, default=200)
+    run_parser.add_argument('--pause', type=float, default=0.1, help="每批之间停顿的秒数")
+    run_parser.add_argument('--max-batches', type=int, default=None)
+    args = parser.parse_args()
+
+    from database import SessionLocal, engine
+
+    migrations.upgrade(engine)
+    session = SessionLocal()
+    try:
+        count = archive_orders(session, older_than_days=args.days, batch_size=args.batch_size,
+                               pause=args.pause, max_batches=args.max_batches)
+        print(f"已归档 {count} 个订单")
+    finally:
+        session.close()
@@ -0,0 +1,179 @@
+"""
+线上性能排查：按需采样的剖析器和单个请求的耗时分解
+
+- SamplingProfiler 在指定时间内每隔 interval 秒用 sys._current_frames() 抓取所有线程
+  （包括事件循环线程和线程池）的调用栈，输出 flamegraph.pl / speedscope 可直接读取的
+  collapsed stack 格式。只读取栈帧，不安装 trace 钩子，对被采样的请求几乎没有额外开销
+- 请求带上 X-Debug-Timing: 1 时，ServerTimingMiddleware 在响应中附加 Server-Timing 头，
+  给出数据库、认证、序列化和总耗时；认证耗时包含其中的数据库查询。耗时会暴露查询次数等内部信息，
+  只有设置环境变量 DEBUG_TIMING=1 时才开启，默认关闭
+"""
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import fastapi.routing
+from sqlalchemy import event
+
+MAX_SECONDS = 60
+TIMING_HEADER = b"x-debug-timing"
+
+# 这些文件中的栈顶帧表示线程在空闲等待（线程池等任务、事件循环等 IO）
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "thread.py")
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _label(code) -> str:
+    parts = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(parts[-2:])}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, max_depth: int = 128):
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float, interval: float = 0.005, include_idle: bool = False) -> Counter:
+        """
+        采样 seconds 秒，同一时间只允许一次采样
+        :return: Counter({"线程名;外层函数;...;栈顶函数": 采样次数})
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            me = threading.get_ident()
+            stacks = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    if not include_idle and frame.f_code.co_filename.endswith(_IDLE_FILES):
+                        continue
+                    labels = []
+                    while frame is not None and len(labels) < self.max_depth:
+                        labels.append(_label(frame.f_code))
+                        frame = frame.f_back
+                    labels.append(names.get(ident, str(ident)))
+                    stacks[";".join(reversed(labels))] += 1
+                time.sleep(interval)
+            return stacks
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def collapse(stacks: Counter) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+# 当前请求的耗时分解；只有带 X-Debug-Timing 头的请求才创建
+_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def span(name: str):
+    """
+    累计代码块耗时到当前请求的 name 项，未开启耗时分解时不做任何事
+    """
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _timings.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _timings.get()
+    if timings is not None and conn.info.get("query_start"):
+        timings["db"] = timings.get("db", 0.0) + time.perf_counter() - conn.info["query_start"].pop()
+        timings["db_queries"] = timings.get("db_queries", 0) + 1
+
+
+def install(engine):
+    """
+    统计数据库耗时，并计时 FastAPI 的响应序列化（FastAPI 没有提供序列化钩子，只能包装该函数）
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    serialize_response = fastapi.routing.serialize_response
+    if getattr(serialize_response, "_timed", False):
+        return
+
+    async def timed_serialize_response(*args, **kwargs):
+        with span("serialize"):
+            return await serialize_response(*args, **kwargs)
+
+    timed_serialize_response._timed = True
+    fastapi.routing.serialize_response = timed_serialize_response
+
+
+def _server_timing(timings: dict, total: float) -> bytes:
+    entries = []
+    for name in ("db", "auth", "serialize"):
+        if name in timings:
+            entry = f"{name};dur={timings[name] * 1000:.2f}"
+            if name == "db":
+                entry += f';desc="{timings.get("db_queries", 0)} queries"'
+            entries.append(entry)
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries).encode("latin-1")
+
+
+def timing_enabled() -> bool:
+    return os.environ.get("DEBUG_TIMING", "").strip().lower() in ("1", "true", "yes")
+
+
+class ServerTimingMiddleware:
+    def __init__(self, app, enabled: bool = None):
+        """
+        :param enabled: 是否响应 X-Debug-Timing 头，默认读取环境变量 DEBUG_TIMING
+        """
+        self.app = app
+        self.enabled = timing_enabled() if enabled is None else enabled
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http" or not any(
+                name == TIMING_HEADER and value == b"1" for name, value in scope["headers"]):
+            return await self.app(scope, receive, send)
+
+        timings = {}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", _server_timing(timings, time.perf_counter() - start))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+
+
+def admin_usernames() -> set:
+    return {name.strip() for name in os.environ.get("ADMIN_USERNAMES", "").split(",") if name.strip()}
+
+
+# 全局采样剖析器
+profiler = SamplingProfiler()
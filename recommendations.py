@@ -0,0 +1,200 @@
+"""
+“买了该商品的用户还买了” —— 基于 sold_products 的商品共现索引
+
+每个商品只保留固定容量的候选邻居（Space-Saving 算法），邻居 ID 和共现次数存放在
+array 中，内存占用与商品数成正比，与历史订单量无关。索引在启动时从数据库（包括归档的
+历史订单，不含已取消的订单）分批构建，之后随新订单增量更新、随订单取消扣减，查询完全在内存中完成。
+"""
+import threading
+from array import array
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+import models
+
+
+class CoPurchaseIndex:
+    def __init__(self, top_k: int = 10, capacity: int = None):
+        """
+        :param top_k: 每个商品最多返回的相关商品数
+        :param capacity: 每个商品保留的候选邻居数，越大结果越准确，默认 top_k 的 4 倍
+        """
+        self.top_k = top_k
+        self.capacity = capacity or top_k * 4
+        self.ready = False
+        self._neighbors = {}  # product_id -> (邻居 ID array, 共现次数 array)
+        self._lock = threading.Lock()
+        self._pending = None  # 重建期间到达的新订单和取消的订单，重建完成后补录
+        self._scanned_order_id = 0  # 重建时 sold_products 已经扫描到的订单 ID
+
+    def _bump(self, neighbors, product_id: int, other_id: int, weight: int = 1):
+        entry = neighbors.get(product_id)
+        if entry is None:
+            neighbors[product_id] = (array('l', [other_id]), array('l', [weight]))
+            return
+        ids, counts = entry
+        try:
+            pos = ids.index(other_id)
+        except ValueError:
+            if len(ids) < self.capacity:
+                ids.append(other_id)
+                counts.append(weight)
+                return
+            # 容量已满：替换计数最小的邻居，并继承其计数（Space-Saving）
+            pos = min(range(len(counts)), key=counts.__getitem__)
+            ids[pos] = other_id
+        counts[pos] += weight
+
+    @staticmethod
+    def _unbump(neighbors, product_id: int, other_id: int):
+        # 已被替换出候选的邻居无法扣减，Space-Saving 的计数本身就是近似值
+        entry = neighbors.get(product_id)
+        if entry is None or other_id not in entry[0]:
+            return
+        ids, counts = entry
+        pos = ids.index(other_id)
+        if counts[pos] > 1:
+            counts[pos] -= 1
+            return
+        del ids[pos]
+        del counts[pos]
+        if not ids:
+            del neighbors[product_id]
+
+    def _add_basket(self, neighbors, product_ids, weight: int = 1):
+        """
+        :param weight: 1 表示加入订单，-1 表示扣减已取消的订单
+        """
+        basket = set(product_ids)
+        if len(basket) < 2:
+            return
+        for product_id in basket:
+            for other_id in basket:
+                if other_id == product_id:
+                    continue
+                if weight > 0:
+                    self._bump(neighbors, product_id, other_id)
+                else:
+                    self._unbump(neighbors, product_id, other_id)
+
+    def add_order(self, order_id: int, product_ids):
+        """
+        新订单写入后增量更新索引
+        :param order_id: 订单 ID
+        :param product_ids: 同一订单中的商品 ID
+        """
+        product_ids = list(product_ids)
+        with self._lock:
+            self._add_basket(self._neighbors, product_ids)
+            if self._pending is not None:
+                self._pending.append((order_id, product_ids, 1, False))
+
+    def remove_order(self, order_id: int, product_ids):
+        """
+        订单取消后扣减共现次数
+        :param order_id: 订单 ID
+        :param product_ids: 同一订单中的商品 ID
+        """
+        product_ids = list(product_ids)
+        with self._lock:
+            self._add_basket(self._neighbors, product_ids, -1)
+            if self._pending is not None:
+                # 扫描已经读到的订单（当时还未取消）在新索引中也要扣减；还没读到的，扫描时会按状态跳过
+                self._pending.append((order_id, product_ids, -1, order_id <= self._scanned_order_id))
+
+    def related(self, product_id: int, limit: int = None):
+        """
+        返回与该商品共同购买次数最多的商品
+        :return: (product_id, 共现次数) 列表，按次数降序
+        """
+        limit = min(limit or self.top_k, self.top_k)
+        with self._lock:
+            entry = self._neighbors.get(product_id)
+            if entry is None:
+                return []
+            pairs = list(zip(entry[1], entry[0]))
+        pairs.sort(reverse=True)
+        return [(other_id, count) for count, other_id in pairs[:limit]]
+
+    def _scan(self, db: Session, neighbors, sold_model, order_model, chunk_size: int) -> int:
+        """
+        按 (order_id, id) 分批读取一张已售商品表，把每个未取消订单的商品加入 neighbors
+        :return: 读到的最大订单 ID
+        """
+        basket_order, basket = None, []
+        last_order_id, last_id = 0, 0
+        while True:
+            rows = (
+                db.query(sold_model.order_id, sold_model.id, sold_model.product_id)
+                .join(order_model, order_model.id == sold_model.order_id)
+                .filter(order_model.status != 'canceled')
+                .filter(or_(
+                    sold_model.order_id > last_order_id,
+                    and_(sold_model.order_id == last_order_id, sold_model.id > last_id)
+                ))
+                .order_by(sold_model.order_id, sold_model.id)
+                .limit(chunk_size)
+                .all()
+            )
+            if not rows:
+                break
+            for order_id, _, product_id in rows:
+                if order_id != basket_order:
+                    self._add_basket(neighbors, basket)
+                    basket_order, basket = order_id, []
+                basket.append(product_id)
+            last_order_id, last_id = rows[-1][0], rows[-1][1]
+            if sold_model is models.SoldProduct:
+                with self._lock:
+                    self._scanned_order_id = last_order_id
+        self._add_basket(neighbors, basket)
+        return last_order_id
+
+    def rebuild(self, db: Session, chunk_size: int = 5000):
+        """
+        分批读取归档表和 sold_products 重建索引，完成后整体替换
+        """
+        with self._lock:
+            self._pending = []
+            self._scanned_order_id = 0
+        try:
+            neighbors = {}
+            last_order_id = max(
+                self._scan(db, neighbors, sold_model, order_model, chunk_size)
+                for sold_model, order_model in ((models.ArchivedSoldProduct, models.ArchivedOrder),
+                                                (models.SoldProduct, models.Order))
+            )
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            # 补录重建期间写入、但扫描时还没读到的订单；这些订单被取消时同样补录扣减
+            for order_id, product_ids, weight, scanned in self._pending:
+                if order_id > last_order_id or scanned:
+                    self._add_basket(neighbors, product_ids, weight)
+            self._pending = None
+            self._neighbors = neighbors
+            self.ready = True
+
+
+# 全局共现索引
+index = CoPurchaseIndex()
+
+
+def rebuild_in_background(session_factory):
+    """
+    在后台线程中构建索引，避免阻塞服务启动
+    """
+    def run():
+        db = session_factory()
+        try:
+            index.rebuild(db)
+        finally:
+            db.close()
+
+    thread = threading.Thread(target=run, name="co-purchase-index", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,186 @@
+"""
+搜索和商品列表的结果缓存
+
+- lists：按规范化后的查询参数缓存商品 ID 列表（而不是完整结果），按估算的内存占用做 LRU 淘汰，
+  每类查询有自己的 TTL。每个条目带有标签（category:<id>、seller:<id>、search:all），
+  发布商品、库存变化时按标签失效
+- cards：按商品 ID 缓存列表中展示的商品信息，库存变化、图片变化时按 ID 失效
+
+响应由缓存的 ID 列表加商品信息缓存拼装，商品信息缺失时用一次 IN 查询补齐。
+缓存在进程内，多 worker 部署时其他 worker 的修改要等 TTL 过期后才可见。
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# 各类列表的 TTL（秒）
+TTLS = {
+    "search": 60,
+    "seller": 300,
+    "category_pool": 300,
+}
+
+# 分类随机推荐的 ID 池最多保存的商品数
+CATEGORY_POOL_SIZE = 5000
+
+
+def normalize_keyword(keyword):
+    """
+    搜索使用不区分大小写的 ilike，关键字去掉首尾空白、转小写后结果不变
+    """
+    if keyword is None:
+        return None
+    keyword = keyword.strip().lower()
+    return keyword or None
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, clock=time.monotonic):
+        """
+        :param max_bytes: 所有条目估算内存占用的上限
+        """
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (过期时间, ids, 标签, 估算字节数)
+        self._tags = {}  # 标签 -> set(key)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def _size(key, ids) -> int:
+        # tuple 本身 + 每个整数对象和指针
+        return sys.getsizeof(key) + sys.getsizeof(ids) + 28 * len(ids) + 200
+
+    def _remove(self, key):
+        _, _, tags, size = self._entries.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key):
+        """
+        :return: 缓存的 ID 元组，不存在或已过期时返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    self._remove(key)
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[1]
+
+    def put(self, key, ids, ttl: float, tags=()):
+        ids = tuple(ids)
+        size = self._size(key, ids)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self.clock() + ttl, ids, frozenset(tags), size)
+            self._bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+        return ids
+
+    def invalidate(self, tags) -> int:
+        """
+        删除带有任一标签的条目
+        :return: 删除的条目数
+        """
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys |= self._tags.get(tag, set())
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+            self._counters["invalidations"] += len(keys)
+            return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    **self._counters}
+
+
+class CardCache:
+    def __init__(self, max_entries: int = 20000, ttl: float = 30, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # product_id -> (过期时间, 商品信息)
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+
+    def get_many(self, product_ids):
+        """
+        :return: ({product_id: 商品信息}, 缺失的 ID 列表)
+        """
+        found = {}
+        missing = []
+        now = self.clock()
+        with self._lock:
+            for product_id in product_ids:
+                entry = self._entries.get(product_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(product_id)
+                    found[product_id] = entry[1]
+                else:
+                    missing.append(product_id)
+            self._counters["hits"] += len(found)
+            self._counters["misses"] += len(missing)
+        return found, missing
+
+    def put_many(self, cards: dict):
+        expires_at = self.clock() + self.ttl
+        with self._lock:
+            for product_id, card in cards.items():
+                self._entries[product_id] = (expires_at, card)
+                self._entries.move_to_end(product_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, product_ids):
+        with self._lock:
+            for product_id in product_ids:
+                self._entries.pop(product_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), **self._counters}
+
+
+def product_created(category_id: int, seller_id: int):
+    """
+    新商品会出现在该分类、该卖家的列表和不限分类的搜索中
+    """
+    lists.invalidate([f"category:{category_id}", f"seller:{seller_id}", "search:all"])
+
+
+def stock_changed(product_ids, sold_out_categories=()):
+    """
+    库存变化后刷新商品信息；有商品售罄时，只看有货商品的搜索结果也会变化
+    """
+    cards.invalidate(product_ids)
+    if sold_out_categories:
+        lists.invalidate([f"category:{category_id}" for category_id in sold_out_categories] + ["search:all"])
+
+
+def stats() -> dict:
+    return {"lists": lists.stats(), "cards": cards.stats()}
+
+
+# 全局结果缓存
+lists = ResultCache()
+cards = CardCache()
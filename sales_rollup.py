@@ -0,0 +1,258 @@
+"""
+卖家销售汇总（seller_sales_daily）的增量维护、查询和回填
+
+- 下单后由后台任务（tasks.record_order_sales）调用 record_order_sales 累加销量和销售额
+- 订单取消后由后台任务调用 revert_orders 按已售记录中的成交单价扣减，商品改价不会使汇总产生偏差
+- 每个订单累加、扣减各只生效一次（seller_sales_applied 记录已处理的订单），任务日志重放时不会重复计入
+- 历史数据可以通过 `python sales_rollup.py backfill` 分批流式重建
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import circuit_breaker
+import migrations
+import models
+
+# 汇总表的唯一键
+ROLLUP_KEY = ('seller_id', 'sales_date', 'product_id')
+
+PERIODS = ('day', 'week', 'month')
+
+
+def _sale_price(sold_model):
+    """
+    成交单价；记录成交单价之前的早期已售记录只能按商品当前价格计算
+    """
+    return func.coalesce(sold_model.unit_price, models.Product.price)
+
+
+def _merge_rows(rows):
+    """
+    合并相同 (seller_id, sales_date, product_id) 的增量
+    :param rows: (seller_id, product_id, sold_at, quantity, unit_price) 元组的可迭代对象
+    """
+    merged = defaultdict(lambda: [0, Decimal('0')])
+    for seller_id, product_id, sold_at, quantity, unit_price in rows:
+        sales_date = sold_at.date() if isinstance(sold_at, datetime) else sold_at
+        entry = merged[(seller_id, sales_date, product_id)]
+        entry[0] += quantity
+        entry[1] += Decimal(str(unit_price)) * quantity
+    return [
+        {"seller_id": key[0], "sales_date": key[1], "product_id": key[2], "units": units, "revenue": revenue}
+        for key, (units, revenue) in merged.items()
+    ]
+
+
+def _upsert(db: Session, rows):
+    """
+    以一条 INSERT ... ON DUPLICATE KEY UPDATE 语句把增量累加到汇总表
+    """
+    if not rows:
+        return
+    table = models.SellerSalesDaily.__table__
+    dialect = db.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update(
+            units=table.c.units + stmt.inserted.units,
+            revenue=table.c.revenue + stmt.inserted.revenue,
+        )
+    else:
+        # 本地测试使用的 SQLite / PostgreSQL
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(ROLLUP_KEY),
+            set_={
+                "units": table.c.units + stmt.excluded.units,
+                "revenue": table.c.revenue + stmt.excluded.revenue,
+            },
+        )
+    db.execute(stmt)
+
+
+def _claim(db: Session, order_ids, kind: str):
+    """
+    记录订单已经累加（record）或扣减（revert），与汇总更新在同一事务中提交
+    :return: 之前尚未处理过的订单 ID 列表
+    """
+    order_ids = set(order_ids)
+    if not order_ids:
+        return []
+    applied = {
+        row[0] for row in
+        db.query(models.SalesRollupApplied.order_id)
+        .filter(models.SalesRollupApplied.order_id.in_(order_ids), models.SalesRollupApplied.kind == kind)
+    }
+    new_ids = sorted(order_ids - applied)
+    db.add_all([models.SalesRollupApplied(order_id=order_id, kind=kind) for order_id in new_ids])
+    db.flush()
+    return new_ids
+
+
+def record_sales(db: Session, sales):
+    """
+    累加新售出商品的销量和销售额，不提交事务，由调用方统一 commit
+    :param sales: (seller_id, product_id, sold_at, quantity, unit_price) 元组列表
+    """
+    _upsert(db, _merge_rows(sales))
+
+
+def record_order_sales(db: Session, order_id: int, sales) -> bool:
+    """
+    累加一个订单的销量和销售额，同一订单只累加一次，不提交事务
+    :return: 是否累加（订单已经计入过时返回 False）
+    """
+    if not _claim(db, [order_id], 'record'):
+        return False
+    record_sales(db, sales)
+    return True
+
+
+def revert_orders(db: Session, order_ids):
+    """
+    订单取消时从汇总表中扣减对应的销量和销售额，同一订单只扣减一次，不提交事务
+    :param order_ids: 被取消的订单 ID 列表
+    """
+    order_ids = _claim(db, order_ids, 'revert')
+    if not order_ids:
+        return
+    sold = (
+        db.query(
+            models.SoldProduct.seller_id,
+            models.SoldProduct.product_id,
+            models.SoldProduct.sold_date,
+            models.SoldProduct.quantity,
+            _sale_price(models.SoldProduct),
+        )
+        .outerjoin(models.Product, models.Product.id == models.SoldProduct.product_id)
+        .filter(models.SoldProduct.order_id.in_(order_ids))
+        .all()
+    )
+    _upsert(db, _merge_rows(
+        (seller_id, product_id, sold_at, -quantity, price)
+        for seller_id, product_id, sold_at, quantity, price in sold
+    ))
+
+
+def _period_start(day: date, period: str) -> date:
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def get_seller_sales(db: Session, seller_id: int, period: str = 'day', start: date = None, end: date = None,
+                     product_id: int = None):
+    """
+    按天 / 周 / 月读取卖家每个商品的销量和销售额
+    :param period: day, week 或 month
+    :param start: 起始日期（含），默认 30 天前
+    :param end: 结束日期（含），默认今天
+    :return: 按周期和商品排序的汇总列表
+    """
+    if period not in PERIODS:
+        raise ValueError(f"period 必须是 {', '.join(PERIODS)} 之一")
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=30)
+
+    query = db.query(
+        models.SellerSalesDaily.sales_date,
+        models.SellerSalesDaily.product_id,
+        models.SellerSalesDaily.units,
+        models.SellerSalesDaily.revenue,
+    ).filter(
+        models.SellerSalesDaily.seller_id == seller_id,
+        models.SellerSalesDaily.sales_date >= start,
+        models.SellerSalesDaily.sales_date <= end,
+    )
+    if product_id is not None:
+        query = query.filter(models.SellerSalesDaily.product_id == product_id)
+
+    totals = defaultdict(lambda: [0, Decimal('0')])
+    for sales_date, row_product_id, units, revenue in query:
+        entry = totals[(_period_start(sales_date, period), row_product_id)]
+        entry[0] += units
+        entry[1] += Decimal(str(revenue))
+
+    return [
+        {"period": period_start, "product_id": row_product_id, "units": units, "revenue": float(revenue)}
+        for (period_start, row_product_id), (units, revenue) in sorted(totals.items())
+    ]
+
+
+def backfill(db: Session, chunk_size: int = 1000):
+    """
+    根据 sold_products 及其归档表的历史记录重建汇总表（不含已取消订单）。按主键分批（keyset）读取，
+    每批写入一次并提交，内存占用与历史数据量无关，也不会长时间占用远程数据库游标。
+    回填过的订单同时记为已处理，之后执行的同一订单的后台任务不会重复计入。
+    建议在低峰期执行。
+    :return: 处理的 sold_products 行数
+    """
+    circuit_breaker.long_running(db)  # 全量扫描历史表，不计慢查询
+    db.query(models.SellerSalesDaily).delete(synchronize_session=False)
+    db.query(models.SalesRollupApplied).delete(synchronize_session=False)
+    db.commit()
+
+    processed = 0
+    for sold_model, order_model in ((models.ArchivedSoldProduct, models.ArchivedOrder),
+                                    (models.SoldProduct, models.Order)):
+        last_id = 0
+        while True:
+            chunk = (
+                db.query(
+                    sold_model.id,
+                    sold_model.seller_id,
+                    sold_model.product_id,
+                    sold_model.sold_date,
+                    sold_model.quantity,
+                    _sale_price(sold_model),
+                    order_model.id,
+                    order_model.status,
+                )
+                .outerjoin(models.Product, models.Product.id == sold_model.product_id)
+                .join(order_model, order_model.id == sold_model.order_id)
+                .filter(sold_model.id > last_id)
+                .order_by(sold_model.id)
+                .limit(chunk_size)
+                .all()
+            )
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            record_sales(db, [tuple(row[1:6]) for row in chunk if row[7] != 'canceled'])
+            _claim(db, [row[6] for row in chunk], 'record')
+            _claim(db, [row[6] for row in chunk if row[7] == 'canceled'], 'revert')
+            db.commit()
+            processed += len(chunk)
+
+    return processed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="卖家销售汇总维护工具")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subparsers.add_parser('backfill', help="根据历史订单重建 seller_sales_daily")
+    backfill_parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    from database import SessionLocal, engine
+
+    migrations.upgrade(engine)
+    session = SessionLocal()
+    try:
+        count = backfill(session, chunk_size=args.chunk_size)
+        print(f"已回填 {count} 条已售记录")
+    finally:
+        session.close()
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, date
 from enum import Enum
 
 
@@ -59,6 +59,23 @@ class OrderStatusEnum(str, Enum):
 class OrderStatusUpdate(BaseModel):
     status: str
 
+
+# 批量修改订单状态
+class OrderStatusBatchItem(BaseModel):
+    order_id: int
+    status: OrderStatusEnum
+
+
+class OrderStatusBatchUpdate(BaseModel):
+    items: List[OrderStatusBatchItem]
+
+
+class OrderStatusBatchResult(BaseModel):
+    order_id: int
+    success: bool
+    status: Optional[str] = None  # 处理后的订单状态
+    detail: Optional[str] = None  # 失败原因
+
 # 订单创建模型
 class OrderCreate(BaseModel):
     buyer_id: int
@@ -90,6 +107,14 @@ class Order(BaseModel):
         from_attributes = True
 
 
+# 卖家销售汇总
+class SellerSalesRollup(BaseModel):
+    period: date  # 周期起始日（按周为周一，按月为 1 号）
+    product_id: int
+    units: int
+    revenue: float
+
+
 # 评论相关模式
 class CommentCreate(BaseModel):
     product_id: int
@@ -190,4 +215,18 @@ class ReviewResponse(BaseModel):
     created_at: datetime
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+# 购物车相关模式
+class CartItemAdd(BaseModel):
+    product_id: int
+    quantity: int = 1
+
+
+class CartItemUpdate(BaseModel):
+    quantity: int  # 为 0 时从购物车移除
+
+
+class CartCheckout(BaseModel):
+    receipt_info: ReceiptInfo
@@ -0,0 +1,85 @@
+"""
+请求合并（single-flight）：相同参数的并发读请求共享同一次数据库查询
+
+同一个键第一个到达的请求（leader）在线程池中执行查询，查询期间到达的相同请求（follower）
+等待并直接使用它的结果或异常；查询结束后键即被移除，不做缓存，之后的请求重新查询。
+follower 最多等待 timeout 秒，超时后由第一个超时的 follower 重新发起查询，其余请求改为等待它，
+卡住的 leader 不会让后面的请求一直等下去。
+"""
+import asyncio
+import threading
+
+from starlette.concurrency import run_in_threadpool
+
+
+class _LeaderGone(Exception):
+    """leader 请求被取消（客户端断开），follower 需要自己重新查询"""
+
+
+class SingleFlight:
+    def __init__(self, timeout: float = 5.0):
+        """
+        :param timeout: follower 等待 leader 的最长秒数
+        """
+        self.timeout = timeout
+        self._calls = {}  # key -> asyncio.Future
+        self._totals = {"executed": 0, "collapsed": 0, "timeouts": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, field: str):
+        with self._lock:
+            self._totals[field] += 1
+
+    async def do(self, key, fn, *args):
+        """
+        执行 fn(*args)，同一个键的并发调用只执行一次
+        :param key: 可哈希的键，应包含接口名和全部查询参数
+        :param fn: 同步函数，在线程池中执行
+        """
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                return await self._lead(key, fn, args)
+
+            self._count("collapsed")
+            try:
+                # shield：本请求超时或断开时不取消共享的 future
+                return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            except asyncio.TimeoutError:
+                self._count("timeouts")
+                if self._calls.get(key) is future:
+                    del self._calls[key]  # 放弃卡住的 leader，下一轮由本请求重新查询
+            except _LeaderGone:
+                pass
+
+    async def _lead(self, key, fn, args):
+        future = asyncio.get_running_loop().create_future()
+        # 没有 follower 时，避免 “exception was never retrieved” 警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        self._count("executed")
+        try:
+            result = await run_in_threadpool(fn, *args)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            future.set_exception(_LeaderGone())
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def stats(self) -> dict:
+        """
+        只返回总计数：键中包含用户的搜索关键字和筛选参数，不能对外展示
+        """
+        with self._lock:
+            return {**self._totals, "in_flight": len(self._calls)}
+
+
+# 全局请求合并器
+group = SingleFlight()
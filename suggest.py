@@ -0,0 +1,310 @@
+"""
+搜索框输入联想：商品名和分类名的前缀索引
+
+所有名称按规范化（去空格、casefold）后的文本排序，用二分查找定位前缀区间。每个名称只保存一份
+原始字符串，规范化文本在比较时现算；实体 ID 和权重保存在与之对齐的 array 中，而不是为每个字符
+建字典节点的 trie。商品权重取未取消订单的销量，分类权重取商品数。
+
+区间较小时直接在区间内取权重最高的前几项；区间很大时使用按前缀缓存、随插入和销量变化增量维护的
+前 K 名结果。单个字符的前缀区间最大，它们的结果在重建时一次算好并常驻，不参与 LRU 淘汰。
+"""
+import heapq
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+
+PRODUCT = 'p'
+CATEGORY = 'c'
+KIND_NAMES = {PRODUCT: "product", CATEGORY: "category"}
+
+MAX_KEY_CHARS = 64  # 只索引名称的前 64 个字符
+MAX_SUGGESTIONS = 20
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+def _text(name: str) -> str:
+    return normalize(name)[:MAX_KEY_CHARS]
+
+
+def _code(kind: str, entity_id: int) -> int:
+    # 类型和 ID 编码成一个整数，同名的商品、分类也能排出唯一的顺序
+    return entity_id * 2 + (kind == CATEGORY)
+
+
+def _decode(code: int):
+    return (CATEGORY if code & 1 else PRODUCT), code >> 1
+
+
+class PrefixIndex:
+    def __init__(self, scan_limit: int = 1000, cache_size: int = 4096):
+        """
+        :param scan_limit: 前缀区间不超过该长度时直接扫描区间
+        :param cache_size: 大区间前缀结果缓存的最大条目数
+        """
+        self.scan_limit = scan_limit
+        self.cache_size = cache_size
+        self.ready = False
+        self._names = []  # 原始名称，按 (规范化文本, code) 排序
+        self._codes = array('q')  # 与 _names 对齐的实体编码
+        self._weights = array('d')  # 与 _names 对齐的权重
+        self._name_of = {}  # code -> 名称（与 _names 中是同一个字符串对象），用于定位条目
+        self._top_cache = OrderedDict()  # prefix -> [(weight, code, name), ...]，按权重降序
+        self._head_top = {}  # 单个字符的前缀 -> 同上，不淘汰
+        self._pending = None  # 重建期间的新增和权重变化，替换索引后重放
+        self._scanned_order_id = 0  # 重建时销量快照包含的最大订单 ID，快照完成前为 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def _sort_key(self, pos: int):
+        return _text(self._names[pos]), self._codes[pos]
+
+    def _bisect(self, target) -> int:
+        return bisect_left(range(len(self._names)), target, key=self._sort_key)
+
+    def _position(self, code: int):
+        name = self._name_of.get(code)
+        return None if name is None else self._bisect((_text(name), code))
+
+    def _cached_top(self, prefix: str):
+        return self._head_top.get(prefix) if len(prefix) == 1 else self._top_cache.get(prefix)
+
+    def _cache_offer(self, text: str, code: int, name: str, weight: float):
+        # 把新的或权重变化的条目合并进所有已缓存的前缀结果
+        for length in range(1, len(text) + 1):
+            top = self._cached_top(text[:length])
+            if top is None:
+                continue
+            top[:] = [entry for entry in top if entry[1] != code]
+            top.append((weight, code, name))
+            top.sort(reverse=True)
+            del top[MAX_SUGGESTIONS:]
+
+    def _cache_discard(self, code: int):
+        for top in (*self._top_cache.values(), *self._head_top.values()):
+            top[:] = [entry for entry in top if entry[1] != code]
+
+    def add(self, kind: str, entity_id: int, name: str, weight: float = 0.0):
+        """
+        新增或重命名一个商品 / 分类
+        """
+        if not name or not _text(name):
+            return
+        with self._lock:
+            self._add(_code(kind, entity_id), name, weight)
+            if self._pending is not None:
+                self._pending.append((_code(kind, entity_id), name, weight, None, False))
+
+    def _add(self, code: int, name: str, weight: float):
+        old_name = self._name_of.get(code)
+        if old_name is not None and _text(old_name) == _text(name):
+            return
+        if old_name is not None:
+            pos = self._position(code)
+            weight = max(weight, self._weights[pos])
+            del self._names[pos]
+            del self._codes[pos]
+            del self._weights[pos]
+            self._cache_discard(code)
+        text = _text(name)
+        pos = self._bisect((text, code))
+        self._names.insert(pos, name)
+        self._codes.insert(pos, code)
+        self._weights.insert(pos, weight)
+        self._name_of[code] = name
+        self._cache_offer(text, code, name, weight)
+
+    def add_weight(self, kind: str, entity_id: int, amount: float, order_id: int = None):
+        """
+        增加权重，例如商品售出时按数量累加、订单取消时扣减
+        :param order_id: 销量所属的订单，重建期间据此判断是否已经包含在销量快照中
+        """
+        code = _code(kind, entity_id)
+        with self._lock:
+            self._add_weight(code, amount)
+            if self._pending is not None:
+                # 扣减只对快照已经计入的订单重放，快照之后下单的订单连同增加一起重放
+                scanned = order_id is not None and amount < 0 and order_id <= self._scanned_order_id
+                self._pending.append((code, None, amount, order_id, scanned))
+
+    def _add_weight(self, code: int, amount: float):
+        pos = self._position(code)
+        if pos is None:
+            return
+        self._weights[pos] = max(0.0, self._weights[pos] + amount)
+        self._cache_offer(_text(self._names[pos]), code, self._names[pos], self._weights[pos])
+
+    def _range(self, prefix: str):
+        start = self._bisect((prefix, -1))
+        end = bisect_left(range(len(self._names)), (prefix + "\U0010ffff", -1), lo=start, key=self._sort_key)
+        return start, end
+
+    def _nlargest(self, start: int, end: int):
+        positions = heapq.nlargest(MAX_SUGGESTIONS, range(start, end), key=self._weights.__getitem__)
+        return [(self._weights[pos], self._codes[pos], self._names[pos]) for pos in positions]
+
+    def _top(self, prefix: str, start: int, end: int):
+        if end - start <= self.scan_limit:
+            return self._nlargest(start, end)
+
+        top = self._cached_top(prefix)
+        if top is not None:
+            if len(prefix) > 1:
+                self._top_cache.move_to_end(prefix)
+            return top
+        top = self._nlargest(start, end)
+        if len(prefix) == 1:
+            self._head_top[prefix] = top
+        else:
+            self._top_cache[prefix] = top
+            if len(self._top_cache) > self.cache_size:
+                self._top_cache.popitem(last=False)
+        return top
+
+    def suggest(self, prefix: str, limit: int = 8):
+        """
+        返回以 prefix 开头、权重最高的商品名和分类名
+        """
+        prefix = _text(prefix)
+        if not prefix:
+            return []
+        limit = max(1, min(limit, MAX_SUGGESTIONS))
+        with self._lock:
+            start, end = self._range(prefix)
+            if start == end:
+                return []
+            result = []
+            for weight, code, name in self._top(prefix, start, end)[:limit]:
+                kind, entity_id = _decode(code)
+                result.append({"type": KIND_NAMES[kind], "id": entity_id, "name": name, "weight": weight})
+            return result
+
+    def _sales_snapshot(self, db: Session) -> dict:
+        """
+        :return: 商品 ID -> 未取消订单的销量（包括已归档的历史订单）
+        """
+        last_order_id = max(
+            db.query(func.max(sold_model.order_id)).scalar() or 0
+            for sold_model in (models.ArchivedSoldProduct, models.SoldProduct)
+        )
+        sales = {}
+        for sold_model, order_model in ((models.ArchivedSoldProduct, models.ArchivedOrder),
+                                        (models.SoldProduct, models.Order)):
+            for product_id, quantity in (
+                db.query(sold_model.product_id, func.sum(sold_model.quantity))
+                .join(order_model, order_model.id == sold_model.order_id)
+                .filter(sold_model.order_id <= last_order_id, order_model.status != 'canceled')
+                .group_by(sold_model.product_id)
+            ):
+                sales[product_id] = sales.get(product_id, 0) + (quantity or 0)
+        with self._lock:
+            self._scanned_order_id = last_order_id
+        return sales
+
+    def rebuild(self, db: Session, chunk_size: int = 10000):
+        """
+        从数据库分批读取商品和分类，整体排序后替换当前索引
+        """
+        with self._lock:
+            self._pending = []
+            self._scanned_order_id = 0
+        try:
+            sales = self._sales_snapshot(db)
+            entries = self._load_entries(db, sales, chunk_size)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        entries.sort()
+        names = [entry[2] for entry in entries]
+        codes = array('q', (entry[1] for entry in entries))
+        weights = array('d', (entry[3] for entry in entries))
+        del entries
+        name_of = dict(zip(codes, names))
+
+        with self._lock:
+            self._names, self._codes, self._weights, self._name_of = names, codes, weights, name_of
+            self._top_cache.clear()
+            self._head_top.clear()
+            # 重放重建期间的新增和权重变化；快照已经包含的订单销量跳过
+            for code, name, amount, order_id, scanned in self._pending:
+                if name is not None:
+                    self._add(code, name, amount)
+                elif order_id is None or order_id > self._scanned_order_id or scanned:
+                    self._add_weight(code, amount)
+            self._pending = None
+            self._warm_heads()
+            self.ready = True
+
+    def _load_entries(self, db: Session, sales: dict, chunk_size: int) -> list:
+        # 分类下的商品数
+        category_sizes = dict(
+            db.query(models.Product.category_id, func.count(models.Product.id))
+            .group_by(models.Product.category_id)
+            .all()
+        )
+
+        entries = []  # (规范化文本, code, 名称, 权重)
+        for category_id, name in db.query(models.Category.id, models.Category.name):
+            if name and _text(name):
+                entries.append((_text(name), _code(CATEGORY, category_id), name,
+                                float(category_sizes.get(category_id, 0))))
+
+        last_id = 0
+        while True:
+            rows = (
+                db.query(models.Product.id, models.Product.name)
+                .filter(models.Product.id > last_id)
+                .order_by(models.Product.id)
+                .limit(chunk_size)
+                .all()
+            )
+            if not rows:
+                break
+            for product_id, name in rows:
+                if name and _text(name):
+                    entries.append((_text(name), _code(PRODUCT, product_id), name,
+                                    float(sales.get(product_id) or 0)))
+            last_id = rows[-1][0]
+        return entries
+
+    def _warm_heads(self):
+        # 同一首字符的条目在有序数组中连续，一遍扫描算出所有单字符前缀的前 K 名
+        start = 0
+        while start < len(self._names):
+            head = _text(self._names[start])[:1]
+            end = self._bisect((head + "\U0010ffff", -1))
+            if end - start > self.scan_limit:
+                self._head_top[head] = self._nlargest(start, end)
+            start = end
+
+
+# 全局联想索引
+index = PrefixIndex()
+
+
+def rebuild_in_background(session_factory):
+    """
+    在后台线程中构建索引，避免阻塞服务启动
+    """
+    def run():
+        db = session_factory()
+        try:
+            index.rebuild(db)
+        finally:
+            db.close()
+
+    thread = threading.Thread(target=run, name="suggest-index", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,166 @@
+"""
+订单、商品写入提交后执行的后台任务
+
+crud 在事务提交后调用这里的 enqueue_* 函数，具体工作由 jobs.queue 的 worker 异步完成。
+"""
+from datetime import datetime
+from decimal import Decimal
+
+import events
+import image_store
+import jobs
+import models
+import recommendations
+import sales_rollup
+import suggest
+import trending
+from database import SessionLocal
+
+
+@jobs.queue.register("record_order_sales")
+def record_order_sales(order_id: int, sold_at: str, items: list):
+    """
+    累加卖家销售汇总，按订单去重，重放不会重复计入
+    :param items: [seller_id, product_id, category_id, quantity, unit_price] 列表
+    """
+    sold_at = datetime.fromisoformat(sold_at)
+    sales = [
+        (seller_id, product_id, sold_at, quantity, Decimal(unit_price))
+        for seller_id, product_id, _, quantity, unit_price in items
+    ]
+    db = SessionLocal()
+    try:
+        sales_rollup.record_order_sales(db, order_id, sales)
+        db.commit()
+    finally:
+        db.close()
+
+
+@jobs.queue.register("revert_order_sales")
+def revert_order_sales(order_ids: list):
+    """
+    订单取消后扣减卖家销售汇总
+    """
+    db = SessionLocal()
+    try:
+        sales_rollup.revert_orders(db, order_ids)
+        db.commit()
+    finally:
+        db.close()
+
+
+# 内存索引在启动时从数据库重建，已经包含重启前提交的订单，日志中未完成的任务不再重放
+@jobs.queue.register("index_order", replay=False)
+def index_order(order_id: int, sold_at: str, items: list):
+    """
+    更新内存中的推荐索引、热门排行和联想权重
+    """
+    at = trending.sold_timestamp(datetime.fromisoformat(sold_at))
+    recommendations.index.add_order(order_id, [item[1] for item in items])
+    for _, product_id, category_id, quantity, _ in items:
+        trending.tracker.record_sale(product_id, category_id, quantity, at=at, order_id=order_id)
+        suggest.index.add_weight(suggest.PRODUCT, product_id, quantity, order_id)
+
+
+# 同 index_order：重建时会跳过已取消的订单
+@jobs.queue.register("unindex_orders", replay=False)
+def unindex_orders(order_ids: list):
+    """
+    订单取消后从推荐索引、热门排行和联想权重中扣减
+    """
+    db = SessionLocal()
+    try:
+        sold = (
+            db.query(models.SoldProduct.order_id, models.SoldProduct.product_id, models.Product.category_id,
+                     models.SoldProduct.quantity, models.SoldProduct.sold_date)
+            .outerjoin(models.Product, models.Product.id == models.SoldProduct.product_id)
+            .filter(models.SoldProduct.order_id.in_(order_ids))
+            .all()
+        )
+    finally:
+        db.close()
+
+    baskets = {}
+    for order_id, product_id, category_id, quantity, sold_date in sold:
+        baskets.setdefault(order_id, []).append(product_id)
+        trending.tracker.remove_sale(product_id, category_id, quantity, trending.sold_timestamp(sold_date), order_id)
+        suggest.index.add_weight(suggest.PRODUCT, product_id, -quantity, order_id)
+    for order_id, product_ids in baskets.items():
+        recommendations.index.remove_order(order_id, product_ids)
+
+
+@jobs.queue.register("index_product")
+def index_product(product_id: int, product_name: str):
+    """
+    把新商品加入搜索联想索引
+    """
+    suggest.index.add(suggest.PRODUCT, product_id, product_name)
+
+
+@jobs.queue.register("publish_order_events")
+def publish_order_events(order_ids: list, event_type: str, status: str):
+    """
+    向订单的买家和卖家推送订单事件
+    :param status: 入队时的订单状态；任务执行前订单可能又被修改，推送的应该是这次变化后的状态
+    """
+    db = SessionLocal()
+    try:
+        orders = (
+            db.query(models.Order.id, models.Order.buyer_id, models.Order.total_amount)
+            .filter(models.Order.id.in_(order_ids))
+            .all()
+        )
+        sellers = {}
+        for order_id, seller_id in (
+            db.query(models.SoldProduct.order_id, models.SoldProduct.seller_id)
+            .filter(models.SoldProduct.order_id.in_(order_ids))
+            .distinct()
+        ):
+            sellers.setdefault(order_id, set()).add(seller_id)
+    finally:
+        db.close()
+
+    for order_id, buyer_id, total_amount in orders:
+        events.hub.publish(
+            event_type,
+            {"order_id": order_id, "status": status, "total_amount": float(total_amount)},
+            audience={buyer_id} | sellers.get(order_id, set()),
+        )
+
+
+@jobs.queue.register("generate_thumbnails")
+def generate_thumbnails(digest: str, ext: str):
+    """
+    为上传的商品图片生成各尺寸缩略图
+    """
+    image_store.generate_thumbnails(digest, ext)
+
+
+def enqueue_order_created(order_id: int, sold_at: datetime, items: list):
+    """
+    :param items: (seller_id, product_id, category_id, quantity, unit_price) 列表
+    """
+    items = [
+        [seller_id, product_id, category_id, quantity, str(unit_price)]
+        for seller_id, product_id, category_id, quantity, unit_price in items
+    ]
+    jobs.queue.enqueue("record_order_sales", order_id=order_id, sold_at=sold_at.isoformat(), items=items)
+    jobs.queue.enqueue("index_order", order_id=order_id, sold_at=sold_at.isoformat(), items=items)
+    jobs.queue.enqueue("publish_order_events", order_ids=[order_id], event_type="order_created", status='pending')
+
+
+def enqueue_order_status_changed(order_ids: list, new_status: str):
+    order_ids = list(order_ids)
+    if new_status == 'canceled':
+        jobs.queue.enqueue("revert_order_sales", order_ids=order_ids)
+        jobs.queue.enqueue("unindex_orders", order_ids=order_ids)
+    jobs.queue.enqueue("publish_order_events", order_ids=order_ids, event_type="order_status", status=new_status)
+
+
+def enqueue_product_created(product_id: int, name: str):
+    # 任务参数不能叫 name，会与 enqueue 的任务名参数冲突
+    jobs.queue.enqueue("index_product", product_id=product_id, product_name=name)
+
+
+def enqueue_image_uploaded(digest: str, ext: str):
+    jobs.queue.enqueue("generate_thumbnails", digest=digest, ext=ext)
@@ -0,0 +1,66 @@
+"""
+测试共用的 fixture
+
+- engine / session_factory / db：独立的内存 sqlite 数据库（StaticPool，所有连接、线程共用同一个库）
+- 每个测试开始前把进程内的全局单例（联想索引、热门榜、推荐索引、事件中心、任务队列、结果缓存、
+  旧数据缓存）替换为新的实例，测试结束后恢复，测试之间互不影响
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import circuit_breaker
+import events
+import jobs
+import models
+import recommendations
+import result_cache
+import suggest
+import trending
+
+
+@pytest.fixture
+def empty_engine():
+    """
+    没有建表的内存数据库，用于测试迁移
+    """
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def engine(empty_engine):
+    models.Base.metadata.create_all(empty_engine)
+    return empty_engine
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_singletons(tmp_path, monkeypatch):
+    monkeypatch.setattr(suggest, "index", suggest.PrefixIndex())
+    monkeypatch.setattr(trending, "tracker", trending.TrendingTracker())
+    monkeypatch.setattr(recommendations, "index", recommendations.CoPurchaseIndex())
+    monkeypatch.setattr(events, "hub", events.EventHub(events.MemoryBackend()))
+    monkeypatch.setattr(result_cache, "lists", result_cache.ResultCache())
+    monkeypatch.setattr(result_cache, "cards", result_cache.CardCache())
+    monkeypatch.setattr(circuit_breaker, "stale", circuit_breaker.StaleCache())
+
+    # 任务处理函数在导入 tasks 时注册到全局队列上，新队列沿用这些注册。
+    # StaticPool 下所有会话共用一个 sqlite 连接，多个 worker 并发提交会互相打断事务，只用一个 worker
+    queue = jobs.JobQueue(journal_path=str(tmp_path / "jobs.journal"), workers=1, fsync=False)
+    queue._handlers = dict(jobs.queue._handlers)
+    queue._no_replay = set(jobs.queue._no_replay)
+    monkeypatch.setattr(jobs, "queue", queue)
@@ -0,0 +1,53 @@
+import io
+import json
+import logging
+import queue
+
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import access_log
+
+
+def make_client():
+    app = FastAPI()
+    app.add_middleware(access_log.AccessLogMiddleware)
+
+    @app.get("/items/{item_id}")
+    def read_item(item_id: int):
+        access_log.set_user(7)
+        if item_id == 0:
+            raise HTTPException(status_code=404, detail="missing")
+        return {"id": item_id}
+
+    return TestClient(app)
+
+
+def test_errors_are_always_logged_and_success_is_sampled(monkeypatch):
+    monkeypatch.setattr(access_log, "SAMPLE_RATE", 0.0)
+    stream = io.StringIO()
+    access_log.start(stream)
+    try:
+        client = make_client()
+        ok = client.get("/items/1", headers={"X-Request-ID": "req-1"})
+        missing = client.get("/items/0")
+    finally:
+        access_log.stop()
+
+    assert ok.headers["x-request-id"] == "req-1"
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    access = [entry for entry in entries if entry["logger"] == "access"]
+    assert len(access) == 1
+    entry = access[0]
+    assert entry["request_id"] == missing.headers["x-request-id"]
+    assert (entry["route"], entry["status"], entry["user_id"], entry["sampled"]) == ("/items/{item_id}", 404, 7, False)
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = access_log.ContextQueueHandler(queue.Queue(1))
+    logger = logging.getLogger("test_access_log.full")
+    logger.propagate = False
+    logger.addHandler(handler)
+    for _ in range(3):
+        logger.error("boom")
+    assert handler.dropped == 2
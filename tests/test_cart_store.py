@@ -0,0 +1,65 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+import models
+from cart_store import CartStore, CheckoutInProgress
+
+
+def saved_items(db, user_id):
+    return dict(
+        db.query(models.CartItem.product_id, models.CartItem.quantity)
+        .join(models.Cart, models.Cart.id == models.CartItem.cart_id)
+        .filter(models.Cart.user_id == user_id)
+        .all()
+    )
+
+
+def test_failed_flush_keeps_edits_until_a_later_flush_succeeds(empty_engine):
+    db = sessionmaker(bind=empty_engine)()
+    store = CartStore(max_carts=1)
+    store._carts[1] = {}
+    store.add(db, 1, 10, 2)
+
+    with pytest.raises(Exception):
+        store.flush(db)
+    db.rollback()
+
+    # 落库失败的购物车不能被淘汰
+    store._carts[2] = {}
+    store._evict()
+    assert 1 in store._carts
+
+    models.Base.metadata.create_all(db.get_bind())
+    assert store.flush(db) == 1
+    assert saved_items(db, 1) == {10: 2}
+    assert store.flush(db) == 0
+
+
+def test_edits_made_during_flush_stay_dirty(db):
+    store = CartStore()
+    store.add(db, 1, 10, 1)
+
+    edits = [11]
+
+    @event.listens_for(db, "before_commit")
+    def edit_while_flushing(session):
+        if edits:
+            store.add(db, 1, edits.pop(), 1)
+
+    assert store.flush(db) == 1
+    assert saved_items(db, 1) == {10: 1}
+    assert store.flush(db) == 1
+    assert saved_items(db, 1) == {10: 1, 11: 1}
+
+
+def test_concurrent_checkout_is_rejected():
+    store = CartStore()
+    with store.checking_out(1):
+        with pytest.raises(CheckoutInProgress):
+            with store.checking_out(1):
+                pass
+        with store.checking_out(2):
+            pass
+    with store.checking_out(1):
+        pass
@@ -0,0 +1,45 @@
+import pytest
+
+import change_feed
+import models
+
+
+@pytest.fixture
+def db(session_factory):
+    change_feed.install(session_factory)
+    db = session_factory()
+    yield db
+    db.close()
+
+
+def test_changes_are_collapsed_and_resumable(db):
+    category = models.Category(name="fruit")
+    db.add(category)
+    db.flush()
+    apple = models.Product(name="apple", price=2, stock=10, category_id=category.id)
+    pear = models.Product(name="pear", price=1, stock=5, category_id=category.id)
+    db.add_all([apple, pear])
+    db.commit()
+
+    first = change_feed.get_changes(db, since=0, settle_seconds=0)
+    assert [(c["entity"], c["op"]) for c in first["changes"]] == [
+        ("category", "upsert"), ("product", "upsert"), ("product", "upsert")]
+
+    apple.stock = 7
+    db.commit()
+    apple.stock = 6
+    db.delete(pear)
+    db.commit()
+
+    second = change_feed.get_changes(db, since=first["cursor"], settle_seconds=0)
+    assert [(c["id"], c["op"]) for c in second["changes"]] == [(apple.id, "upsert"), (pear.id, "delete")]
+    assert second["changes"][0]["data"]["stock"] == 6
+    assert change_feed.get_changes(db, since=second["cursor"], settle_seconds=0)["changes"] == []
+
+
+def test_unsettled_changes_are_held_back(db):
+    db.add(models.Category(name="fruit"))
+    db.commit()
+
+    result = change_feed.get_changes(db, since=0, settle_seconds=60)
+    assert result == {"cursor": 0, "has_more": False, "changes": []}
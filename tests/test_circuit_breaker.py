@@ -0,0 +1,158 @@
+import pytest
+from sqlalchemy import Column, Integer, String, event, exc
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from circuit_breaker import CLOSED, LONG_RUNNING, OPEN, CircuitBreaker, CircuitOpen, StaleCache, catalog_read, long_running
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = "items"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(20))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FaultyDatabase:
+    """本地 sqlite 替身：可以让每条 SQL 报错或变慢"""
+
+    def __init__(self, clock, engine):
+        self.clock = clock
+        self.engine = engine
+        Base.metadata.create_all(self.engine)
+        self.session_factory = sessionmaker(bind=self.engine)
+        self.down = False
+        self.latency = 0.0
+        self.statements = 0
+        event.listen(self.engine, "before_cursor_execute", self._before)
+        with self.session_factory() as db:
+            db.add(Item(id=1, name="apple"))
+            db.commit()
+        self.statements = 0
+
+    def _before(self, *args):
+        self.statements += 1
+        self.clock.now += self.latency
+        if self.down:
+            raise exc.OperationalError("SELECT", {}, Exception("Can't connect to MySQL server"))
+
+
+clock = FakeClock()
+
+
+@pytest.fixture
+def setup(empty_engine):
+    clock.now = 1000.0
+    database = FaultyDatabase(clock, empty_engine)
+    breaker = CircuitBreaker(failure_threshold=3, min_calls=4, slow_call_seconds=1.0, reset_timeout=10,
+                             clock=clock)
+    breaker.install(database.session_factory)
+    return database, breaker
+
+
+def query(database):
+    with database.session_factory() as db:
+        return db.query(Item.name).filter(Item.id == 1).scalar()
+
+
+def test_trips_after_consecutive_failures_and_fails_fast(setup):
+    database, breaker = setup
+    database.down = True
+    for _ in range(3):
+        with pytest.raises(exc.OperationalError):
+            query(database)
+    assert breaker.state == OPEN
+
+    statements = database.statements
+    with pytest.raises(CircuitOpen) as e:
+        query(database)
+    assert e.value.status_code == 503 and e.value.headers["Retry-After"] == "10"
+    assert database.statements == statements  # 没有再访问数据库
+
+    with database.session_factory() as db:
+        db.add(Item(name="pear"))
+        with pytest.raises(CircuitOpen):
+            db.commit()
+
+
+def test_slow_calls_trip_by_rate(setup):
+    database, breaker = setup
+    for latency in (0, 2, 0, 2):
+        database.latency = latency
+        query(database)
+    assert breaker.state == OPEN
+
+
+def test_long_running_queries_are_not_slow_calls(setup):
+    database, breaker = setup
+    database.latency = 5
+    with long_running(database.session_factory()) as db:
+        for _ in range(5):
+            assert db.query(Item.name).filter(Item.id == 1).scalar() == "apple"
+    with database.session_factory() as db:
+        for _ in range(5):
+            db.query(Item.name).filter(Item.id == 1).execution_options(**{LONG_RUNNING: True}).scalar()
+    assert breaker.state == CLOSED
+    assert breaker.stats()["slow_calls"] == 0
+
+    # 出错仍然计入失败
+    database.down = True
+    with long_running(database.session_factory()) as db:
+        for _ in range(3):
+            with pytest.raises(exc.OperationalError):
+                db.query(Item.name).scalar()
+    assert breaker.state == OPEN
+
+
+def test_half_open_trial_closes_or_reopens(setup):
+    database, breaker = setup
+    database.down = True
+    for _ in range(3):
+        with pytest.raises(exc.OperationalError):
+            query(database)
+
+    clock.now += 10
+    with pytest.raises(exc.OperationalError):
+        query(database)  # 试探失败
+    assert breaker.state == OPEN
+
+    clock.now += 10
+    database.down = False
+    assert query(database) == "apple"
+    assert breaker.state == CLOSED
+
+
+def test_background_probe_recovers(setup):
+    database, breaker = setup
+    database.down = True
+    for _ in range(3):
+        with pytest.raises(exc.OperationalError):
+            query(database)
+    assert breaker.probe(database.engine) is False
+    database.down = False
+    assert breaker.probe(database.engine) is True
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_catalog_read_serves_stale_data_while_open(setup):
+    database, breaker = setup
+    cache = StaleCache(clock=clock)
+    assert await catalog_read(("item", 1), query, database, cache=cache) == "apple"
+
+    database.down = True
+    for _ in range(3):
+        assert await catalog_read(("item", 1), query, database, cache=cache) == "apple"
+    assert breaker.state == OPEN
+
+    assert await catalog_read(("item", 1), query, database, cache=cache) == "apple"
+    with pytest.raises(CircuitOpen):
+        await catalog_read(("item", 2), query, database, cache=cache)
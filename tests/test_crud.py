@@ -0,0 +1,81 @@
+from datetime import datetime
+
+import pytest
+
+import crud
+import models
+import tasks
+from schemas import OrderStatusBatchItem
+
+SELLER_ID = 3
+
+
+@pytest.fixture
+def db(db, monkeypatch):
+    for order_id, status in enumerate(['pending', 'pending', 'shipped', 'completed', 'canceled'], start=1):
+        db.add(models.Order(id=order_id, buyer_id=7, order_date=datetime(2024, 5, 1), status=status,
+                            total_amount=1, recipient_name="a", phone="1", address_line1="x"))
+        db.add(models.SoldProduct(seller_id=SELLER_ID, buyer_id=7, product_id=11, order_id=order_id,
+                                  sold_date=datetime(2024, 5, 1), quantity=1))
+    # 其他卖家的订单
+    db.add(models.Order(id=6, buyer_id=7, order_date=datetime(2024, 5, 1), status='pending',
+                        total_amount=1, recipient_name="a", phone="1", address_line1="x"))
+    db.add(models.SoldProduct(seller_id=4, buyer_id=7, product_id=12, order_id=6,
+                              sold_date=datetime(2024, 5, 1), quantity=1))
+    db.commit()
+    changed = []
+    monkeypatch.setattr(tasks, "enqueue_order_status_changed",
+                        lambda order_ids, new_status: changed.append((sorted(order_ids), new_status)))
+    db.changed = changed
+    return db
+
+
+def update(db, *pairs):
+    items = [OrderStatusBatchItem(order_id=order_id, status=status) for order_id, status in pairs]
+    return crud.batch_update_order_status(db, items, seller_id=SELLER_ID)
+
+
+def statuses(db):
+    db.expire_all()
+    return {order.id: order.status for order in db.query(models.Order)}
+
+
+@pytest.mark.parametrize("old_status, new_status, allowed", [
+    ('pending', 'shipped', True),
+    ('pending', 'canceled', True),
+    ('pending', 'completed', False),
+    ('shipped', 'completed', True),
+    ('shipped', 'canceled', False),
+    ('shipped', 'pending', False),
+    ('completed', 'canceled', False),
+    ('canceled', 'pending', False),
+])
+def test_transition_matrix(db, old_status, new_status, allowed):
+    order_id = {'pending': 1, 'shipped': 3, 'completed': 4, 'canceled': 5}[old_status]
+    [result] = update(db, (order_id, new_status))
+
+    assert result["success"] is allowed
+    assert statuses(db)[order_id] == (new_status if allowed else old_status)
+    assert db.changed == ([([order_id], new_status)] if allowed else [])
+
+
+def test_partial_success(db):
+    results = update(db, (1, 'shipped'), (3, 'completed'), (4, 'shipped'), (6, 'shipped'), (99, 'shipped'))
+
+    assert [result["success"] for result in results] == [True, True, False, False, False]
+    assert results[2]["status"] == 'completed'
+    assert results[3]["detail"] == "无权修改该订单"
+    assert results[4]["detail"] == "订单 ID 99 不存在"
+    assert statuses(db) == {1: 'shipped', 2: 'pending', 3: 'completed', 4: 'completed', 5: 'canceled', 6: 'pending'}
+    assert sorted(db.changed) == [([1], 'shipped'), ([3], 'completed')]
+
+
+def test_duplicate_order_applies_first_occurrence(db):
+    results = update(db, (1, 'shipped'), (2, 'canceled'), (1, 'canceled'), (1, 'shipped'))
+
+    assert results[0] == {"order_id": 1, "success": True, "status": 'shipped'}
+    assert results[1]["success"] is True
+    assert [result["success"] for result in results[2:]] == [False, False]
+    assert all(result["detail"] == "订单重复提交" for result in results[2:])
+    assert statuses(db)[1] == 'shipped'
+    assert sorted(db.changed) == [([1], 'shipped'), ([2], 'canceled')]
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from events import EventHub, FileBackend, MemoryBackend
+
+
+async def _next_chunk(stream):
+    return await asyncio.wait_for(stream.__anext__(), 1)
+
+
+@pytest.mark.asyncio
+async def test_events_are_delivered_only_to_audience_and_can_be_resumed():
+    hub = EventHub(MemoryBackend())
+    hub.start()
+    try:
+        stream = hub.stream(user_id=1)
+        assert await _next_chunk(stream) == "retry: 3000\n\n"
+
+        hub.publish("order_status", {"order_id": 5}, audience={2})
+        first = hub.publish("order_status", {"order_id": 6, "status": "shipped"}, audience={1, 2})
+        chunk = await _next_chunk(stream)
+        assert chunk.startswith(f"id: {first}\n") and '"order_id": 6' in chunk
+        await stream.aclose()
+
+        # 断线期间的事件在重连时补发
+        missed = hub.publish("order_status", {"order_id": 6, "status": "completed"}, audience={1})
+        resumed = hub.stream(user_id=1, last_event_id=first)
+        assert (await _next_chunk(resumed)).startswith(f"id: {missed}\n")
+        await resumed.aclose()
+    finally:
+        await hub.stop()
+
+
+@pytest.mark.asyncio
+async def test_file_backend_shares_events_between_hubs(tmp_path):
+    path = str(tmp_path / "events.log")
+    publisher, subscriber = EventHub(FileBackend(path, 0.01)), EventHub(FileBackend(path, 0.01))
+    subscriber.start()
+    try:
+        stream = subscriber.stream(user_id=3)
+        await _next_chunk(stream)
+        await asyncio.sleep(0.05)
+        event_id = publisher.publish("order_created", {"order_id": 9}, audience={3})
+        assert (await _next_chunk(stream)).startswith(f"id: {event_id}\n")
+        await stream.aclose()
+
+        later = publisher.publish("order_status", {"order_id": 9}, audience={3})
+        assert [event.id for event in subscriber.replay(3, event_id)] == [later]
+    finally:
+        await subscriber.stop()
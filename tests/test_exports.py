@@ -0,0 +1,86 @@
+import csv
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+import exports
+import models
+
+SELLER_ID = 3
+SOLD_AT = datetime(2024, 5, 1, 12, 0)
+
+
+@pytest.fixture
+def session_factory(session_factory, monkeypatch):
+    # 小批量，保证数据跨越多个批次
+    monkeypatch.setattr(exports, "CHUNK_SIZE", 3)
+    db = session_factory()
+    # 其他卖家的商品穿插在中间
+    for product_id in range(1, 11):
+        seller_id = 4 if product_id % 4 == 0 else SELLER_ID
+        db.add(models.Product(id=product_id, name=f"product {product_id}", price=Decimal("1.50"), stock=product_id,
+                              seller_id=seller_id, category_id=1))
+    db.add(models.ProductImage(product_id=1, image_url="/media/a.png"))
+    db.add(models.ProductImage(product_id=1, image_url="/media/b.png"))
+
+    for order_id in range(1, 5):
+        db.add(models.ArchivedOrder(id=order_id, buyer_id=7, order_date=SOLD_AT, status='completed', total_amount=1,
+                                    recipient_name="a", phone="1", address_line1="x", archived_at=SOLD_AT))
+        db.add(models.ArchivedSoldProduct(id=order_id, seller_id=SELLER_ID, buyer_id=7, product_id=1,
+                                          order_id=order_id, sold_date=SOLD_AT, quantity=order_id))
+    for order_id in range(5, 12):
+        db.add(models.Order(id=order_id, buyer_id=7, order_date=SOLD_AT, status='pending', total_amount=1,
+                            recipient_name="a", phone="1", address_line1="x"))
+        db.add(models.SoldProduct(seller_id=SELLER_ID if order_id != 8 else 4, buyer_id=7, product_id=2,
+                                  order_id=order_id, sold_date=SOLD_AT, quantity=1))
+    db.commit()
+    db.close()
+    return session_factory
+
+
+def test_products_ndjson_spans_chunks_without_gaps_or_duplicates(session_factory):
+    chunks = list(exports.export_products(session_factory, SELLER_ID, "ndjson"))
+    assert len(chunks) == 3  # 8 个商品，每批 3 个
+
+    # 每行是一个完整的 JSON 对象，以换行结尾
+    body = "".join(chunks)
+    assert body.endswith("\n") and all(chunk.endswith("\n") for chunk in chunks)
+    rows = [json.loads(line) for line in body.splitlines()]
+    assert [row["id"] for row in rows] == [1, 2, 3, 5, 6, 7, 9, 10]
+    assert list(rows[0]) == list(exports.PRODUCT_FIELDS)
+    assert rows[0]["price"] == 1.5
+    assert rows[0]["image_urls"] == ["/media/a.png", "/media/b.png"]
+
+
+def test_orders_include_archive_then_hot_tables(session_factory):
+    rows = [json.loads(line) for line in "".join(exports.export_orders(session_factory, SELLER_ID)).splitlines()]
+
+    assert [row["order_id"] for row in rows] == [1, 2, 3, 4, 5, 6, 7, 9, 10, 11]
+    assert rows[0]["sold_date"] == SOLD_AT.isoformat()
+    assert {row["status"] for row in rows[:4]} == {"completed"}
+
+
+def test_csv_has_bom_single_header_and_escaping(session_factory):
+    db = session_factory()
+    db.get(models.Product, 2).name = 'say "hi", 你好'
+    db.get(models.Product, 3).description = "line 1\nline 2"
+    db.commit()
+    db.close()
+
+    body = "".join(exports.export_products(session_factory, SELLER_ID, "csv"))
+    assert body.startswith("\ufeff")
+    rows = list(csv.reader(io.StringIO(body[1:])))
+    assert rows[0] == list(exports.PRODUCT_FIELDS)
+    assert [row[0] for row in rows[1:]] == ["1", "2", "3", "5", "6", "7", "9", "10"]  # 表头只在第一批输出
+    assert rows[1][6] == "/media/a.png /media/b.png"
+    assert rows[2][1] == 'say "hi", 你好'
+    assert rows[3][2] == "line 1\nline 2"
+
+
+def test_empty_export(session_factory):
+    assert "".join(exports.export_products(session_factory, 99, "csv")) == "\ufeff" + ",".join(
+        exports.PRODUCT_FIELDS) + "\r\n"
+    assert list(exports.export_products(session_factory, 99, "ndjson")) == []
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from idempotency import IdempotencyStore
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicates_share_one_execution():
+    store = IdempotencyStore()
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"id": 1}
+
+    results = await asyncio.gather(*[store.run("order:1:k", "fp", handler) for _ in range(5)])
+    assert len(calls) == 1
+    assert [replayed for _, replayed in results] == [False, True, True, True, True]
+    assert all(body == {"id": 1} for body, _ in results)
+
+
+@pytest.mark.asyncio
+async def test_errors_are_not_saved():
+    store = IdempotencyStore()
+
+    def out_of_stock():
+        raise HTTPException(status_code=400, detail="库存不足")
+
+    with pytest.raises(HTTPException) as exc:
+        await store.run("a", "fp", out_of_stock)
+    assert exc.value.status_code == 400
+    # 补货后用同一个键重试可以成功
+    body, replayed = await store.run("a", "fp", lambda: {"id": 1})
+    assert body == {"id": 1} and not replayed
+    assert (await store.run("a", "fp", out_of_stock)) == ({"id": 1}, True)
+
+    def broken():
+        raise HTTPException(status_code=500, detail="boom")
+
+    with pytest.raises(HTTPException):
+        await store.run("b", "fp", broken)
+    body, replayed = await store.run("b", "fp", lambda: {"ok": True})
+    assert body == {"ok": True} and not replayed
+
+    with pytest.raises(HTTPException) as exc:
+        await store.run("b", "other", lambda: {})
+    assert exc.value.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicates_share_an_error():
+    store = IdempotencyStore()
+    calls = []
+
+    async def rejected():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise HTTPException(status_code=409, detail="购物车正在结算")
+
+    results = await asyncio.gather(*[store.run("a", "fp", rejected) for _ in range(3)], return_exceptions=True)
+    assert len(calls) == 1
+    assert [result.status_code for result in results] == [409, 409, 409]
+    assert len(store) == 0
@@ -0,0 +1,86 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+import image_store
+
+
+@pytest.fixture(autouse=True)
+def media_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_store, "MEDIA_ROOT", str(tmp_path))
+    return tmp_path
+
+
+def png_bytes(color=(255, 0, 0), size=(600, 400)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_save_is_content_addressed():
+    data = png_bytes()
+    digest, ext, created = image_store.save(io.BytesIO(data))
+
+    assert ext == "png" and created
+    with open(image_store.original_path(digest, ext), "rb") as f:
+        assert f.read() == data
+    # 相同内容只存一份
+    assert image_store.save(io.BytesIO(data)) == (digest, ext, False)
+    assert image_store.save(io.BytesIO(png_bytes(color=(0, 0, 255))))[0] != digest
+    assert os.listdir(os.path.join(image_store.MEDIA_ROOT, "tmp")) == []
+
+
+@pytest.mark.parametrize("data, message", [
+    (b"", "图片内容为空"),
+    (b"%PDF-1.4 not an image", "只支持"),
+])
+def test_save_rejects_non_images(data, message):
+    with pytest.raises(image_store.InvalidImage, match=message):
+        image_store.save(io.BytesIO(data))
+    assert os.listdir(os.path.join(image_store.MEDIA_ROOT, "tmp")) == []
+
+
+@pytest.mark.parametrize("data", [
+    png_bytes()[:200],  # 截断
+    png_bytes()[:100] + b"\0" * 400 + png_bytes()[500:],  # 中间的数据损坏
+    b"\xff\xd8\xff\xe0" + b"\0" * 1000,  # 只有 JPEG 文件头
+])
+def test_save_rejects_corrupt_images(data):
+    with pytest.raises(image_store.InvalidImage, match="损坏"):
+        image_store.save(io.BytesIO(data))
+    assert os.listdir(os.path.join(image_store.MEDIA_ROOT, "tmp")) == []
+    assert not os.path.exists(os.path.join(image_store.MEDIA_ROOT, "originals"))
+
+
+def test_save_rejects_oversized_upload(monkeypatch):
+    monkeypatch.setattr(image_store, "MAX_UPLOAD_BYTES", 1024)
+    data = png_bytes() + b"\0" * 2048
+    with pytest.raises(image_store.InvalidImage, match="不能超过"):
+        image_store.save(io.BytesIO(data))
+    assert os.listdir(os.path.join(image_store.MEDIA_ROOT, "tmp")) == []
+
+
+def test_thumbnails_missing_until_generated():
+    digest, ext, _ = image_store.save(io.BytesIO(png_bytes()))
+    assert image_store.thumbnails_missing(digest)
+
+    assert image_store.generate_thumbnails(digest, ext) == [128, 256, 512]
+    assert not image_store.thumbnails_missing(digest)
+    with Image.open(image_store.thumbnail_path(digest, 256)) as thumb:
+        assert thumb.format == "JPEG" and thumb.size == (256, 171)
+
+    # 只补生成缺少的尺寸
+    os.unlink(image_store.thumbnail_path(digest, 128))
+    assert image_store.thumbnails_missing(digest)
+    assert image_store.generate_thumbnails(digest, ext) == [128]
+
+
+def test_parse_name_rejects_path_traversal():
+    digest = "a" * 64
+    assert image_store.parse_name(f"{digest}.png") == (digest, "png")
+    assert image_store.parse_name(f"../{digest}.png") is None
+    assert image_store.parse_name(f"{digest}.exe") is None
+    assert image_store.thumbnail_url(f"/media/{digest}.png") == f"/media/thumbs/256/{digest}.jpg"
+    assert image_store.thumbnail_url("https://example.com/a.png") == "https://example.com/a.png"
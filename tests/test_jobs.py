@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from jobs import JobQueue
+
+
+@pytest.mark.asyncio
+async def test_failed_jobs_are_retried_with_backoff(tmp_path):
+    queue = JobQueue(journal_path=str(tmp_path / "jobs.journal"), workers=2, base_delay=0.01)
+    attempts = []
+
+    @queue.register("flaky")
+    def flaky(value):
+        attempts.append(value)
+        if len(attempts) < 3:
+            raise RuntimeError("temporary failure")
+
+    await queue.start()
+    queue.enqueue("flaky", value=1)
+    for _ in range(100):
+        if queue.stats()["succeeded"]:
+            break
+        await asyncio.sleep(0.01)
+    await queue.stop()
+
+    assert attempts == [1, 1, 1]
+    stats = queue.stats()
+    assert stats["retried"] == 2 and stats["succeeded"] == 1 and stats["pending"] == 0
+
+
+@pytest.mark.asyncio
+async def test_unfinished_jobs_survive_restart(tmp_path):
+    journal = str(tmp_path / "jobs.journal")
+    blocked = asyncio.Event()
+
+    first = JobQueue(journal_path=journal, workers=1)
+
+    @first.register("notify")
+    async def stuck(order_id):
+        await blocked.wait()
+
+    await first.start()
+    first.enqueue("notify", order_id=7)
+    await asyncio.sleep(0.01)
+    await first.stop(drain=False)
+
+    done = []
+    second = JobQueue(journal_path=journal, workers=1)
+
+    @second.register("notify")
+    def notify(order_id):
+        done.append(order_id)
+
+    await second.start()
+    await second.stop(drain=True, timeout=1)
+    assert done == [7]
+
+
+@pytest.mark.asyncio
+async def test_jobs_registered_without_replay_are_dropped_on_restart(tmp_path):
+    journal = str(tmp_path / "jobs.journal")
+    blocked = asyncio.Event()
+
+    first = JobQueue(journal_path=journal, workers=1)
+
+    @first.register("index", replay=False)
+    async def stuck(order_id):
+        await blocked.wait()
+
+    await first.start()
+    first.enqueue("index", order_id=7)
+    await asyncio.sleep(0.01)
+    await first.stop(drain=False)
+
+    done = []
+    second = JobQueue(journal_path=journal, workers=1)
+
+    @second.register("index", replay=False)
+    def index(order_id):
+        done.append(order_id)
+
+    await second.start()
+    await second.stop(drain=True, timeout=1)
+    assert done == []
+    assert second.stats()["skipped"] == 1
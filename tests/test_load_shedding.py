@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from load_shedding import Limiter, Overloaded, limits
+
+
+@pytest.mark.asyncio
+async def test_waiters_are_admitted_by_priority():
+    limiter = Limiter("shared", limit=1, queue=10, max_wait=5)
+    await limiter.acquire()
+    order = []
+
+    async def request(name, priority):
+        await limiter.acquire(priority)
+        order.append(name)
+        limiter.release()
+
+    tasks = [asyncio.create_task(request("browse", 2)), asyncio.create_task(request("checkout", 0))]
+    await asyncio.sleep(0)
+    limiter.release()
+    await asyncio.gather(*tasks)
+
+    assert order == ["checkout", "browse"]
+    stats = limiter.stats()
+    assert (stats["in_flight"], stats["waiting"], stats["admitted"]) == (0, 0, 3)
+
+
+@pytest.mark.asyncio
+async def test_full_queue_and_long_wait_are_rejected():
+    limiter = Limiter("browse", limit=1, queue=1, max_wait=0.05)
+    await limiter.acquire()
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+
+    with pytest.raises(Overloaded) as e:
+        await limiter.acquire()
+    assert e.value.retry_after >= 1
+
+    with pytest.raises(Overloaded):
+        await waiter
+    stats = limiter.stats()
+    assert (stats["rejected"], stats["timed_out"], stats["waiting"]) == (1, 1, 0)
+
+    limiter.release()
+    await limiter.acquire()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_passes_its_slot_on():
+    limiter = Limiter("write", limit=1, queue=10, max_wait=5)
+    await limiter.acquire()
+    cancelled = asyncio.create_task(limiter.acquire())
+    second = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+
+    limiter.release()
+    await asyncio.wait_for(second, 1)
+    assert limiter.stats()["in_flight"] == 1
+
+
+def test_routes_are_classified_into_groups():
+    assert limits.classify("POST", "/order/create").name == "checkout"
+    assert limits.classify("POST", "/token").name == "auth"
+    assert limits.classify("POST", "/orders/1/status").name == "write"
+    assert limits.classify("GET", "/products/search").name == "browse"
+    assert limits.classify("GET", "/export/orders").shared is False
+    assert limits.classify("GET", "/orders/events") is None
@@ -1,5 +1,25 @@
+import asyncio
+import io
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+
 import pytest
+from fastapi.testclient import TestClient
+import httpx
 from httpx import AsyncClient
+from PIL import Image
+
+import auth
+import cart_store
+import circuit_breaker
+import crud
+import idempotency
+import image_store
+import models
+import recommendations
+import tasks
+from database import get_db
 from main import app
 
 
@@ -35,3 +55,172 @@ async def test_get_user_info():
         assert response.status_code == 200
         assert response.json()["username"] == "testuser"
 
+
+
+@pytest.fixture
+def client(session_factory):
+    # 使用独立的内存数据库，登录用户固定为商品 1 的卖家
+    db = session_factory()
+    db.add(models.Product(id=1, name="apple", price=1, stock=1, seller_id=3, category_id=1))
+    db.add(models.Product(id=2, name="pear", price=1, stock=1, seller_id=3, category_id=1))
+    db.commit()
+    db.close()
+
+    def override_get_db():
+        session = session_factory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[auth.get_current_user] = lambda: SimpleNamespace(id=3, username="seller")
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def media_client(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(image_store, "MEDIA_ROOT", str(tmp_path))
+    enqueued = []
+    monkeypatch.setattr(tasks, "enqueue_image_uploaded", lambda digest, ext: enqueued.append(digest))
+    client.enqueued = enqueued
+    return client
+
+
+def test_related_products(client):
+    index = recommendations.index
+    index.add_order(1, [1, 2])
+    index.add_order(2, [1, 2, 3])
+
+    related = client.get("/products/1/related").json()
+    assert related["source"] == "co_purchase"
+    assert related["products"] == [{"product_id": 2, "score": 2}, {"product_id": 3, "score": 1}]
+    assert client.get("/products/1/related", params={"limit": 1}).json()["products"] == [
+        {"product_id": 2, "score": 2}]
+
+    # 取消的订单不再计入
+    index.remove_order(2, [1, 2, 3])
+    assert client.get("/products/1/related").json()["products"] == [{"product_id": 2, "score": 1}]
+
+    # 没有购买记录时返回同分类商品
+    index.remove_order(1, [1, 2])
+    fallback = client.get("/products/1/related").json()
+    assert fallback == {"product_id": 1, "source": "category", "products": [{"product_id": 2, "score": 0}]}
+    assert client.get("/products/99/related").status_code == 404
+
+
+def test_product_detail_caches_serialized_dict(client):
+    response = client.get("/products/1/detail")
+    assert response.status_code == 200
+    assert response.json()["name"] == "apple"
+    cached, _ = circuit_breaker.stale.get(("detail", 1))
+    assert cached == {"id": 1, "name": "apple", "description": None, "price": 1.0, "stock": 1, "seller_id": 3,
+                      "category_id": 1}
+    assert client.get("/products/99/detail").status_code == 404
+
+
+def test_faceted_search_bounds_and_stale_cache(client):
+    assert client.get("/products/search/faceted", params={"limit": crud.SEARCH_MAX_LIMIT + 1}).status_code == 422
+    assert client.get("/products/search/faceted", params={"offset": crud.SEARCH_MAX_OFFSET + 1}).status_code == 422
+    assert client.get("/products/search", params={"keyword": "apple", "limit": 0}).status_code == 422
+
+    body = client.get("/products/search/faceted", params={"keyword": " Apple"}).json()
+    assert [item["id"] for item in body["items"]] == [1]
+    cached, _ = circuit_breaker.stale.get(("faceted", "apple", 10, None, None, None, False, "relevance", 0))
+    assert cached == body
+
+
+def png_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 200), (255, 0, 0)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_upload_enqueues_thumbnails_while_missing(media_client):
+    data = png_bytes()
+    first = media_client.post("/product/1/images/upload", files={"file": ("a.png", data, "image/png")})
+    assert first.status_code == 200
+    digest = image_store.parse_name(first.json()["image_url"].rsplit("/", 1)[1])[0]
+
+    # 原图已存在但缩略图还没生成，重新上传时再次排队
+    second = media_client.post("/product/1/images/upload", files={"file": ("b.png", data, "image/png")})
+    assert second.json()["id"] == first.json()["id"]
+    assert media_client.enqueued == [digest, digest]
+
+    image_store.generate_thumbnails(digest, "png")
+    media_client.post("/product/1/images/upload", files={"file": ("c.png", data, "image/png")})
+    assert media_client.enqueued == [digest, digest]
+
+
+def test_upload_rejects_non_images(media_client):
+    response = media_client.post("/product/1/images/upload", files={"file": ("a.txt", b"hello", "text/plain")})
+    assert response.status_code == 400
+    assert media_client.enqueued == []
+
+    # 文件头正确、内容损坏的图片不保存，也不关联到商品
+    corrupt = png_bytes()[:200]
+    response = media_client.post("/product/1/images/upload", files={"file": ("a.png", corrupt, "image/png")})
+    assert response.status_code == 400
+    assert media_client.enqueued == []
+    assert media_client.get("/product/1/images").status_code == 404
+
+
+def test_media_routes(media_client):
+    data = png_bytes()
+    digest, ext, _ = image_store.save(io.BytesIO(data))
+
+    original = media_client.get(f"/media/{digest}.png")
+    assert original.content == data
+    assert original.headers["content-type"] == "image/png"
+    assert "immutable" in original.headers["cache-control"]
+    assert media_client.get(f"/media/{digest}.jpg").status_code == 404
+    assert media_client.get("/media/not-a-digest.png").status_code == 404
+
+    # 缩略图生成前临时返回原图，且只短时间缓存
+    fallback = media_client.get(f"/media/thumbs/256/{digest}.jpg")
+    assert fallback.content == data and fallback.headers["cache-control"] == "public, max-age=60"
+    image_store.generate_thumbnails(digest, ext)
+    thumb = media_client.get(f"/media/thumbs/256/{digest}.jpg")
+    assert thumb.headers["content-type"] == "image/jpeg" and "immutable" in thumb.headers["cache-control"]
+    assert media_client.get(f"/media/thumbs/100/{digest}.jpg").status_code == 404
+
+
+@pytest.mark.parametrize("path", ["/singleflight/stats", "/jobs/stats", "/load/stats", "/db/health", "/cache/stats"])
+def test_operational_stats_require_admin(client, monkeypatch, path):
+    monkeypatch.delenv("ADMIN_USERNAMES", raising=False)
+    assert client.get(path).status_code == 403
+    monkeypatch.setenv("ADMIN_USERNAMES", "seller")
+    assert client.get(path).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_concurrent_checkout_is_rejected_and_not_saved(client, monkeypatch):
+    store = cart_store.CartStore()
+    monkeypatch.setattr(cart_store, "store", store)
+    monkeypatch.setattr(idempotency, "store", idempotency.IdempotencyStore())
+    store._carts[3] = {1: 1}
+    release = threading.Event()
+    order_ids = iter(range(1, 10))
+
+    def create_order(db, order_data, buyer_id):
+        release.wait(5)
+        return SimpleNamespace(id=next(order_ids), buyer_id=buyer_id, order_date=datetime(2024, 5, 1),
+                               status='pending', total_amount=1)
+
+    monkeypatch.setattr(crud, "create_order", create_order)
+    receipt = {"receipt_info": {"recipient_name": "a", "phone": "1", "address_line1": "x", "address_line2": None}}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as async_client:
+        first = asyncio.create_task(
+            async_client.post("/cart/checkout", json=receipt, headers={"Idempotency-Key": "k1"}))
+        await asyncio.sleep(0.1)
+        second = await async_client.post("/cart/checkout", json=receipt, headers={"Idempotency-Key": "k2"})
+        assert second.status_code == 409
+        release.set()
+        assert (await first).json()["id"] == 1
+
+        # 409 没有保存在幂等键下，之后用同一个键重试可以成功
+        store._carts[3] = {2: 1}
+        retry = await async_client.post("/cart/checkout", json=receipt, headers={"Idempotency-Key": "k2"})
+        assert retry.status_code == 200 and retry.json()["id"] == 2
@@ -0,0 +1,39 @@
+import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, inspect
+from sqlalchemy.orm import sessionmaker
+
+import migrations
+import models
+
+
+def test_missing_columns_are_added_to_existing_tables(empty_engine):
+    engine = empty_engine
+    with engine.begin() as conn:
+        # 添加 updated_at 之前的 products 表
+        conn.exec_driver_sql("CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, "
+                             "description TEXT, price DECIMAL(10, 2) NOT NULL, stock INTEGER NOT NULL, "
+                             "seller_id INTEGER, category_id INTEGER)")
+        conn.exec_driver_sql("INSERT INTO products (id, name, price, stock) VALUES (1, 'apple', 2, 5)")
+
+    assert migrations.upgrade(engine, dry_run=True) == [
+        'ALTER TABLE products ADD COLUMN updated_at DATETIME',
+        'CREATE INDEX ix_products_category_price ON products (category_id, price)',
+        'CREATE INDEX ix_products_price ON products (price)',
+    ]
+    migrations.upgrade(engine)
+
+    assert "updated_at" in {column["name"] for column in inspect(engine).get_columns("products")}
+    db = sessionmaker(bind=engine)()
+    assert db.query(models.Product).one().name == "apple"
+    assert migrations.upgrade(engine) == []
+
+
+def test_not_null_columns_without_default_fail_loudly(empty_engine):
+    engine = empty_engine
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE things (id INTEGER PRIMARY KEY)")
+    metadata = MetaData()
+    Table("things", metadata, Column("id", Integer, primary_key=True), Column("size", Integer, nullable=False))
+
+    with pytest.raises(migrations.SchemaError):
+        migrations.upgrade(engine, metadata)
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import crud
+import models
+import order_archive
+
+
+@pytest.fixture
+def db(db):
+    old = datetime.utcnow() - timedelta(days=400)
+    for order_id, status, order_date in ((1, 'completed', old), (2, 'pending', old), (3, 'canceled', old),
+                                         (4, 'completed', datetime.utcnow())):
+        db.add(models.Order(id=order_id, buyer_id=1, order_date=order_date, status=status, total_amount=10,
+                            recipient_name="a", phone="1", address_line1="x"))
+        db.add(models.SoldProduct(seller_id=2, buyer_id=1, product_id=1, order_id=order_id,
+                                  sold_date=order_date, quantity=order_id))
+    db.commit()
+    return db
+
+
+def test_old_finished_orders_move_to_archive_in_batches(db):
+    assert order_archive.archive_orders(db, older_than_days=180, batch_size=1, pause=0) == 2
+
+    assert [order.id for order in db.query(models.Order).order_by(models.Order.id)] == [2, 4]
+    assert [order.id for order in db.query(models.ArchivedOrder).order_by(models.ArchivedOrder.id)] == [1, 3]
+    assert db.query(models.SoldProduct).count() == 2
+    assert db.query(models.ArchivedSoldProduct).count() == 2
+
+
+def test_reads_fall_back_to_archive(db):
+    order_archive.archive_orders(db, older_than_days=180, pause=0)
+
+    details = crud.get_order_details(db, 3)
+    assert details["status"] == 'canceled'
+    assert details["products"][0]["quantity"] == 3
+    orders = crud.get_user_orders(db, 1)
+    assert sorted(orders["buyer_orders"]) == [1, 2, 3, 4]
+    assert sorted(crud.get_user_orders(db, 2)["seller_orders"]) == [1, 2, 3, 4]
+
+
+def test_rebuilt_indexes_include_archived_orders(db):
+    from recommendations import CoPurchaseIndex
+    from suggest import PrefixIndex
+    from trending import TrendingTracker
+
+    db.add_all([models.Product(id=1, name="apple", price=1, stock=5),
+                models.Product(id=2, name="pear", price=1, stock=5)])
+    db.add(models.SoldProduct(seller_id=2, buyer_id=1, product_id=2, order_id=4, sold_date=datetime.utcnow(),
+                              quantity=1))
+    db.commit()
+    order_archive.archive_orders(db, older_than_days=0, pause=0)
+    assert db.query(models.SoldProduct).filter(models.SoldProduct.order_id == 4).count() == 0
+
+    index = CoPurchaseIndex()
+    index.rebuild(db)
+    assert index.related(1) == [(2, 1)]
+
+    tracker = TrendingTracker()
+    tracker.rebuild(db)
+    assert dict(tracker.top())[2] > 0
+
+    prefix_index = PrefixIndex()
+    prefix_index.rebuild(db)
+    weights = {item["id"]: item["weight"] for item in prefix_index.suggest("apple") if item["type"] == "product"}
+    assert weights[1] == 1 + 2 + 4  # 订单 1、4 已归档，订单 2 未完成仍在热表中，已取消的订单 3 不计入
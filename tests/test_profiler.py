@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import profiler
+
+
+def test_profile_collects_collapsed_stacks_of_busy_threads():
+    stop = threading.Event()
+
+    def spin():
+        while not stop.is_set():
+            sum(range(100))
+
+    thread = threading.Thread(target=spin, name="spinner")
+    thread.start()
+    try:
+        stacks = profiler.SamplingProfiler().profile(0.2, interval=0.005)
+    finally:
+        stop.set()
+        thread.join()
+
+    spinner = [stack for stack in stacks if stack.startswith("spinner;")]
+    assert spinner and spinner[0].split(";")[-1].startswith("spin (")
+    assert profiler.SamplingProfiler.collapse(stacks).splitlines()[0].rsplit(" ", 1)[1].isdigit()
+
+
+def test_only_one_profile_at_a_time():
+    sampler = profiler.SamplingProfiler()
+    thread = threading.Thread(target=sampler.profile, args=(0.3,))
+    thread.start()
+    time.sleep(0.05)
+    with pytest.raises(profiler.ProfilerBusy):
+        sampler.profile(0.1)
+    thread.join()
+
+
+def timing_app():
+    app = FastAPI()
+    app.add_middleware(profiler.ServerTimingMiddleware)
+
+    @app.get("/work")
+    def work():
+        with profiler.span("auth"):
+            time.sleep(0.01)
+        return {"ok": True}
+
+    return TestClient(app)
+
+
+def test_server_timing_is_added_only_when_requested(monkeypatch):
+    monkeypatch.setenv("DEBUG_TIMING", "1")
+    client = timing_app()
+    assert "server-timing" not in client.get("/work").headers
+    timing = client.get("/work", headers={"X-Debug-Timing": "1"}).headers["server-timing"]
+    assert timing.startswith("auth;dur=") and "total;dur=" in timing
+
+
+def test_server_timing_is_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("DEBUG_TIMING", raising=False)
+    client = timing_app()
+    assert "server-timing" not in client.get("/work", headers={"X-Debug-Timing": "1"}).headers
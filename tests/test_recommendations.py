@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import pytest
+
+import models
+from recommendations import CoPurchaseIndex
+
+SOLD_AT = datetime(2024, 5, 1, 12, 0)
+
+
+@pytest.fixture
+def make_session(db):
+    def make(orders):
+        """
+        :param orders: {order_id: (status, [product_id, ...])}
+        """
+        for order_id, (status, product_ids) in orders.items():
+            db.add(models.Order(id=order_id, buyer_id=7, order_date=SOLD_AT, status=status, total_amount=1,
+                                recipient_name="a", phone="1", address_line1="x"))
+            for product_id in product_ids:
+                db.add(models.SoldProduct(seller_id=3, buyer_id=7, product_id=product_id, order_id=order_id,
+                                          sold_date=SOLD_AT, quantity=1))
+        db.commit()
+        return db
+
+    return make
+
+
+def test_space_saving_replaces_least_frequent_neighbor():
+    index = CoPurchaseIndex(top_k=2, capacity=2)
+    index.add_order(1, [1, 2])
+    index.add_order(2, [1, 2])
+    index.add_order(3, [1, 3])
+    assert index.related(1) == [(2, 2), (3, 1)]
+
+    # 容量已满，新邻居替换计数最小的 3，并继承其计数
+    index.add_order(4, [1, 4])
+    index.add_order(5, [1, 2])
+    assert index.related(1) == [(2, 3), (4, 2)]
+    assert index.related(1, limit=1) == [(2, 3)]
+    assert index.related(4) == [(1, 1)]
+
+
+def test_rebuild_skips_canceled_orders(make_session):
+    db = make_session({1: ('completed', [1, 2]), 2: ('canceled', [1, 3]), 3: ('pending', [1, 2, 3])})
+    index = CoPurchaseIndex()
+    index.rebuild(db, chunk_size=2)
+    assert index.related(1) == [(2, 2), (3, 1)]
+    assert index.related(3) == [(2, 1), (1, 1)]
+
+
+def test_remove_order_decrements_and_drops_neighbors():
+    index = CoPurchaseIndex()
+    index.add_order(1, [1, 2])
+    index.add_order(2, [1, 2, 3])
+    index.remove_order(2, [1, 2, 3])
+    assert index.related(1) == [(2, 1)]
+    assert index.related(3) == []
+
+    # 已经不在候选中的邻居忽略
+    index.remove_order(3, [1, 4])
+    assert index.related(1) == [(2, 1)]
+
+
+def test_cancellations_during_rebuild_are_applied(make_session):
+    db = make_session({1: ('pending', [1, 2]), 2: ('pending', [1, 3])})
+    index = CoPurchaseIndex()
+    scan = index._scan
+
+    def scan_with_concurrent_orders(db, neighbors, sold_model, order_model, chunk_size):
+        last_order_id = scan(db, neighbors, sold_model, order_model, chunk_size)
+        if sold_model is models.SoldProduct:
+            # 订单 1 已被扫描到，之后取消
+            index.remove_order(1, [1, 2])
+            # 订单 3 在扫描结束后下单，随后取消
+            index.add_order(3, [1, 4])
+            index.add_order(4, [1, 5])
+            index.remove_order(3, [1, 4])
+        return last_order_id
+
+    index._scan = scan_with_concurrent_orders
+    index.rebuild(db)
+    assert index.related(1) == [(5, 1), (3, 1)]
+    assert index._pending is None
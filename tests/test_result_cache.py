@@ -0,0 +1,68 @@
+from result_cache import CardCache, ResultCache, normalize_keyword
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_keyword_is_normalized():
+    assert normalize_keyword("  Apple ") == "apple"
+    assert normalize_keyword("   ") is None
+    assert normalize_keyword(None) is None
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = ResultCache(clock=clock)
+    cache.put(("search", "apple"), [3, 1, 2], ttl=60)
+
+    assert cache.get(("search", "apple")) == (3, 1, 2)
+    clock.now = 61
+    assert cache.get(("search", "apple")) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_invalidate_by_tag():
+    cache = ResultCache()
+    cache.put(("search", "apple", 1), [1], ttl=60, tags=["category:1"])
+    cache.put(("search", "apple", None), [1, 2], ttl=60, tags=["search:all"])
+    cache.put(("seller", 7), [1, 2], ttl=60, tags=["seller:7"])
+
+    assert cache.invalidate(["category:1", "search:all"]) == 2
+    assert cache.get(("search", "apple", 1)) is None
+    assert cache.get(("search", "apple", None)) is None
+    assert cache.get(("seller", 7)) == (1, 2)
+
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    cache = ResultCache(max_bytes=10 ** 9)
+    cache.put("a", range(100), ttl=60)
+    cache.max_bytes = cache.stats()["bytes"] * 2 + 10
+    cache.put("b", range(100), ttl=60)
+    cache.get("a")
+    cache.put("c", range(100), ttl=60, tags=["t"])
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+
+def test_card_cache_reports_missing_ids():
+    clock = FakeClock()
+    cards = CardCache(max_entries=2, ttl=30, clock=clock)
+    cards.put_many({1: {"id": 1}, 2: {"id": 2}})
+    cards.put_many({3: {"id": 3}})
+
+    found, missing = cards.get_many([1, 2, 3])
+    assert found == {2: {"id": 2}, 3: {"id": 3}}
+    assert missing == [1]
+
+    cards.invalidate([2])
+    clock.now = 31
+    found, missing = cards.get_many([2, 3])
+    assert found == {} and missing == [2, 3]
@@ -0,0 +1,77 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+import models
+import sales_rollup
+
+SOLD_AT = datetime(2024, 5, 1, 12, 0)
+
+
+@pytest.fixture
+def db(db):
+    db.add(models.Product(id=11, name="apple", price=Decimal("3.50"), stock=10, seller_id=3))
+    db.add(models.Order(id=1, buyer_id=7, order_date=SOLD_AT, status='pending', total_amount=7,
+                        recipient_name="a", phone="1", address_line1="x"))
+    db.add(models.SoldProduct(seller_id=3, buyer_id=7, product_id=11, order_id=1, sold_date=SOLD_AT, quantity=2,
+                              unit_price=Decimal("3.50")))
+    db.commit()
+    return db
+
+
+def totals(db):
+    return [(row["units"], row["revenue"]) for row in sales_rollup.get_seller_sales(
+        db, 3, start=SOLD_AT.date(), end=SOLD_AT.date())]
+
+
+def test_replayed_order_jobs_are_applied_once(db):
+    sales = [(3, 11, SOLD_AT, 2, Decimal("3.50"))]
+    for _ in range(2):
+        sales_rollup.record_order_sales(db, 1, sales)
+        db.commit()
+    assert totals(db) == [(2, 7.0)]
+
+    for _ in range(2):
+        sales_rollup.revert_orders(db, [1])
+        db.commit()
+    assert totals(db) == [(0, 0.0)]
+
+
+def test_backfill_marks_orders_as_applied(db):
+    assert sales_rollup.backfill(db) == 1
+    # 回填之后才执行的下单任务不再重复累加
+    sales_rollup.record_order_sales(db, 1, [(3, 11, SOLD_AT, 2, Decimal("3.50"))])
+    db.commit()
+    assert totals(db) == [(2, 7.0)]
+
+
+def test_revert_uses_price_at_sale_time(db):
+    sales_rollup.record_order_sales(db, 1, [(3, 11, SOLD_AT, 2, Decimal("3.50"))])
+    db.commit()
+    db.get(models.Product, 11).price = Decimal("10.00")
+    db.commit()
+
+    sales_rollup.revert_orders(db, [1])
+    db.commit()
+    assert totals(db) == [(0, 0.0)]
+
+
+def test_backfill_skips_canceled_orders_and_keeps_sale_prices(db):
+    db.get(models.Product, 11).price = Decimal("10.00")
+    db.add(models.Order(id=2, buyer_id=7, order_date=SOLD_AT, status='canceled', total_amount=10,
+                        recipient_name="a", phone="1", address_line1="x"))
+    db.add(models.SoldProduct(seller_id=3, buyer_id=7, product_id=11, order_id=2, sold_date=SOLD_AT, quantity=1,
+                              unit_price=Decimal("10.00")))
+    # 记录成交单价之前的已售记录按当前价格计算
+    db.add(models.Order(id=3, buyer_id=7, order_date=SOLD_AT, status='completed', total_amount=10,
+                        recipient_name="a", phone="1", address_line1="x"))
+    db.add(models.SoldProduct(seller_id=3, buyer_id=7, product_id=11, order_id=3, sold_date=SOLD_AT, quantity=1))
+    db.commit()
+
+    assert sales_rollup.backfill(db, chunk_size=1) == 3
+    assert totals(db) == [(3, 17.0)]
+    # 已取消订单的扣减任务在回填后执行也不会再扣一次
+    sales_rollup.revert_orders(db, [2])
+    db.commit()
+    assert totals(db) == [(3, 17.0)]
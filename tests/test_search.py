@@ -0,0 +1,83 @@
+import pytest
+from sqlalchemy import inspect
+from sqlalchemy.orm import sessionmaker
+
+import circuit_breaker
+import crud
+import migrations
+import models
+import result_cache
+
+
+@pytest.fixture
+def db(empty_engine):
+    # 通过迁移建表，检查迁移创建的搜索索引
+    migrations.upgrade(empty_engine)
+    session = sessionmaker(bind=empty_engine)()
+    session.add_all([models.Category(id=1, name="fruit"), models.Category(id=2, name="tools")])
+    for product_id, name, price, stock, category_id in (
+            (1, "apple", 3, 10, 1), (2, "green apple", 60, 0, 1), (3, "apple peeler", 120, 5, 2),
+            (4, "pear", 8, 7, 1), (5, "apple press", 700, 1, 2)):
+        session.add(models.Product(id=product_id, name=name, price=price, stock=stock, category_id=category_id))
+    session.commit()
+    return session
+
+
+def ids(products):
+    return [product["id"] for product in products]
+
+
+def test_filters_and_sorts(db):
+    assert ids(crud.search_products(db, "APPLE ", sort="price_asc")) == [1, 2, 3, 5]
+    assert ids(crud.search_products(db, "apple", sort="price_desc", limit=2)) == [5, 3]
+    assert ids(crud.search_products(db, "apple", sort="newest", offset=1, limit=2)) == [3, 2]
+    assert ids(crud.search_products(db, "apple", category_id=1, sort="price_asc")) == [1, 2]
+    assert ids(crud.search_products(db, "apple", min_price=50, max_price=200, sort="price_asc")) == [2, 3]
+    assert ids(crud.search_products(db, "apple", in_stock=True, sort="price_asc")) == [1, 3, 5]
+
+
+def test_facets_ignore_their_own_filter(db):
+    facets = crud.get_search_facets(db, keyword="apple", category_id=1, min_price=0, max_price=100)
+
+    # 分类分面不受分类条件限制，但受价格条件限制
+    assert facets["categories"] == [{"category_id": 1, "name": "fruit", "count": 2}]
+    # 价格分面不受价格条件限制，但受分类条件限制
+    counts = {(bucket["min_price"], bucket["max_price"]): bucket["count"] for bucket in facets["price_ranges"]}
+    assert counts[(0, 50)] == 1 and counts[(50, 100)] == 1 and counts[(100, 200)] == 0
+    assert counts[(1000, None)] == 0
+
+
+def test_facets_are_cached_until_products_change(db):
+    facets = crud.get_search_facets(db, keyword=" Apple")
+    db.add(models.Product(id=6, name="apple pie", price=9, stock=1, category_id=1))
+    db.commit()
+    assert crud.get_search_facets(db, keyword="apple") == facets
+
+    result_cache.product_created(category_id=1, seller_id=None)
+    counts = {row["category_id"]: row["count"] for row in crud.get_search_facets(db, keyword="apple")["categories"]}
+    assert counts == {1: 3, 2: 2}
+
+
+def test_keyword_only_scans_skip_slow_call_accounting(db):
+    def long_running(query):
+        return query.get_execution_options().get(circuit_breaker.LONG_RUNNING, False)
+
+    products = db.query(models.Product)
+    assert long_running(crud._apply_conditions(products, crud._search_conditions("apple")))
+    assert long_running(crud._apply_conditions(products, crud._search_conditions("apple", in_stock=True)))
+    assert not long_running(crud._apply_conditions(products, crud._search_conditions("apple", category_id=1)))
+    assert not long_running(crud._apply_conditions(products, crud._search_conditions(category_id=1)))
+    # 分类分面不带分类条件，仍是全表扫描
+    assert long_running(crud._apply_conditions(products, crud._search_conditions("apple", category_id=1),
+                                               exclude="category"))
+
+
+def test_schema_upgrade_creates_search_indexes(db):
+    engine = db.get_bind()
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_products_category_price")
+        conn.exec_driver_sql("DROP INDEX ix_products_price")
+
+    migrations.upgrade(engine)
+    names = {index["name"] for index in inspect(engine).get_indexes("products")}
+    assert {"ix_products_category_price", "ix_products_price"} <= names
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_execution():
+    group = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def query(product_id):
+        calls.append(product_id)
+        release.wait(5)
+        return {"id": product_id}
+
+    tasks = [asyncio.create_task(group.do(("detail", 1), query, 1)) for _ in range(10)]
+    await asyncio.sleep(0.05)
+    release.set()
+    results = await asyncio.gather(*tasks)
+
+    assert calls == [1]
+    assert all(result == {"id": 1} for result in results)
+    stats = group.stats()
+    assert (stats["executed"], stats["collapsed"], stats["in_flight"]) == (1, 9, 0)
+    assert "keys" not in stats
+
+
+@pytest.mark.asyncio
+async def test_errors_are_shared_and_not_remembered():
+    group = SingleFlight()
+    release = threading.Event()
+
+    def broken():
+        release.wait(5)
+        raise RuntimeError("db down")
+
+    tasks = [asyncio.create_task(group.do("k", broken)) for _ in range(3)]
+    await asyncio.sleep(0.05)
+    release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+    assert await group.do("k", lambda: "ok") == "ok"
+
+
+@pytest.mark.asyncio
+async def test_stuck_leader_is_replaced_after_timeout():
+    group = SingleFlight(timeout=0.1)
+    stuck = threading.Event()
+    calls = []
+
+    def query():
+        calls.append(1)
+        if len(calls) == 1:
+            stuck.wait(5)
+            return "late"
+        return "fresh"
+
+    leader = asyncio.create_task(group.do("k", query))
+    await asyncio.sleep(0.02)
+    followers = await asyncio.gather(*[group.do("k", query) for _ in range(5)])
+
+    assert followers == ["fresh"] * 5
+    assert len(calls) == 2
+    assert group.stats()["timeouts"] == 5
+    stuck.set()
+    assert await leader == "late"
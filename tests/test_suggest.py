@@ -0,0 +1,115 @@
+from datetime import datetime
+
+import pytest
+
+import models
+from suggest import PrefixIndex, PRODUCT, CATEGORY
+
+
+def test_suggest_orders_by_weight_and_updates_incrementally():
+    index = PrefixIndex(scan_limit=1)  # 强制走前缀缓存
+    index.add(PRODUCT, 1, "Apple", 3)
+    index.add(PRODUCT, 2, "Apricot", 1)
+    index.add(CATEGORY, 1, "Appliances", 2)
+    index.add(PRODUCT, 3, "Banana", 9)
+
+    assert [item["name"] for item in index.suggest("ap")] == ["Apple", "Appliances", "Apricot"]
+
+    # 销量变化和新增商品需要反映到已缓存的结果中
+    index.add_weight(PRODUCT, 2, 5)
+    index.add(PRODUCT, 4, "  APPLE pie ", 4)
+    names = [item["name"] for item in index.suggest("AP", limit=3)]
+    assert names == ["Apricot", "  APPLE pie ", "Apple"]
+
+    assert index.suggest("x") == []
+    assert index.suggest("") == []
+
+
+def test_scan_and_cache_paths_rank_the_same():
+    names = ["Apple", "apple pie", "Apricot", "Avocado", "Banana", "Apple Juice"]
+    scanned, cached = PrefixIndex(), PrefixIndex(scan_limit=1)
+    for index in (scanned, cached):
+        for entity_id, name in enumerate(names, start=1):
+            index.add(PRODUCT, entity_id, name, entity_id % 3)
+        index.add(CATEGORY, 1, "Apple", 5)  # 与商品同名的分类
+
+    for prefix in ("a", "ap", "apple", "apple ", "b"):
+        assert scanned.suggest(prefix, limit=20) == cached.suggest(prefix, limit=20)
+    assert [(item["type"], item["id"]) for item in scanned.suggest("apple", limit=2)] == [
+        ("category", 1), ("product", 2)]
+
+
+def test_rename_and_weight_changes_update_cached_prefixes():
+    index = PrefixIndex(scan_limit=1)
+    index.add(PRODUCT, 1, "Apple", 3)
+    index.add(PRODUCT, 2, "Apricot", 1)
+    assert [item["id"] for item in index.suggest("ap")] == [1, 2]
+
+    # 改名后旧前缀下不再出现，保留原有权重
+    index.add(PRODUCT, 1, "Banana")
+    assert [item["id"] for item in index.suggest("ap")] == [2]
+    assert index.suggest("b") == [{"type": "product", "id": 1, "name": "Banana", "weight": 3}]
+
+    # 取消订单扣减权重，不会低于 0
+    index.add_weight(PRODUCT, 1, -2)
+    index.add_weight(PRODUCT, 2, -5)
+    assert [(item["id"], item["weight"]) for item in index.suggest("b") + index.suggest("a")] == [(1, 1), (2, 0)]
+    # 未知实体忽略
+    index.add_weight(PRODUCT, 99, 1)
+    assert len(index) == 2
+
+
+@pytest.fixture
+def make_catalog(db):
+    def make(orders):
+        """
+        :param orders: {order_id: (status, quantity)}，每个订单卖出商品 1
+        """
+        db.add(models.Category(id=1, name="Fruit"))
+        db.add_all([models.Product(id=1, name="Apple", price=1, stock=1, category_id=1),
+                    models.Product(id=2, name="Apricot", price=1, stock=1, category_id=1)])
+        for order_id, (status, quantity) in orders.items():
+            db.add(models.Order(id=order_id, buyer_id=7, order_date=datetime(2024, 5, 1), status=status,
+                                total_amount=1, recipient_name="a", phone="1", address_line1="x"))
+            db.add(models.SoldProduct(seller_id=3, buyer_id=7, product_id=1, order_id=order_id,
+                                      sold_date=datetime(2024, 5, 1), quantity=quantity))
+        db.commit()
+        return db
+
+    return make
+
+
+def weights(index, prefix):
+    return {(item["type"], item["id"]): item["weight"] for item in index.suggest(prefix, limit=20)}
+
+
+def test_rebuild_skips_canceled_orders_and_warms_single_characters(make_catalog):
+    index = PrefixIndex(scan_limit=1)
+    index.rebuild(make_catalog({1: ('completed', 2), 2: ('canceled', 5), 3: ('pending', 1)}))
+
+    assert set(index._head_top) == {"a"}  # "f" 只有一个条目，直接扫描
+    assert weights(index, "a") == {("product", 1): 3, ("product", 2): 0}
+    assert weights(index, "fr") == {("category", 1): 2}
+
+
+def test_updates_during_rebuild_are_replayed(make_catalog):
+    db = make_catalog({1: ('pending', 2), 2: ('pending', 4)})
+    index = PrefixIndex()
+    snapshot = index._sales_snapshot
+
+    def snapshot_with_concurrent_updates(db):
+        # 快照之前到达：订单 1 的销量已经包含在快照中
+        index.add_weight(PRODUCT, 1, 2, order_id=1)
+        sales = snapshot(db)
+        index.add(PRODUCT, 3, "Apple Pie")
+        index.add_weight(PRODUCT, 1, -4, order_id=2)  # 快照之后取消
+        index.add_weight(PRODUCT, 3, 7, order_id=3)  # 快照之后下单
+        index.add_weight(PRODUCT, 1, 5, order_id=4)
+        index.add_weight(PRODUCT, 1, -5, order_id=4)  # 快照之后下单又取消
+        return sales
+
+    index._sales_snapshot = snapshot_with_concurrent_updates
+    index.rebuild(db)
+
+    assert weights(index, "ap") == {("product", 1): 2, ("product", 2): 0, ("product", 3): 7}
+    assert index._pending is None
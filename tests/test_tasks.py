@@ -0,0 +1,96 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+import events
+import jobs
+import models
+import recommendations
+import suggest
+import tasks
+import trending
+
+
+@pytest.fixture
+def session_factory(session_factory, monkeypatch):
+    monkeypatch.setattr(tasks, "SessionLocal", session_factory)
+    return session_factory
+
+
+# 通过全局队列执行的测试，任务参数要经过 JSON 日志（conftest 中的新队列写到临时目录），和线上一致
+@pytest.mark.asyncio
+async def test_enqueue_product_created_indexes_product():
+    await jobs.queue.start()
+    tasks.enqueue_product_created(9001, "Durian Cake")
+    await jobs.queue.stop(drain=True, timeout=5)
+
+    assert jobs.queue.stats()["failed"] == 0
+    assert [item["id"] for item in suggest.index.suggest("durian c")] == [9001]
+
+
+def test_enqueue_product_created_runs_inline_without_queue():
+    assert not jobs.queue.running
+    tasks.enqueue_product_created(9002, "Jackfruit Chips")
+    assert [item["id"] for item in suggest.index.suggest("jackfruit")] == [9002]
+
+
+@pytest.mark.asyncio
+async def test_enqueue_order_created(session_factory):
+    db = session_factory()
+    sold_at = datetime(2024, 5, 1, 12, 0)
+    db.add(models.Order(id=1, buyer_id=7, order_date=sold_at, status='pending', total_amount=7,
+                        recipient_name="a", phone="1", address_line1="x"))
+    db.add(models.SoldProduct(seller_id=3, buyer_id=7, product_id=11, order_id=1, sold_date=sold_at, quantity=2))
+    db.commit()
+
+    await jobs.queue.start()
+    tasks.enqueue_order_created(1, sold_at, [(3, 11, 5, 2, Decimal("3.50"))])
+    await jobs.queue.stop(drain=True, timeout=5)
+
+    rollup = db.query(models.SellerSalesDaily).one()
+    assert (rollup.units, Decimal(str(rollup.revenue))) == (2, Decimal("7.00"))
+    assert [(event.type, event.data["status"]) for event in events.hub.replay(7, 0)] == [
+        ("order_created", "pending")]
+
+
+def test_order_status_event_carries_status_from_enqueue(session_factory):
+    db = session_factory()
+    db.add(models.Order(id=1, buyer_id=7, order_date=datetime(2024, 5, 1), status='completed', total_amount=7,
+                        recipient_name="a", phone="1", address_line1="x"))
+    db.commit()
+
+    # 任务执行前订单已经再次变更，推送的仍是入队时的状态
+    tasks.enqueue_order_status_changed([1], 'shipped')
+
+    assert [event.data["status"] for event in events.hub.replay(7, 0)] == ["shipped"]
+
+
+def test_canceled_orders_are_removed_from_in_memory_indexes(session_factory):
+    index = recommendations.index
+    tracker = trending.tracker
+    db = session_factory()
+    sold_at = datetime.utcnow().replace(microsecond=0)
+    for product_id in (11, 12):
+        db.add(models.Product(id=product_id, name="p", price=1, stock=1, seller_id=3, category_id=5))
+    for order_id in (1, 2):
+        db.add(models.Order(id=order_id, buyer_id=7, order_date=sold_at, status='canceled', total_amount=1,
+                            recipient_name="a", phone="1", address_line1="x"))
+        for product_id in (11, 12):
+            db.add(models.SoldProduct(seller_id=3, buyer_id=7, product_id=product_id, order_id=order_id,
+                                      sold_date=sold_at, quantity=order_id))
+        tasks.index_order(order_id, sold_at.isoformat(), [[3, 11, 5, order_id, "1"], [3, 12, 5, order_id, "1"]])
+    db.commit()
+
+    tasks.enqueue_order_status_changed([1], 'canceled')
+    assert index.related(11) == [(12, 1)]
+    assert dict(tracker.top(5, category_id=5)) == {11: trending.SALE_WEIGHT * 2, 12: trending.SALE_WEIGHT * 2}
+
+
+def test_record_order_sales_job_is_idempotent(session_factory):
+    # 重放日志时同一任务可能执行两次
+    for _ in range(2):
+        tasks.record_order_sales(order_id=1, sold_at="2024-05-01T12:00:00", items=[[3, 11, 5, 2, "3.50"]])
+
+    rollup = session_factory().query(models.SellerSalesDaily).one()
+    assert (rollup.units, Decimal(str(rollup.revenue))) == (2, Decimal("7.00"))
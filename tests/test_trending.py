@@ -0,0 +1,133 @@
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+import models
+from trending import SALE_WEIGHT, VIEW_WEIGHT, SlidingWindowCounter, TrendingTracker, sold_timestamp
+
+# 在窗口内的下单时间
+SOLD_AT = datetime.utcnow() - timedelta(hours=1)
+
+
+def test_sliding_window_expires_old_buckets():
+    now = [0.0]
+    counter = SlidingWindowCounter(window_seconds=300, bucket_seconds=60, clock=lambda: now[0])
+
+    counter.add("a", 1)
+    now[0] = 120
+    counter.add("b", 2)
+    counter.add("a", 1, at=30)  # 落在第一个分桶
+    assert counter.top(5) == [("a", 2), ("b", 2)]
+
+    # 第一个分桶滑出窗口
+    now[0] = 330
+    assert counter.top(5) == [("b", 2)]
+    assert counter.get("a") == 0
+
+    # 空闲超过整个窗口
+    now[0] = 10000
+    assert counter.top(5) == []
+
+
+def test_top_is_cached_until_ttl_or_eviction():
+    now = [0.0]
+    counter = SlidingWindowCounter(window_seconds=300, bucket_seconds=60, clock=lambda: now[0], top_cache_seconds=5)
+
+    counter.add("a", 1)
+    assert counter.top(5) == [("a", 1)]
+    # 新增计数不会立即使缓存失效
+    counter.add("b", 3)
+    assert counter.top(5) == [("a", 1)]
+    now[0] = 6
+    assert counter.top(5) == [("b", 3), ("a", 1)]
+
+    # 分桶滑出窗口时立即失效
+    now[0] = 100
+    counter.add("c", 1)
+    assert counter.top(5) == [("b", 3), ("a", 1), ("c", 1)]
+    now[0] = 301
+    assert counter.top(5) == [("c", 1)]
+
+
+def test_top_cache_is_kept_per_limit():
+    now = [0.0]
+    counter = SlidingWindowCounter(window_seconds=300, bucket_seconds=60, clock=lambda: now[0])
+    counter.add("a", 2)
+    counter.add("b", 1)
+    assert counter.top(1) == [("a", 2)]
+    assert counter.top(2) == [("a", 2), ("b", 1)]
+
+    counter.add("b", 5)
+    assert counter.top(1) == [("a", 2)]
+    assert counter.top(2) == [("a", 2), ("b", 1)]
+
+
+def test_negative_amount_removes_counts():
+    now = [120.0]
+    counter = SlidingWindowCounter(window_seconds=300, bucket_seconds=60, clock=lambda: now[0], top_cache_seconds=0)
+    counter.add("a", 3, at=30)
+    counter.add("b", 1)
+    counter.add("a", -3, at=30)
+    assert counter.top(5) == [("b", 1)]
+    assert counter.get("a") == 0
+
+    # 已经滑出窗口的计数不再扣减
+    now[0] = 330
+    counter.add("b", -1, at=30)
+    assert counter.top(5) == [("b", 1)]
+
+
+@pytest.fixture
+def make_sales(db):
+    def make(orders):
+        """
+        :param orders: {order_id: (status, quantity)}，每个订单卖出一件商品 11
+        """
+        db.add(models.Product(id=11, name="apple", price=Decimal("3.50"), stock=10, seller_id=3, category_id=5))
+        for order_id, (status, quantity) in orders.items():
+            db.add(models.Order(id=order_id, buyer_id=7, order_date=SOLD_AT, status=status, total_amount=1,
+                                recipient_name="a", phone="1", address_line1="x"))
+            db.add(models.SoldProduct(seller_id=3, buyer_id=7, product_id=11, order_id=order_id, sold_date=SOLD_AT,
+                                      quantity=quantity))
+        db.commit()
+        return db
+
+    return make
+
+
+def test_rebuild_skips_canceled_orders(make_sales):
+    tracker = TrendingTracker()
+    tracker.rebuild(make_sales({1: ('pending', 2), 2: ('canceled', 3), 3: ('completed', 1)}))
+    assert tracker.top(5) == [(11, SALE_WEIGHT * 3)]
+
+    tracker.remove_sale(11, 5, 1, sold_timestamp(SOLD_AT), 3)
+    assert tracker.top(5, category_id=5) == [(11, SALE_WEIGHT * 2)]
+
+
+def test_rebuild_applies_events_recorded_during_scan(make_sales):
+    db = make_sales({1: ('pending', 2), 2: ('pending', 4)})
+    tracker = TrendingTracker()
+    scan = tracker._scan
+    at = sold_timestamp(SOLD_AT)
+
+    def scan_with_concurrent_events(*args):
+        last_order_id = scan(*args)
+        tracker.record_sale(11, 5, 2, at=at, order_id=1)  # 扫描已经读到，不能重复计入
+        tracker.remove_sale(11, 5, 4, at, 2)  # 扫描读到后取消，需要扣减
+        tracker.record_sale(11, 5, 1, at=at, order_id=3)
+        tracker.record_sale(11, 5, 5, at=at, order_id=4)
+        tracker.remove_sale(11, 5, 5, at, 4)  # 扫描后下单又取消
+        tracker.record_view(11, 5, at=time.time())
+        return last_order_id
+
+    tracker._scan = scan_with_concurrent_events
+    tracker.rebuild(db)
+
+    expected = SALE_WEIGHT * 3 + VIEW_WEIGHT
+    assert tracker.top(5) == [(11, expected)]
+    assert tracker.top(5, category_id=5) == [(11, expected)]
+    # 重建完成后不再缓存事件
+    tracker.record_view(11, 5)
+    assert tracker._pending is None
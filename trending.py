@@ -0,0 +1,282 @@
+"""
+热门商品排行：按分钟分桶的滑动窗口计数器
+
+下单（销量）和浏览商品详情（浏览量）时增量累加到内存中的环形分桶里，过期的分桶在
+时间推进时整体扣减，每个商品的窗口内总分始终是最新的。排行榜用堆取前 N 名，
+结果按 limit 最多复用 TOP_CACHE_SECONDS 秒（有分桶滑出窗口时立即失效），不需要每次请求都去聚合
+sold_products，也不会因为每次浏览都重新排序。已取消订单的销量不计入：重建时跳过，取消时扣减。
+"""
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.orm import Session
+
+import models
+
+# 一次购买和一次浏览对热度的贡献
+SALE_WEIGHT = 5.0
+VIEW_WEIGHT = 1.0
+
+# 排行榜结果的缓存时间（秒）
+TOP_CACHE_SECONDS = 5
+
+
+def sold_timestamp(sold_date: datetime) -> float:
+    """
+    sold_date 是不带时区的 UTC 时间
+    """
+    return sold_date.replace(tzinfo=timezone.utc).timestamp()
+
+
+class SlidingWindowCounter:
+    def __init__(self, window_seconds: int = 24 * 3600, bucket_seconds: int = 60, clock=time.time,
+                 top_cache_seconds: float = TOP_CACHE_SECONDS):
+        """
+        :param window_seconds: 窗口长度，默认 24 小时
+        :param bucket_seconds: 分桶粒度，默认 1 分钟
+        :param clock: 返回当前 Unix 时间戳的函数，便于测试
+        :param top_cache_seconds: 排行榜结果的缓存时间，期间新增的计数不会立即反映到排行榜
+        """
+        self.bucket_seconds = bucket_seconds
+        self.top_cache_seconds = top_cache_seconds
+        self.size = max(1, window_seconds // bucket_seconds)
+        self.clock = clock
+        self._slots = [None] * self.size  # 每个分桶：key -> 计数
+        self._slot_index = [-1] * self.size  # 分桶当前对应的时间序号
+        self._oldest = None  # 窗口内最早的分桶序号
+        self._totals = {}  # key -> 窗口内总计数
+        self._version = 0  # 只在分桶滑出窗口时变化，新增计数依靠缓存过期
+        self._top_cache = {}  # limit -> (version, 过期时间, 结果)，limit 由接口限制在 1~100
+        self._lock = threading.Lock()
+
+    def _evict(self, index: int):
+        pos = index % self.size
+        if self._slot_index[pos] != index or self._slots[pos] is None:
+            return
+        for key, amount in self._slots[pos].items():
+            remaining = self._totals.get(key, 0) - amount
+            if remaining > 1e-9:
+                self._totals[key] = remaining
+            else:
+                self._totals.pop(key, None)
+        self._slots[pos] = None
+        self._slot_index[pos] = -1
+        self._version += 1
+
+    def _advance(self, now_index: int):
+        floor = now_index - self.size + 1
+        if self._oldest is None:
+            self._oldest = floor
+            return
+        if floor <= self._oldest:
+            return
+        if floor - self._oldest >= self.size:
+            # 空闲超过整个窗口，直接清空
+            self._slots = [None] * self.size
+            self._slot_index = [-1] * self.size
+            self._totals = {}
+            self._version += 1
+        else:
+            for index in range(self._oldest, floor):
+                self._evict(index)
+        self._oldest = floor
+
+    def add(self, key, amount: float = 1.0, at: float = None):
+        """
+        累加计数
+        :param amount: 可以为负数，用于撤销之前累加的计数
+        :param at: 事件发生的 Unix 时间戳，默认当前时间；超出窗口的事件会被忽略
+        """
+        with self._lock:
+            now_index = int(self.clock() // self.bucket_seconds)
+            self._advance(now_index)
+            index = now_index if at is None else int(at // self.bucket_seconds)
+            if index < self._oldest or index > now_index:
+                return
+            pos = index % self.size
+            if self._slot_index[pos] != index:
+                self._slots[pos] = {}
+                self._slot_index[pos] = index
+            slot = self._slots[pos]
+            remaining = slot.get(key, 0) + amount
+            if remaining > 1e-9:
+                slot[key] = remaining
+            else:
+                slot.pop(key, None)
+            total = self._totals.get(key, 0) + amount
+            if total > 1e-9:
+                self._totals[key] = total
+            else:
+                self._totals.pop(key, None)
+
+    def get(self, key) -> float:
+        with self._lock:
+            self._advance(int(self.clock() // self.bucket_seconds))
+            return self._totals.get(key, 0)
+
+    def top(self, limit: int = 10):
+        """
+        返回窗口内计数最高的 limit 个 (key, 计数)
+        """
+        with self._lock:
+            now = self.clock()
+            self._advance(int(now // self.bucket_seconds))
+            cached = self._top_cache.get(limit)
+            if cached and cached[0] == self._version and cached[1] > now:
+                return cached[2]
+            result = heapq.nlargest(limit, self._totals.items(), key=lambda item: item[1])
+            self._top_cache[limit] = (self._version, now + self.top_cache_seconds, result)
+            return result
+
+
+class TrendingTracker:
+    def __init__(self, window_seconds: int = 24 * 3600, bucket_seconds: int = 60, clock=time.time):
+        self._window_seconds = window_seconds
+        self._bucket_seconds = bucket_seconds
+        self._clock = clock
+        self._all = self._new_counter()
+        self._by_category = {}  # category_id -> SlidingWindowCounter
+        self._pending = None  # 重建期间到达的事件，切换到新计数器后补录
+        self._scanned_order_id = 0  # 重建时 sold_products 已经扫描到的订单 ID
+        self._lock = threading.Lock()
+
+    def _new_counter(self):
+        return SlidingWindowCounter(self._window_seconds, self._bucket_seconds, self._clock)
+
+    def _counter_in(self, by_category: dict, category_id: int):
+        counter = by_category.get(category_id)
+        if counter is None:
+            counter = by_category[category_id] = self._new_counter()
+        return counter
+
+    def _category_counter(self, category_id: int):
+        with self._lock:
+            return self._counter_in(self._by_category, category_id)
+
+    def _record(self, product_id: int, category_id: int, amount: float, at: float = None, order_id: int = None):
+        with self._lock:
+            if self._pending is not None:
+                # 固定事件时间，补录时落在原来的分桶；扣减只对扫描已经读到的订单补录，还没读到的扫描时会跳过
+                scanned = amount < 0 and order_id <= self._scanned_order_id
+                self._pending.append((product_id, category_id, amount, self._clock() if at is None else at, order_id,
+                                      scanned))
+        self._all.add(product_id, amount, at)
+        if category_id is not None:
+            self._category_counter(category_id).add(product_id, amount, at)
+
+    def record_sale(self, product_id: int, category_id: int, quantity: int = 1, at: float = None,
+                    order_id: int = None):
+        """
+        :param order_id: 所属订单，重建期间据此判断这笔销量是否已经被扫描到
+        """
+        self._record(product_id, category_id, SALE_WEIGHT * quantity, at, order_id)
+
+    def remove_sale(self, product_id: int, category_id: int, quantity: int, at: float, order_id: int):
+        """
+        订单取消后扣减销量，参数与下单时 record_sale 的一致
+        """
+        self._record(product_id, category_id, -SALE_WEIGHT * quantity, at, order_id)
+
+    def record_view(self, product_id: int, category_id: int, at: float = None):
+        self._record(product_id, category_id, VIEW_WEIGHT, at)
+
+    def top(self, limit: int = 10, category_id: int = None):
+        """
+        返回热度最高的商品 (product_id, 热度) 列表，可按分类筛选
+        """
+        if category_id is None:
+            return self._all.top(limit)
+        counter = self._by_category.get(category_id)
+        return counter.top(limit) if counter else []
+
+    def rebuild(self, db: Session, chunk_size: int = 5000):
+        """
+        从 sold_products 及其归档表恢复窗口内的销量计数（浏览量不落库，重启后从零开始）
+        """
+        since = datetime.utcnow() - timedelta(seconds=self._window_seconds)
+        all_counter = self._new_counter()
+        by_category = {}
+        with self._lock:
+            self._pending = []
+            self._scanned_order_id = 0
+        try:
+            last_order_id = self._scan(db, all_counter, by_category, since, chunk_size)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            # 补录重建期间的浏览量、扫描时还没读到的订单的销量，以及这些订单和已扫描订单的取消
+            for product_id, category_id, amount, at, order_id, scanned in self._pending:
+                if order_id is not None and order_id <= last_order_id and not scanned:
+                    continue
+                all_counter.add(product_id, amount, at)
+                if category_id is not None:
+                    self._counter_in(by_category, category_id).add(product_id, amount, at)
+            self._pending = None
+            self._all = all_counter
+            self._by_category = by_category
+
+    def _scan(self, db: Session, all_counter, by_category, since, chunk_size: int) -> int:
+        """
+        :return: 扫描到的最大订单 ID
+        """
+        last_order_id = 0
+        # 归档天数小于窗口长度时，窗口内的订单也可能已经归档
+        for sold_model, order_model in ((models.ArchivedSoldProduct, models.ArchivedOrder),
+                                        (models.SoldProduct, models.Order)):
+            last_id = 0
+            while True:
+                rows = (
+                    db.query(
+                        sold_model.id,
+                        sold_model.order_id,
+                        sold_model.product_id,
+                        models.Product.category_id,
+                        sold_model.sold_date,
+                        sold_model.quantity,
+                    )
+                    .join(models.Product, models.Product.id == sold_model.product_id)
+                    .join(order_model, order_model.id == sold_model.order_id)
+                    .filter(sold_model.id > last_id, sold_model.sold_date >= since, order_model.status != 'canceled')
+                    .order_by(sold_model.id)
+                    .limit(chunk_size)
+                    .all()
+                )
+                if not rows:
+                    break
+                for _, order_id, product_id, category_id, sold_date, quantity in rows:
+                    last_order_id = max(last_order_id, order_id or 0)
+                    at = sold_timestamp(sold_date)
+                    amount = SALE_WEIGHT * quantity
+                    all_counter.add(product_id, amount, at)
+                    if category_id is not None:
+                        self._counter_in(by_category, category_id).add(product_id, amount, at)
+                last_id = rows[-1][0]
+                if sold_model is models.SoldProduct:
+                    with self._lock:
+                        self._scanned_order_id = last_order_id
+        return last_order_id
+
+
+# 全局热门商品统计
+tracker = TrendingTracker()
+
+
+def rebuild_in_background(session_factory):
+    """
+    在后台线程中从数据库恢复计数，避免阻塞服务启动
+    """
+    def run():
+        db = session_factory()
+        try:
+            tracker.rebuild(db)
+        finally:
+            db.close()
+
+    thread = threading.Thread(target=run, name="trending-rebuild", daemon=True)
+    thread.start()
+    return thread